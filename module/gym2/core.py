@@ -32,6 +32,9 @@ class Env(object):
     metadata = {'render.modes': []}
     reward_range = (-float('inf'), float('inf'))
     spec = None
+    # Set to True if step() and reset() always return a newly allocated observation,
+    # so that agents can skip copying it.
+    fresh_observations = False
 
     # Set these in ALL subclasses
     action_space = None
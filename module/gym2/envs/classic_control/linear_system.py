@@ -7,6 +7,7 @@ from os import path
 import sys
 sys.path.append('../../../')
 from rl2.barrier_certificate import h, set_alpha
+from rl2.integration import QuadraticIntervalCost
 
 
 class LinearEnv(gym2.Env):
@@ -14,6 +15,8 @@ class LinearEnv(gym2.Env):
         'render.modes': ['human', 'rgb_array'],
         'video.frames_per_second': 30
     }
+    # _get_obs builds a new array on every call.
+    fresh_observations = True
 
     def __init__(self):
         """
@@ -22,7 +25,8 @@ class LinearEnv(gym2.Env):
         self.A = np.array([[-1, 4], [2, -3]])
         self.B = np.array([2, 4])
         self.D = np.array([.6, .3])
-
+        # `QuadraticIntervalCost` per (alpha, ln) for `step_interval`
+        self.interval_costs = {}
 
         self.seed()
 
@@ -45,7 +49,28 @@ class LinearEnv(gym2.Env):
         x_prime += ln * np.dot(self.D, np.sqrt(dt) * np.random.randn(2))
         x_prime = np.clip(x_prime, -7, 7)
 
-        self.state = np.array(x_prime)
+        self.state = x_prime
+        return self._get_obs(), -costs, False, {}
+
+    def step_interval(self, u, tau, ln=1, alpha=0.):
+        """Holds `u` for `tau` in one call, integrating the plant and the cost exactly.
+
+        Unlike a loop over `step`, the plant is discretized exactly (zero-order hold) and the
+        reward is `-int_0^tau exp(-alpha t) (.1|x|^2 + .01u^2) dt` in expectation over the
+        noise, i.e. already the integral that the sub-step rewards times `dt` approximate.
+        """
+        key = (alpha, ln)
+        if key not in self.interval_costs:
+            noise = ln * np.sqrt(np.dot(self.D, self.D)) * np.ones(2)
+            self.interval_costs[key] = QuadraticIntervalCost(self.A, self.B, .1, .01, alpha=alpha, G=noise)
+        interval_cost = self.interval_costs[key]
+
+        x = np.asarray(self.state, dtype=np.float64)[None]
+        u = np.reshape(u, (1,))
+        self.last_u = u[0]  # for rendering
+        costs = interval_cost.cost(x, u, tau)[0]
+        x_prime = interval_cost.transition(x, u, tau, random_state=np.random if ln else None)[0]
+        self.state = np.clip(x_prime, -7, 7)
         return self._get_obs(), -costs, False, {}
 
     # modify to change start position
@@ -16,6 +16,8 @@ class PendulumEnv2(gym2.Env):
         'render.modes': ['human', 'rgb_array'],
         'video.frames_per_second': 30
     }
+    # _get_obs builds a new array on every call.
+    fresh_observations = True
 
     def __init__(self, g=10.0):
         self.max_speed = 2*np.pi
@@ -6,6 +6,9 @@ from __future__ import print_function
 
 import six
 import copy
+import fnmatch
+
+import numpy as np
 from six.moves import zip
 
 from . import backend as K
@@ -692,6 +695,187 @@ class Nadam(Optimizer):
         return dict(list(base_config.items()) + list(config.items()))
 
 
+class GroupedAdam(Optimizer):
+    """Adam optimizer with named parameter groups.
+
+    Every group has its own learning rate, learning rate decay or schedule
+    and gradient norm clipping, but all groups are updated by one Adam step:
+    the gradients of all parameters are concatenated into a single vector,
+    the moment estimates are kept in one flat slot variable each and the
+    per-group hyperparameters are broadcast onto that vector by group index.
+
+    # Arguments
+        groups: list of dicts, one per group, with the keys
+            - name: string, used by `get_lr` and `set_lr`.
+            - layers: list of layer names or glob patterns such as
+                `'tau_*'`. A variable belongs to the group if one of its
+                name scopes (e.g. `dense_3` in `dense_3/kernel:0`) matches.
+            - params: list of variables that belong to the group.
+            - lr: float >= 0. Learning rate of the group.
+            - decay: float >= 0. Learning rate decay over each update.
+            - schedule: function `(lr, iterations) -> lr` mapping the
+                learning rate variable and the iteration counter to the
+                learning rate tensor of the group.
+            - clipnorm: float >= 0. The gradients of the group are clipped
+                when their joint L2 norm exceeds this value.
+            A group without `layers` and `params` takes every variable
+            that no earlier group claims. A variable belongs to the first
+            group that matches it.
+        beta_1: float, 0 < beta < 1. Generally close to 1.
+        beta_2: float, 0 < beta < 1. Generally close to 1.
+        epsilon: float >= 0. Fuzz factor. If `None`, defaults to `K.epsilon()`.
+        amsgrad: boolean. Whether to apply the AMSGrad variant.
+
+    After `get_updates`, `gradients` holds the gradient tensors of the
+    update before group clipping, in the order of `params`, so that they
+    can be monitored without building the backward pass a second time.
+    """
+
+    def __init__(self, groups, beta_1=0.9, beta_2=0.999,
+                 epsilon=None, amsgrad=False, **kwargs):
+        super(GroupedAdam, self).__init__(**kwargs)
+        if not groups:
+            raise ValueError('`GroupedAdam` needs at least one group.')
+        names = [group.get('name') for group in groups]
+        if None in names or len(set(names)) != len(names):
+            raise ValueError('Every group needs a unique name, got ' +
+                             str(names))
+        self.groups = [dict(group) for group in groups]
+        with K.name_scope(self.__class__.__name__):
+            self.iterations = K.variable(0, dtype='int64', name='iterations')
+            self.lrs = [K.variable(group.get('lr', 0.001), name='lr_' + name)
+                        for group, name in zip(self.groups, names)]
+            self.beta_1 = K.variable(beta_1, name='beta_1')
+            self.beta_2 = K.variable(beta_2, name='beta_2')
+        if epsilon is None:
+            epsilon = K.epsilon()
+        self.epsilon = epsilon
+        self.amsgrad = amsgrad
+
+    def _group_index(self, param):
+        scopes = param.name.split(':')[0].split('/')[:-1]
+        for i, group in enumerate(self.groups):
+            params = group.get('params')
+            patterns = group.get('layers')
+            if params is None and patterns is None:
+                return i
+            if params is not None and any(param is p for p in params):
+                return i
+            if patterns is not None and any(fnmatch.fnmatchcase(scope, pattern)
+                                            for scope in scopes
+                                            for pattern in patterns):
+                return i
+        raise ValueError('Variable ' + param.name + ' does not belong to any '
+                         'parameter group. Add a group without `layers` and '
+                         '`params` to collect the remaining variables.')
+
+    def _group_lr(self, i):
+        group = self.groups[i]
+        lr = self.lrs[i]
+        if group.get('decay', 0.) > 0:
+            lr = lr * (1. / (1. + group['decay'] * K.cast(self.iterations,
+                                                          K.floatx())))
+        if group.get('schedule') is not None:
+            lr = group['schedule'](lr, self.iterations)
+        return lr
+
+    def get_lr(self, name):
+        """Returns the current base learning rate of the group `name`."""
+        return float(K.get_value(self.lrs[self._names().index(name)]))
+
+    def set_lr(self, name, lr):
+        """Sets the base learning rate of the group `name`."""
+        K.set_value(self.lrs[self._names().index(name)], lr)
+
+    def _names(self):
+        return [group['name'] for group in self.groups]
+
+    @interfaces.legacy_get_updates_support
+    def get_updates(self, loss, params):
+        # Order the variables by group so that every group is a contiguous
+        # segment of the flat vectors.
+        group_of = [self._group_index(p) for p in params]
+        order = sorted(range(len(params)), key=lambda i: group_of[i])
+        params = [params[i] for i in order]
+        group_of = [group_of[i] for i in order]
+        grads = self.get_gradients(loss, params)
+        self.gradients = [None] * len(grads)
+        for i, grad in zip(order, grads):
+            self.gradients[i] = grad
+        self.updates = [K.update_add(self.iterations, 1)]
+        if not params:
+            self.weights = [self.iterations]
+            return self.updates
+
+        shapes = [K.int_shape(p) for p in params]
+        sizes = [int(np.prod(shape)) for shape in shapes]
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        segments = np.repeat(group_of, sizes)
+        g = K.concatenate([K.reshape(grad, (-1,)) for grad in grads], axis=0)
+
+        t = K.cast(self.iterations, K.floatx()) + 1
+        correction = (K.sqrt(1. - K.pow(self.beta_2, t)) /
+                      (1. - K.pow(self.beta_1, t)))
+        lr_ts = []
+        scales = []
+        for i, group in enumerate(self.groups):
+            lr_ts.append(self._group_lr(i) * correction)
+            members = [j for j, k in enumerate(group_of) if k == i]
+            clipnorm = group.get('clipnorm', 0.)
+            if members and clipnorm > 0:
+                g_group = g[int(offsets[members[0]]):int(offsets[members[-1] + 1])]
+                norm = K.sqrt(K.sum(K.square(g_group)))
+                scales.append(clipnorm / K.maximum(norm, clipnorm))
+            else:
+                scales.append(K.constant(1.))
+        index = K.constant(segments, dtype='int32')
+        lr_t = K.gather(K.stack(lr_ts), index)
+        g = g * K.gather(K.stack(scales), index)
+
+        total = int(offsets[-1])
+        m = K.zeros((total,))
+        v = K.zeros((total,))
+        vhat = K.zeros((total,) if self.amsgrad else (1,))
+        self.weights = [self.iterations, m, v, vhat]
+
+        m_t = (self.beta_1 * m) + (1. - self.beta_1) * g
+        v_t = (self.beta_2 * v) + (1. - self.beta_2) * K.square(g)
+        if self.amsgrad:
+            vhat_t = K.maximum(vhat, v_t)
+            step = lr_t * m_t / (K.sqrt(vhat_t) + self.epsilon)
+            self.updates.append(K.update(vhat, vhat_t))
+        else:
+            step = lr_t * m_t / (K.sqrt(v_t) + self.epsilon)
+        self.updates.append(K.update(m, m_t))
+        self.updates.append(K.update(v, v_t))
+
+        for p, shape, start, end in zip(params, shapes, offsets[:-1], offsets[1:]):
+            new_p = p - K.reshape(step[int(start):int(end)], shape)
+
+            # Apply constraints.
+            if getattr(p, 'constraint', None) is not None:
+                new_p = p.constraint(new_p)
+
+            self.updates.append(K.update(p, new_p))
+        return self.updates
+
+    def get_config(self):
+        groups = []
+        for group, lr in zip(self.groups, self.lrs):
+            # Variables and schedules are not serializable.
+            config = {key: value for key, value in group.items()
+                      if key not in ('params', 'schedule')}
+            config['lr'] = float(K.get_value(lr))
+            groups.append(config)
+        config = {'groups': groups,
+                  'beta_1': float(K.get_value(self.beta_1)),
+                  'beta_2': float(K.get_value(self.beta_2)),
+                  'epsilon': self.epsilon,
+                  'amsgrad': self.amsgrad}
+        base_config = super(GroupedAdam, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
 class TFOptimizer(Optimizer):
     """Wrapper class for native TensorFlow optimizers.
     """
@@ -730,6 +914,7 @@ adadelta = Adadelta
 adam = Adam
 adamax = Adamax
 nadam = Nadam
+grouped_adam = GroupedAdam
 
 
 def serialize(optimizer):
@@ -757,6 +942,7 @@ def deserialize(config, custom_objects=None):
         'adam': Adam,
         'adamax': Adamax,
         'nadam': Nadam,
+        'groupedadam': GroupedAdam,
         'tfoptimizer': TFOptimizer,
     }
     # Make deserialization case-insensitive for built-in optimizers.
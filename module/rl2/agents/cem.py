@@ -1,6 +1,7 @@
 from __future__ import division
 from collections import deque
 from copy import deepcopy
+import multiprocessing
 
 import numpy as np
 import keras.backend as K
@@ -9,6 +10,112 @@ from keras.models import Model
 from rl.core import Agent
 from rl.util import *
 
+
+def _softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+_ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0.),
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1. / (1. + np.exp(-x)),
+    'softmax': _softmax,
+}
+
+
+def _numpy_spec(model):
+    """Describes `model` as a list of `(kind, activation, use_bias)` for `_numpy_forward`.
+
+    Only `Flatten`, `Dense` and `Activation` layers are supported.
+    """
+    spec = []
+    for layer in model.layers:
+        name = layer.__class__.__name__
+        if name == 'InputLayer':
+            continue
+        elif name == 'Flatten':
+            spec.append(('flatten', None, False))
+        elif name == 'Dense':
+            config = layer.get_config()
+            spec.append(('dense', config['activation'], config['use_bias']))
+        elif name == 'Activation':
+            spec.append(('activation', layer.get_config()['activation'], False))
+        else:
+            raise ValueError('Layer "{}" of type {} is not supported by the NumPy forward pass.'.format(layer.name, name))
+        if spec[-1][1] is not None and spec[-1][1] not in _ACTIVATIONS:
+            raise ValueError('Activation "{}" is not supported by the NumPy forward pass.'.format(spec[-1][1]))
+    return spec
+
+
+def _numpy_forward(spec, weights, batch):
+    x = batch
+    pos = 0
+    for kind, activation, use_bias in spec:
+        if kind == 'flatten':
+            x = x.reshape(x.shape[0], -1)
+            continue
+        if kind == 'dense':
+            x = np.dot(x, weights[pos])
+            pos += 1
+            if use_bias:
+                x = x + weights[pos]
+                pos += 1
+        x = _ACTIVATIONS[activation](x)
+    return x
+
+
+# State of a worker process, set once by `_init_worker`.
+_worker = {}
+
+
+def _init_worker(env_fn, spec, shapes, sizes, nb_actions, processor, window_length, nb_max_episode_steps):
+    _worker.update(env=env_fn(), spec=spec, shapes=shapes, sizes=sizes, nb_actions=nb_actions,
+                   processor=processor, window_length=window_length,
+                   nb_max_episode_steps=nb_max_episode_steps)
+
+
+def _evaluate(task):
+    """Runs one episode with the flat weight vector `task[0]`, returns the total reward and its length."""
+    weights_flat, seed = task
+    w = _worker
+    weights = []
+    pos = 0
+    for shape, size in zip(w['shapes'], w['sizes']):
+        weights.append(weights_flat[pos:pos+size].reshape(shape))
+        pos += size
+
+    np.random.seed(seed)
+    env = w['env']
+    if hasattr(env, 'seed'):
+        env.seed(seed)
+    processor = w['processor']
+    observation = env.reset()
+    if processor is not None:
+        observation = processor.process_observation(observation)
+    recent = deque([observation] * w['window_length'], maxlen=w['window_length'])
+    total_reward = 0.
+    episode_step = 0
+    while True:
+        batch = np.array([list(recent)])
+        if processor is not None:
+            batch = processor.process_state_batch(batch)
+        output = _numpy_forward(w['spec'], weights, batch).flatten()
+        # Same stochastic action selection as `CEMAgent.select_action` during training.
+        action = np.random.choice(np.arange(w['nb_actions']), p=np.exp(output) / np.sum(np.exp(output)))
+        if processor is not None:
+            action = processor.process_action(action)
+        observation, reward, done, info = env.step(action)
+        if processor is not None:
+            observation, reward, done, info = processor.process_step(observation, reward, done, info)
+        recent.append(observation)
+        total_reward += reward
+        episode_step += 1
+        if done or (w['nb_max_episode_steps'] and episode_step >= w['nb_max_episode_steps']):
+            return total_reward, episode_step
+
+
 class CEMAgent(Agent):
     """Write me
     """
@@ -131,8 +238,10 @@ class CEMAgent(Agent):
     def backward(self, reward, terminal):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -145,26 +254,104 @@ class CEMAgent(Agent):
             self.memory.finalize_episode(params)
 
             if self.step > self.nb_steps_warmup and self.episode % self.train_interval == 0:
-                params, reward_totals = self.memory.sample(self.batch_size)
-                best_idx = np.argsort(np.array(reward_totals))[-self.num_best:]
-                best = np.vstack([params[i] for i in best_idx])
-
-                if reward_totals[best_idx[-1]] > self.best_seen[0]:
-                    self.best_seen = (reward_totals[best_idx[-1]], params[best_idx[-1]])
-                    
-                metrics = [np.mean(np.array(reward_totals)[best_idx])]
-                if self.processor is not None:
-                    metrics += self.processor.metrics
-                min_std = self.noise_ampl * np.exp(-self.step * self.noise_decay_const)
-                
-                mean = np.mean(best, axis=0)
-                std = np.std(best, axis=0) + min_std
-                new_theta = np.hstack((mean, std))
-                self.update_theta(new_theta)
+                metrics = self.update_elite()
             self.choose_weights()
             self.episode += 1
         return metrics
 
+    def update_elite(self):
+        """Refits `theta` to the elite of a batch sampled from memory and returns the metrics."""
+        params, reward_totals = self.memory.sample(self.batch_size)
+        best_idx = np.argsort(np.array(reward_totals))[-self.num_best:]
+        best = np.vstack([params[i] for i in best_idx])
+
+        if reward_totals[best_idx[-1]] > self.best_seen[0]:
+            self.best_seen = (reward_totals[best_idx[-1]], params[best_idx[-1]])
+
+        metrics = [np.mean(np.array(reward_totals)[best_idx])]
+        if self.processor is not None:
+            metrics += self.processor.metrics
+        min_std = self.noise_ampl * np.exp(-self.step * self.noise_decay_const)
+
+        mean = np.mean(best, axis=0)
+        std = np.std(best, axis=0) + min_std
+        new_theta = np.hstack((mean, std))
+        self.update_theta(new_theta)
+        return metrics
+
+    def sample_population(self, population_size):
+        """Draws `population_size` flat weight vectors from `theta`."""
+        mean = self.theta[:self.num_weights]
+        std = self.theta[self.num_weights:]
+        return std * np.random.randn(population_size, self.num_weights) + mean
+
+    def fit_parallel(self, env_fn, nb_generations, population_size=None, nb_workers=None,
+                     nb_max_episode_steps=None, verbose=1):
+        """Trains the agent generation by generation, evaluating each population concurrently.
+
+        Every generation draws `population_size` weight vectors from `theta`, runs one episode
+        per vector in a pool of worker processes using a NumPy forward pass of `model`, stores
+        all episodes in the `EpisodeParameterMemory` and then refits `theta` once to the elite.
+
+        # Arguments
+            env_fn (callable): Picklable function without arguments that creates the environment.
+                Every worker creates its own environment with it.
+            nb_generations (integer): Number of generations to evaluate.
+            population_size (integer): Episodes per generation. Defaults to `batch_size`.
+            nb_workers (integer): Number of worker processes. Defaults to the number of CPUs.
+                With 1, the population is evaluated in this process.
+            nb_max_episode_steps (integer): Number of steps after which an episode is ended.
+
+        # Returns
+            Dict with the mean and elite mean reward of every generation.
+        """
+        if not self.compiled:
+            raise RuntimeError('Your tried to fit your agent but it hasn\'t been compiled yet. Please call `compile()` before `fit()`.')
+        population_size = self.batch_size if population_size is None else population_size
+        nb_workers = multiprocessing.cpu_count() if nb_workers is None else nb_workers
+        initargs = (env_fn, _numpy_spec(self.model), self.shapes, self.sizes, self.nb_actions,
+                    self.processor, self.memory.window_length, nb_max_episode_steps)
+
+        self.training = True
+        self.step = 0
+        pool = None
+        if nb_workers > 1:
+            pool = multiprocessing.Pool(nb_workers, initializer=_init_worker, initargs=initargs)
+        else:
+            _init_worker(*initargs)
+        history = {'mean_reward': [], 'mean_best_reward': []}
+        try:
+            for generation in range(nb_generations):
+                population = self.sample_population(population_size)
+                seeds = np.random.randint(2**31 - 1, size=population_size)
+                tasks = list(zip(population, seeds))
+                if pool is not None:
+                    chunksize = max(1, population_size // (4 * nb_workers))
+                    results = pool.map(_evaluate, tasks, chunksize=chunksize)
+                else:
+                    results = [_evaluate(task) for task in tasks]
+                rewards, episode_steps = [list(r) for r in zip(*results)]
+
+                self.memory.append_episodes(list(population), rewards)
+                self.episode += population_size
+                # As in `fit`, the noise floor of `update_elite` decays with the env steps taken.
+                self.step += int(np.sum(episode_steps))
+                metrics = self.update_elite()
+                history['mean_reward'].append(np.mean(rewards))
+                history['mean_best_reward'].append(metrics[0])
+                if verbose > 0:
+                    print('generation {}/{}: mean reward {:.3f}, mean best reward {:.3f}'.format(
+                        generation + 1, nb_generations, np.mean(rewards), metrics[0]))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        self.training = False
+        self._on_train_end()
+        return history
+
     def _on_train_end(self):
         self.model.set_weights(self.get_weights_list(self.best_seen[1]))
 
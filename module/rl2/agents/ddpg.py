@@ -8,6 +8,7 @@ import keras2.backend as K
 import keras2.optimizers as optimizers
 
 from rl2.core import Agent
+from rl2.prefetch import sample_batch
 from rl2.random import OrnsteinUhlenbeckProcess
 from rl2.util import *
 
@@ -231,8 +232,10 @@ class DDPGAgent(Agent):
     def backward(self, reward, terminal=False):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -243,34 +246,14 @@ class DDPGAgent(Agent):
         # Train the network on a single stochastic batch.
         can_train_either = self.step > self.nb_steps_warmup_critic or self.step > self.nb_steps_warmup_actor
         if can_train_either and self.step % self.train_interval == 0:
-            experiences = self.memory.sample(self.batch_size)
-            assert len(experiences) == self.batch_size
-
-            # Start by extracting the necessary parameters (we use a vectorized implementation).
-            state0_batch = []
-            reward_batch = []
-            action_batch = []
-            terminal1_batch = []
-            state1_batch = []
-            for e in experiences:
-                state0_batch.append(e.state0)
-                state1_batch.append(e.state1)
-                reward_batch.append(e.reward)
-                action_batch.append(e.action)
-                terminal1_batch.append(0. if e.terminal1 else 1.)
-
-            # Prepare and validate parameters.
-            state0_batch = self.process_state_batch(state0_batch)
-            state1_batch = self.process_state_batch(state1_batch)
-            terminal1_batch = np.array(terminal1_batch)
-            reward_batch = np.array(reward_batch)
-            action_batch = np.array(action_batch)
+            state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch = sample_batch(self)
             assert reward_batch.shape == (self.batch_size,)
             assert terminal1_batch.shape == reward_batch.shape
             assert action_batch.shape == (self.batch_size, self.nb_actions)
 
             # Update critic, if warm up is over.
             if self.step > self.nb_steps_warmup_critic:
+                start = self.timer.start()
                 target_actions = self.target_actor.predict_on_batch(state1_batch)
                 assert target_actions.shape == (self.batch_size, self.nb_actions)
                 if len(self.critic.inputs) >= 3:
@@ -279,6 +262,7 @@ class DDPGAgent(Agent):
                     state1_batch_with_action = [state1_batch]
                 state1_batch_with_action.insert(self.critic_action_input_idx, target_actions)
                 target_q_values = self.target_critic.predict_on_batch(state1_batch_with_action).flatten()
+                self.timer.stop('critic.target', start)
                 assert target_q_values.shape == (self.batch_size,)
 
                 # Compute r_t + gamma * max_a Q(s_t+1, a) and update the target ys accordingly,
@@ -294,7 +278,9 @@ class DDPGAgent(Agent):
                 else:
                     state0_batch_with_action = [state0_batch]
                 state0_batch_with_action.insert(self.critic_action_input_idx, action_batch)
+                start = self.timer.start()
                 metrics = self.critic.train_on_batch(state0_batch_with_action, targets)
+                self.timer.stop('critic.train', start)
                 if self.processor is not None:
                     metrics += self.processor.metrics
 
@@ -307,11 +293,15 @@ class DDPGAgent(Agent):
                     inputs = [state0_batch]
                 if self.uses_learning_phase:
                     inputs += [self.training]
+                start = self.timer.start()
                 action_values = self.actor_train_fn(inputs)[0]
+                self.timer.stop('actor.train', start)
                 assert action_values.shape == (self.batch_size, self.nb_actions)
 
         if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            start = self.timer.start()
             self.update_target_models_hard()
+            self.timer.stop('target_update', start)
 
         return metrics
 
@@ -419,8 +409,10 @@ class DDPGAgent2(DDPGAgent):
     def backward(self, reward, terminal=False):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -433,35 +425,14 @@ class DDPGAgent2(DDPGAgent):
         if can_train_either and self.step % self.train_interval == 0:
             # Make a mini-batch to learn. So batch learning is done in every time steps.
             #This is based on the paper.
-            experiences = self.memory.sample(self.batch_size)
-            assert len(experiences) == self.batch_size
-
-            # Start by extracting the necessary parameters (we use a vectorized implementation).
-            state0_batch = [] # current_state
-            reward_batch = [] # current_reward
-            action_batch = [] # current_action
-            terminal1_batch = []
-            state1_batch = [] # next_state
-            for e in experiences:
-                state0_batch.append(e.state0)
-                state1_batch.append(e.state1)
-                reward_batch.append(e.reward)
-                action_batch.append(e.action)
-                terminal1_batch.append(0. if e.terminal1 else 1.)
-
-            # Prepare and validate parameters.
-            # Change batch class from list to np.ndarray
-            state0_batch = self.process_state_batch(state0_batch)
-            state1_batch = self.process_state_batch(state1_batch)
-            terminal1_batch = np.array(terminal1_batch)
-            reward_batch = np.array(reward_batch)
-            action_batch = np.array(action_batch)
+            state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch = sample_batch(self)
             assert reward_batch.shape == (self.batch_size,)
             assert terminal1_batch.shape == reward_batch.shape
             assert action_batch.shape == (self.batch_size, self.nb_actions), (action_batch.shape, (self.batch_size, self.nb_actions))
 
             # Update critic, if warm up is over.
             if self.step > self.nb_steps_warmup_critic:
+                start = self.timer.start()
                 target_actions = self.target_actor.predict_on_batch(state1_batch)
                 assert target_actions.shape == (self.batch_size, self.nb_actions)
                 if len(self.critic.inputs) >= 3:
@@ -470,6 +441,7 @@ class DDPGAgent2(DDPGAgent):
                     state1_batch_with_action = [state1_batch]
                 state1_batch_with_action.insert(self.critic_action_input_idx, target_actions)
                 target_q_values = self.target_critic.predict_on_batch(state1_batch_with_action).flatten()
+                self.timer.stop('critic.target', start)
                 assert target_q_values.shape == (self.batch_size,)
 
                 # Compute r_t + gamma * max_a Q(s_t+1, a) and update the target ys accordingly,
@@ -486,7 +458,9 @@ class DDPGAgent2(DDPGAgent):
                     state0_batch_with_action = [state0_batch]
                 state0_batch_with_action.insert(self.critic_action_input_idx, action_batch)
                 # state0_batch_with_action is input, targets is teacher
+                start = self.timer.start()
                 metrics = self.critic.train_on_batch(state0_batch_with_action, targets)
+                self.timer.stop('critic.train', start)
                 if self.processor is not None:
                     metrics += self.processor.metrics
 
@@ -500,7 +474,9 @@ class DDPGAgent2(DDPGAgent):
                 if self.uses_learning_phase:
                     inputs += [self.training]
                 self.inputs = inputs
+                start = self.timer.start()
                 action_values = self.actor_train_fn(inputs)[0] # actor update with critics loss
+                self.timer.stop('actor.train', start)
                 assert action_values.shape == (self.batch_size, self.nb_actions)
                 
                 current_gradient = self._get_current_gradient(inputs)
@@ -508,7 +484,9 @@ class DDPGAgent2(DDPGAgent):
                 self.gradient_log.append(norm)
 
         if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            start = self.timer.start()
             self.update_target_models_hard()
+            self.timer.stop('target_update', start)
         
         return metrics
 
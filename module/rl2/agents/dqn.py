@@ -240,8 +240,10 @@ class DQNAgent(AbstractDQNAgent):
     def backward(self, reward, terminal):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -251,7 +253,9 @@ class DQNAgent(AbstractDQNAgent):
 
         # Train the network on a single stochastic batch.
         if self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+            start = self.timer.start()
             experiences = self.memory.sample(self.batch_size)
+            self.timer.stop('memory.sample', start)
             assert len(experiences) == self.batch_size
 
             # Start by extracting the necessary parameters (we use a vectorized implementation).
@@ -389,127 +393,60 @@ class NAFLayer(Layer):
         a = x[2]
 
         if self.mode == 'full':
-            # Create L and L^T matrix, which we use to construct the positive-definite matrix P.
-            L = None
-            LT = None
+            # Number of elements in a triangular matrix.
+            nb_elems = (self.nb_actions * self.nb_actions + self.nb_actions) // 2
+            rows, cols = np.tril_indices(self.nb_actions)
+            diag = np.diag_indices(self.nb_actions)
+
+            # Build L for the whole batch at once: scatter L_flat into the lower triangle of a
+            # (batch, nb_actions, nb_actions) tensor and exponentiate the diagonal so that
+            # P = L * L^T is positive-definite.
             if K.backend() == 'theano':
                 import theano.tensor as T
-                import theano
-
-                def fn(x, L_acc, LT_acc):
-                    x_ = K.zeros((self.nb_actions, self.nb_actions))
-                    x_ = T.set_subtensor(x_[np.tril_indices(self.nb_actions)], x)
-                    diag = K.exp(T.diag(x_)) + K.epsilon()
-                    x_ = T.set_subtensor(x_[np.diag_indices(self.nb_actions)], diag)
-                    return x_, x_.T
-
-                outputs_info = [
-                    K.zeros((self.nb_actions, self.nb_actions)),
-                    K.zeros((self.nb_actions, self.nb_actions)),
-                ]
-                results, _ = theano.scan(fn=fn, sequences=L_flat, outputs_info=outputs_info)
-                L, LT = results
+
+                nb_rows = L_flat.shape[0]
+                L = T.zeros((nb_rows, self.nb_actions, self.nb_actions))
+                L = T.set_subtensor(L[:, rows, cols], L_flat)
+                L = T.set_subtensor(L[:, diag[0], diag[1]], K.exp(L[:, diag[0], diag[1]]) + K.epsilon())
             elif K.backend() == 'tensorflow':
                 import tensorflow as tf
 
-                # Number of elements in a triangular matrix.
-                nb_elems = (self.nb_actions * self.nb_actions + self.nb_actions) // 2
-
-                # Create mask for the diagonal elements in L_flat. This is used to exponentiate
-                # only the diagonal elements, which is done before gathering.
-                diag_indeces = [0]
-                for row in range(1, self.nb_actions):
-                    diag_indeces.append(diag_indeces[-1] + (row + 1))
-                diag_mask = np.zeros(1 + nb_elems)  # +1 for the leading zero
-                diag_mask[np.array(diag_indeces) + 1] = 1
+                # Mask of the diagonal elements in L_flat, with a leading zero for the padding
+                # element added below.
+                diag_mask = np.zeros(1 + nb_elems)
+                diag_mask[1 + np.where(rows == cols)[0]] = 1
                 diag_mask = K.variable(diag_mask)
 
                 # Add leading zero element to each element in the L_flat. We use this zero
                 # element when gathering L_flat into a lower triangular matrix L.
                 nb_rows = tf.shape(L_flat)[0]
-                zeros = tf.expand_dims(tf.tile(K.zeros((1,)), [nb_rows]), 1)
-                try:
-                    # Old TF behavior.
-                    L_flat = tf.concat(1, [zeros, L_flat])
-                except (TypeError, ValueError):
-                    # New TF behavior
-                    L_flat = tf.concat([zeros, L_flat], 1)
-
-                # Create mask that can be used to gather elements from L_flat and put them
-                # into a lower triangular matrix.
+                zeros = tf.zeros(tf.stack([nb_rows, 1]), dtype=L_flat.dtype)
+                L_flat = tf.concat([zeros, L_flat], 1)
+                L_flat = (K.exp(L_flat) + K.epsilon()) * diag_mask + L_flat * (1. - diag_mask)
+
+                # Indices into the padded L_flat for every entry of L; 0 selects the zero element.
                 tril_mask = np.zeros((self.nb_actions, self.nb_actions), dtype='int32')
-                tril_mask[np.tril_indices(self.nb_actions)] = range(1, nb_elems + 1)
-
-                # Finally, process each element of the batch.
-                init = [
-                    K.zeros((self.nb_actions, self.nb_actions)),
-                    K.zeros((self.nb_actions, self.nb_actions)),
-                ]
-
-                def fn(a, x):
-                    # Exponentiate everything. This is much easier than only exponentiating
-                    # the diagonal elements, and, usually, the action space is relatively low.
-                    x_ = K.exp(x) + K.epsilon()
-                    # Only keep the diagonal elements.
-                    x_ *= diag_mask
-                    # Add the original, non-diagonal elements.
-                    x_ += x * (1. - diag_mask)
-                    # Finally, gather everything into a lower triangular matrix.
-                    L_ = tf.gather(x_, tril_mask)
-                    return [L_, tf.transpose(L_)]
-
-                tmp = tf.scan(fn, L_flat, initializer=init)
-                if isinstance(tmp, (list, tuple)):
-                    # TensorFlow 0.10 now returns a tuple of tensors.
-                    L, LT = tmp
-                else:
-                    # Old TensorFlow < 0.10 returns a shared tensor.
-                    L = tmp[:, 0, :, :]
-                    LT = tmp[:, 1, :, :]
+                tril_mask[rows, cols] = range(1, nb_elems + 1)
+
+                # Gather along the element axis for all samples: (n, n, batch) -> (batch, n, n).
+                L = tf.transpose(tf.gather(tf.transpose(L_flat), tril_mask), perm=[2, 0, 1])
             else:
                 raise RuntimeError('Unknown Keras backend "{}".'.format(K.backend()))
-            assert L is not None
-            assert LT is not None
+            LT = K.permute_dimensions(L, (0, 2, 1))
             P = K.batch_dot(L, LT)
         elif self.mode == 'diag':
+            diag = np.diag_indices(self.nb_actions)
             if K.backend() == 'theano':
                 import theano.tensor as T
-                import theano
-
-                def fn(x, P_acc):
-                    x_ = K.zeros((self.nb_actions, self.nb_actions))
-                    x_ = T.set_subtensor(x_[np.diag_indices(self.nb_actions)], x)
-                    return x_
 
-                outputs_info = [
-                    K.zeros((self.nb_actions, self.nb_actions)),
-                ]
-                P, _ = theano.scan(fn=fn, sequences=L_flat, outputs_info=outputs_info)
+                nb_rows = L_flat.shape[0]
+                P = T.zeros((nb_rows, self.nb_actions, self.nb_actions))
+                P = T.set_subtensor(P[:, diag[0], diag[1]], L_flat)
             elif K.backend() == 'tensorflow':
                 import tensorflow as tf
 
-                # Create mask that can be used to gather elements from L_flat and put them
-                # into a diagonal matrix.
-                diag_mask = np.zeros((self.nb_actions, self.nb_actions), dtype='int32')
-                diag_mask[np.diag_indices(self.nb_actions)] = range(1, self.nb_actions + 1)
-
-                # Add leading zero element to each element in the L_flat. We use this zero
-                # element when gathering L_flat into a lower triangular matrix L.
-                nb_rows = tf.shape(L_flat)[0]
-                zeros = tf.expand_dims(tf.tile(K.zeros((1,)), [nb_rows]), 1)
-                try:
-                    # Old TF behavior.
-                    L_flat = tf.concat(1, [zeros, L_flat])
-                except (TypeError, ValueError):
-                    # New TF behavior
-                    L_flat = tf.concat([zeros, L_flat], 1)
-
-                # Finally, process each element of the batch.
-                def fn(a, x):
-                    x_ = tf.gather(x, diag_mask)
-                    return x_
-
-                P = tf.scan(fn, L_flat, initializer=K.zeros((self.nb_actions, self.nb_actions)))
+                # Scatter L_flat onto the diagonal for the whole batch.
+                P = tf.matrix_diag(L_flat)
             else:
                 raise RuntimeError('Unknown Keras backend "{}".'.format(K.backend()))
         assert P is not None
@@ -656,8 +593,10 @@ class NAFAgent(AbstractDQNAgent):
     def backward(self, reward, terminal):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -667,7 +606,9 @@ class NAFAgent(AbstractDQNAgent):
 
         # Train the network on a single stochastic batch.
         if self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+            start = self.timer.start()
             experiences = self.memory.sample(self.batch_size)
+            self.timer.stop('memory.sample', start)
             assert len(experiences) == self.batch_size
 
             # Start by extracting the necessary parameters (we use a vectorized implementation).
@@ -8,6 +8,8 @@ import keras2.backend as K
 import keras2.optimizers as optimizers
 
 from ..safecore import Agent
+from rl2.layers import CBFProjection, append_cbf_projection
+from rl2.prefetch import sample_batch
 from rl2.random import OrnsteinUhlenbeckProcess
 from rl2.util import *
 
@@ -20,11 +22,18 @@ def mean_q(y_true, y_pred):
 # http://citeseerx.ist.psu.edu/viewdoc/download?doi=10.1.1.646.4324&rep=rep1&type=pdf
 class safeDDPGAgent(Agent):
     """Write me
+
+    # Arguments
+        cbf_projection (boolean): If `True`, the actor acts through `rl2.layers.CBFProjection`
+            and its policy gradient is taken through the projection, so the critic is evaluated
+            at the input that the safety filter would apply. The target actor is projected the
+            same way. Exploration noise is added after the projection, hence the NumPy filter
+            of the fit loop still checks every input.
     """
     def __init__(self, nb_actions, actor, critic, critic_action_input, memory, input_clipper=10.,
                  gamma=.99, batch_size=32, nb_steps_warmup_critic=1000, nb_steps_warmup_actor=1000,
                  train_interval=1, memory_interval=1, delta_range=None, delta_clip=np.inf,
-                 random_process=None, custom_model_objects={}, target_model_update=.001,clip_com=0.1, **kwargs):
+                 random_process=None, custom_model_objects={}, target_model_update=.001,clip_com=0.1, cbf_projection=False, **kwargs):
         if hasattr(actor.output, '__len__') and len(actor.output) > 1:
             raise ValueError('Actor "{}" has more than one output. DDPG expects an actor that has a single output.'.format(actor))
         if hasattr(critic.output, '__len__') and len(critic.output) > 1:
@@ -51,7 +60,7 @@ class safeDDPGAgent(Agent):
             delta_clip = delta_range[1]
 
         if random_process == 'OrnsteinUhlenbeckProcess':
-            random_process = OrnsteinUhlenbeckProcess(1., size=3)
+            random_process = OrnsteinUhlenbeckProcess(1., size=nb_actions)
         elif random_process is None:
             pass
         else:
@@ -72,6 +81,7 @@ class safeDDPGAgent(Agent):
         self.memory_interval = memory_interval
         self.custom_model_objects = custom_model_objects
         self.clip_com = clip_com
+        self.cbf_projection = cbf_projection
 
         # Related objects.
         self.actor = actor
@@ -118,6 +128,13 @@ class safeDDPGAgent(Agent):
         self.target_actor.compile(optimizer='sgd', loss='mse')
         self.target_critic = clone_model(self.critic, self.custom_model_objects)
         self.target_critic.compile(optimizer='sgd', loss='mse')
+        if self.cbf_projection:
+            # Models sharing the weights of the actors, with the safe input as first action column.
+            self.safe_actor = append_cbf_projection(self.actor, clipper=self.input_clipper)
+            self.safe_target_actor = append_cbf_projection(self.target_actor, clipper=self.input_clipper)
+        else:
+            self.safe_actor = self.actor
+            self.safe_target_actor = self.target_actor
 
         # We also compile the actor. We never optimize the actor using Keras but instead compute
         # the policy gradient ourselves. However, we need the actor in feed-forward mode, hence
@@ -141,7 +158,10 @@ class safeDDPGAgent(Agent):
             else:
                 combined_inputs.append(i)
                 state_inputs.append(i)
-        combined_inputs[self.critic_action_input_idx] = self.actor(state_inputs)
+        combined_action = self.actor(state_inputs)
+        if self.cbf_projection:
+            combined_action = CBFProjection(clipper=self.input_clipper)([state_inputs[0], combined_action])
+        combined_inputs[self.critic_action_input_idx] = combined_action
 
         combined_output = self.critic(combined_inputs)
 
@@ -204,7 +224,7 @@ class safeDDPGAgent(Agent):
 
     def select_action(self, state):
         batch = self.process_state_batch([state])
-        action = self.actor.predict_on_batch(batch).flatten()
+        action = self.safe_actor.predict_on_batch(batch).flatten()
 
         # Apply noise, if a random process is set.
         if self.training and self.random_process is not None:
@@ -241,8 +261,10 @@ class safeDDPGAgent(Agent):
     def backward(self, reward, terminal=False):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -255,36 +277,15 @@ class safeDDPGAgent(Agent):
         if can_train_either and self.step % self.train_interval == 0:
             # Make a mini-batch to learn. So batch learning is done in every time steps.
             #This is based on the paper.
-            experiences = self.memory.sample(self.batch_size)
-            assert len(experiences) == self.batch_size
-
-            # Start by extracting the necessary parameters (we use a vectorized implementation).
-            state0_batch = [] # current_state
-            reward_batch = [] # current_reward
-            action_batch = [] # current_action
-            terminal1_batch = []
-            state1_batch = [] # next_state
-            for e in experiences:
-                state0_batch.append(e.state0)
-                state1_batch.append(e.state1)
-                reward_batch.append(e.reward)
-                action_batch.append(e.action)
-                terminal1_batch.append(0. if e.terminal1 else 1.)
-
-            # Prepare and validate parameters.
-            # Change batch class from list to np.ndarray
-            state0_batch = self.process_state_batch(state0_batch)
-            state1_batch = self.process_state_batch(state1_batch)
-            terminal1_batch = np.array(terminal1_batch)
-            reward_batch = np.array(reward_batch)
-            action_batch = np.array(action_batch)
+            state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch = sample_batch(self)
             assert reward_batch.shape == (self.batch_size,)
             assert terminal1_batch.shape == reward_batch.shape
             assert action_batch.shape == (self.batch_size, self.nb_actions), (action_batch.shape, (self.batch_size, self.nb_actions))
 
             # Update critic, if warm up is over.
             if self.step > self.nb_steps_warmup_critic:
-                target_actions = self.target_actor.predict_on_batch(state1_batch)
+                start = self.timer.start()
+                target_actions = self.safe_target_actor.predict_on_batch(state1_batch)
                 assert target_actions.shape == (self.batch_size, self.nb_actions)
                 if len(self.critic.inputs) >= 3:
                     state1_batch_with_action = state1_batch[:]
@@ -292,6 +293,7 @@ class safeDDPGAgent(Agent):
                     state1_batch_with_action = [state1_batch]
                 state1_batch_with_action.insert(self.critic_action_input_idx, target_actions)
                 target_q_values = self.target_critic.predict_on_batch(state1_batch_with_action).flatten()
+                self.timer.stop('critic.target', start)
                 assert target_q_values.shape == (self.batch_size,)
 
                 # Compute r_t + gamma * max_a Q(s_t+1, a) and update the target ys accordingly,
@@ -308,7 +310,9 @@ class safeDDPGAgent(Agent):
                     state0_batch_with_action = [state0_batch]
                 state0_batch_with_action.insert(self.critic_action_input_idx, action_batch)
                 # state0_batch_with_action is input, targets is teacher
+                start = self.timer.start()
                 metrics = self.critic.train_on_batch(state0_batch_with_action, targets)
+                self.timer.stop('critic.train', start)
                 if self.processor is not None:
                     metrics += self.processor.metrics
 
@@ -322,13 +326,17 @@ class safeDDPGAgent(Agent):
                     inputs = [state0_batch]
                 if self.uses_learning_phase:
                     inputs += [self.training]
+                start = self.timer.start()
                 action_values = self.actor_train_fn(inputs)[0] # actor update with critics loss
+                self.timer.stop('actor.train', start)
                 assert action_values.shape == (self.batch_size, self.nb_actions)
             actor_outputlayer_diff = tmp - self.actor.layers[4].get_weights()[0]
             diff_mean = np.mean(np.abs(actor_outputlayer_diff), axis=0)
             self.outputlayer_param_mean.append(diff_mean)
 
         if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            start = self.timer.start()
             self.update_target_models_hard()
+            self.timer.stop('target_update', start)
 
         return metrics
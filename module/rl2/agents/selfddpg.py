@@ -8,7 +8,8 @@ import keras2.backend as K
 import keras2.optimizers as optimizers
 
 from ..selfcore import self_Agent, sample_Agent
-from rl2.random import OrnsteinUhlenbeckProcess
+from rl2.prefetch import sample_batch
+from rl2.random import NoiseBank, OrnsteinUhlenbeckProcess
 from rl2.util import *
 
 
@@ -100,7 +101,7 @@ class selfDDPGAgent(self_Agent):
             delta_clip = delta_range[1]
 
         if random_process == 'OrnsteinUhlenbeckProcess':
-            random_process = OrnsteinUhlenbeckProcess(1., size=3)
+            random_process = OrnsteinUhlenbeckProcess(1., size=nb_actions)
         elif random_process is None:
             pass
         else:
@@ -114,6 +115,8 @@ class selfDDPGAgent(self_Agent):
         self.nb_steps_warmup_actor = nb_steps_warmup_actor
         self.nb_steps_warmup_critic = nb_steps_warmup_critic
         self.random_process = random_process
+        # Unit Gaussian noise for `_add_gaussian`, drawn in blocks instead of twice per step.
+        self.gaussian_noise = NoiseBank(1, 2)
         self.mb_noise = mb_noise
         self.coef_u = coef_u
         self.coef_tau = coef_tau
@@ -283,18 +286,16 @@ class selfDDPGAgent(self_Agent):
 
 
     def _add_gaussian(self, actor_output, coef_u, coef_tau):
-        action, tau = actor_output
-        action += np.random.randn() * coef_u
-        tau += np.random.randn() * coef_tau
-        return np.array([action, tau])
+        return actor_output + self.gaussian_noise.sample()[0] * [coef_u, coef_tau]
 
 
-    def select_action(self, state):
-        batch = self.process_state_batch([state])
+    def select_action(self, state_batch):
+        # `state_batch` holds the single state of `memory.get_recent_state_batch`.
+        batch = self.process_state_batch(state_batch)
         action = self.actor.predict_on_batch(batch).flatten()
         if self.training:
             if self.mb_noise:
-                action = self._add_mb_noise(state, action)
+                action = self._add_mb_noise(state_batch[0], action)
             else:
                 action = self._add_gaussian(action, self.coef_u, self.coef_tau)
         
@@ -308,9 +309,9 @@ class selfDDPGAgent(self_Agent):
 
     def forward(self, observation):
         # Select an action.
-        state = self.memory.get_recent_state(observation)
+        state_batch = self.memory.get_recent_state_batch(observation)
         #TODO: change the law of selecting action
-        action = self.select_action(state)
+        action = self.select_action(state_batch)
         #clip
         action = action.clip(min=np.array([self.action_clipper[0], self.tau_clipper[0]]),\
                              max=np.array([self.action_clipper[1], self.tau_clipper[1]]))
@@ -335,8 +336,10 @@ class selfDDPGAgent(self_Agent):
     def backward(self, reward, terminal=False):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -349,35 +352,14 @@ class selfDDPGAgent(self_Agent):
         if can_train_either and self.step % self.train_interval == 0:
             # Make a mini-batch to learn. So batch learning is done in every time steps.
             #This is based on the paper.
-            experiences = self.memory.sample(self.batch_size)
-            assert len(experiences) == self.batch_size
-
-            # Start by extracting the necessary parameters (we use a vectorized implementation).
-            state0_batch = [] # current_state
-            reward_batch = [] # current_reward
-            action_batch = [] # current_action
-            terminal1_batch = []
-            state1_batch = [] # next_state
-            for e in experiences:
-                state0_batch.append(e.state0)
-                state1_batch.append(e.state1)
-                reward_batch.append(e.reward)
-                action_batch.append(e.action)
-                terminal1_batch.append(0. if e.terminal1 else 1.)
-
-            # Prepare and validate parameters.
-            # Change batch class from list to np.ndarray
-            state0_batch = self.process_state_batch(state0_batch)
-            state1_batch = self.process_state_batch(state1_batch)
-            terminal1_batch = np.array(terminal1_batch)
-            reward_batch = np.array(reward_batch)
-            action_batch = np.array(action_batch)
+            state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch = sample_batch(self)
             assert reward_batch.shape == (self.batch_size,)
             assert terminal1_batch.shape == reward_batch.shape
             assert action_batch.shape == (self.batch_size, self.nb_actions), (action_batch.shape, (self.batch_size, self.nb_actions))
 
             # Update critic, if warm up is over.
             if self.step > self.nb_steps_warmup_critic:
+                start = self.timer.start()
                 target_actions = self.target_actor.predict_on_batch(state1_batch)
                 assert target_actions.shape == (self.batch_size, self.nb_actions)
                 if len(self.critic.inputs) >= 3:
@@ -386,6 +368,7 @@ class selfDDPGAgent(self_Agent):
                     state1_batch_with_action = [state1_batch]
                 state1_batch_with_action.insert(self.critic_action_input_idx, target_actions)
                 target_q_values = self.target_critic.predict_on_batch(state1_batch_with_action).flatten()
+                self.timer.stop('critic.target', start)
                 assert target_q_values.shape == (self.batch_size,)
 
                 # Compute r_t + gamma * max_a Q(s_t+1, a) and update the target ys accordingly,
@@ -402,7 +385,9 @@ class selfDDPGAgent(self_Agent):
                     state0_batch_with_action = [state0_batch]
                 state0_batch_with_action.insert(self.critic_action_input_idx, action_batch)
                 # state0_batch_with_action is input, targets is teacher
+                start = self.timer.start()
                 metrics = self.critic.train_on_batch(state0_batch_with_action, targets)
+                self.timer.stop('critic.train', start)
                 if self.processor is not None:
                     metrics += self.processor.metrics
 
@@ -416,11 +401,15 @@ class selfDDPGAgent(self_Agent):
                 if self.uses_learning_phase:
                     inputs += [self.training]
                 self.inputs = inputs
+                start = self.timer.start()
                 action_values = self.actor_train_fn(inputs)[0] # actor update with critics loss
+                self.timer.stop('actor.train', start)
                 assert action_values.shape == (self.batch_size, self.nb_actions)
 
         if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            start = self.timer.start()
             self.update_target_models_hard()
+            self.timer.stop('target_update', start)
         
         return metrics
 
@@ -448,11 +437,17 @@ class selfDDPGAgent2(selfDDPGAgent):
                  mb_noise=mb_noise,
                  custom_model_objects=custom_model_objects,
                  target_model_update=target_model_update)
+        if gradient_logging not in (False, True, 'global', 'group', 'layer'):
+            raise ValueError('`gradient_logging` must be a boolean or one of "global", "group" and "layer", is {}'.format(gradient_logging))
+        # Global norm of the actor gradient for every actor update. With 'group', also the norms
+        # of the action and tau parameters, with 'layer' additionally the norm of every layer.
         self.gradient_log = []
-        self.gradient_logging = gradient_logging
+        self.gradient_group_log = []
+        self.gradient_layer_log = []
+        self.gradient_logging = 'global' if gradient_logging is True else gradient_logging
         self.params_logging = params_logging
         
-    def compile(self, optimizer, metrics=[], action_lr=0.001, tau_lr=0.00001):
+    def compile(self, optimizer, metrics=[], action_lr=0.001, tau_lr=0.00001, param_groups=None):
         metrics += [mean_q]
 
         if type(optimizer) in (list, tuple):
@@ -513,22 +508,16 @@ class selfDDPGAgent2(selfDDPGAgent):
         # K.mean(combined_output)にマイナスをつけることで, 最小化がQ関数の最大化と同じ役割をはたす.
         # lossを-K.mean(combined_output)にすることでgradientはそれを小さくする方向に動く.
         # meanなのは, memoryの分布がrho^piに従ってるという仮定でやってる
-        dummy_optimizer = optimizers.Optimizer()
         self.combined_inputs = combined_inputs
         self.loss_func = -K.mean(combined_output)
-        self.gradients = dummy_optimizer.get_gradients(-K.mean(combined_output), self.actor.trainable_weights)
-        self.gradient_calculate_function = self._gradient_calculate_function()
 
         # action_params_update と tau_params_updateで分ける
         action_tw, tau_tw = self._split_params()
-        # action params update
-        # ∂Q/∂a
-        action_updates = _get_updates_original(action_tw, -K.mean(combined_output), action_lr)
-        # tau params update
-        # ∂Q/∂τ
-        tau_updates = _get_updates_original(tau_tw, -K.mean(combined_output), tau_lr)
-
-        updates = action_updates + tau_updates
+        # action params (∂Q/∂a) と tau params (∂Q/∂τ) を別々の学習率で一度に更新する
+        self.actor_param_optimizer = optimizers.GroupedAdam(self._param_groups(action_lr, tau_lr, param_groups))
+        updates = self.actor_param_optimizer.get_updates(loss=-K.mean(combined_output),
+                                                         params=self.actor.trainable_weights)
+        gradient_norms = self._gradient_norm_tensors(action_tw, tau_tw, self.actor_param_optimizer.gradients)
         if self.target_model_update < 1.:
             # Include soft target model updates.
             # target network update operations
@@ -538,33 +527,62 @@ class selfDDPGAgent2(selfDDPGAgent):
         # Finally, combine it all into a callable function.
         self.actor_updates = updates
         self.state_inputs = state_inputs
+        # The gradient norms are extra outputs of the same call that applies the updates.
         if K.backend() == 'tensorflow':
             self.actor_train_fn = K.function(state_inputs + [K.learning_phase()],
-                                             [self.actor(state_inputs)], updates=updates)
+                                             [self.actor(state_inputs)] + gradient_norms, updates=updates)
         else:
             if self.uses_learning_phase:
                 state_inputs += [K.learning_phase()]
-            self.actor_train_fn = K.function(state_inputs, [self.actor(state_inputs)], updates=updates)
+            self.actor_train_fn = K.function(state_inputs, [self.actor(state_inputs)] + gradient_norms, updates=updates)
         self.actor_optimizer = actor_optimizer
 
         self.compiled = True
 
     def _split_params(self):
-        tw = self.actor.trainable_weights
-        action_tw = []
-        tau_tw = []
-        for i in range(len(tw)):
-            if i % 4 < 2:
-                action_tw.append(tw[i])
-            else:
-                tau_tw.append(tw[i])
-        return action_tw, tau_tw
+        return _split_actor_params(self.actor)
+
+    def _param_groups(self, action_lr, tau_lr, param_groups=None):
+        if param_groups is not None:
+            return param_groups
+        action_tw, tau_tw = self._split_params()
+        return [{'name': 'action', 'params': action_tw, 'lr': action_lr, 'clipnorm': 1.},
+                {'name': 'tau', 'params': tau_tw, 'lr': tau_lr, 'clipnorm': 1.}]
+
+    def _gradient_norm_tensors(self, action_tw, tau_tw, gradients):
+        """Norm tensors requested by `gradient_logging`, global norm first.
+
+        `gradients` are the tensors the actor update applies, one per actor trainable weight,
+        so the norms come out of the same backward pass as the update.
+        """
+        if not self.gradient_logging:
+            return []
+        gradient_of = {id(w): g for w, g in zip(self.actor.trainable_weights, gradients)}
+
+        def norm(weights):
+            return K.sqrt(sum(K.sum(K.square(gradient_of[id(w)])) for w in weights))
+
+        norms = [norm(self.actor.trainable_weights)]
+        if self.gradient_logging in ('group', 'layer'):
+            norms += [norm(action_tw), norm(tau_tw)]
+        if self.gradient_logging == 'layer':
+            norms += [norm(layer.trainable_weights) for layer in self.actor.layers if layer.trainable_weights]
+        return norms
+
+    def _log_gradient_norms(self, norms):
+        self.gradient_log.append(norms[0])
+        if self.gradient_logging in ('group', 'layer'):
+            self.gradient_group_log.append(np.array(norms[1:3]))
+        if self.gradient_logging == 'layer':
+            self.gradient_layer_log.append(np.array(norms[3:]))
         
     def backward(self, reward, terminal=False):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -577,35 +595,14 @@ class selfDDPGAgent2(selfDDPGAgent):
         if can_train_either and self.step % self.train_interval == 0:
             # Make a mini-batch to learn. So batch learning is done in every time steps.
             #This is based on the paper.
-            experiences = self.memory.sample(self.batch_size)
-            assert len(experiences) == self.batch_size
-
-            # Start by extracting the necessary parameters (we use a vectorized implementation).
-            state0_batch = [] # current_state
-            reward_batch = [] # current_reward
-            action_batch = [] # current_action
-            terminal1_batch = []
-            state1_batch = [] # next_state
-            for e in experiences:
-                state0_batch.append(e.state0)
-                state1_batch.append(e.state1)
-                reward_batch.append(e.reward)
-                action_batch.append(e.action)
-                terminal1_batch.append(0. if e.terminal1 else 1.)
-
-            # Prepare and validate parameters.
-            # Change batch class from list to np.ndarray
-            state0_batch = self.process_state_batch(state0_batch)
-            state1_batch = self.process_state_batch(state1_batch)
-            terminal1_batch = np.array(terminal1_batch)
-            reward_batch = np.array(reward_batch)
-            action_batch = np.array(action_batch)
+            state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch = sample_batch(self)
             assert reward_batch.shape == (self.batch_size,)
             assert terminal1_batch.shape == reward_batch.shape
             assert action_batch.shape == (self.batch_size, self.nb_actions), (action_batch.shape, (self.batch_size, self.nb_actions))
 
             # Update critic, if warm up is over.
             if self.step > self.nb_steps_warmup_critic:
+                start = self.timer.start()
                 target_actions = self.target_actor.predict_on_batch(state1_batch)
                 assert target_actions.shape == (self.batch_size, self.nb_actions)
                 if len(self.critic.inputs) >= 3:
@@ -614,6 +611,7 @@ class selfDDPGAgent2(selfDDPGAgent):
                     state1_batch_with_action = [state1_batch]
                 state1_batch_with_action.insert(self.critic_action_input_idx, target_actions)
                 target_q_values = self.target_critic.predict_on_batch(state1_batch_with_action).flatten()
+                self.timer.stop('critic.target', start)
                 assert target_q_values.shape == (self.batch_size,)
 
                 # Compute r_t + gamma * max_a Q(s_t+1, a) and update the target ys accordingly,
@@ -630,7 +628,9 @@ class selfDDPGAgent2(selfDDPGAgent):
                     state0_batch_with_action = [state0_batch]
                 state0_batch_with_action.insert(self.critic_action_input_idx, action_batch)
                 # state0_batch_with_action is input, targets is teacher
+                start = self.timer.start()
                 metrics = self.critic.train_on_batch(state0_batch_with_action, targets)
+                self.timer.stop('critic.train', start)
                 if self.processor is not None:
                     metrics += self.processor.metrics
 
@@ -644,36 +644,23 @@ class selfDDPGAgent2(selfDDPGAgent):
                 if self.uses_learning_phase:
                     inputs += [self.training]
                 self.inputs = inputs
-                if self.gradient_logging:
-                    current_gradient = self._get_current_gradient(inputs)
-                    norm = gradient_evaluation(current_gradient)
-                    self.gradient_log.append(norm)
-                action_values = self.actor_train_fn(inputs)[0] # actor update with critics loss
+                start = self.timer.start()
+                outputs = self.actor_train_fn(inputs) # actor update with critics loss
+                self.timer.stop('actor.train', start)
+                action_values = outputs[0]
                 assert action_values.shape == (self.batch_size, self.nb_actions)
+                if self.gradient_logging:
+                    self._log_gradient_norms(outputs[1:])
 
         if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            start = self.timer.start()
             self.update_target_models_hard()
+            self.timer.stop('target_update', start)
         
         if self.params_logging:
             self.params_log.append(_NN_params(self.actor))
         return metrics
 
-    def _gradient_calculate_function(self):
-        # function input
-        input_tensors = [self.combined_inputs[1]]
-        gradient_tensors = self.gradients
-
-        # tensorflow running function
-        gradient_calculate_function = K.function(input_tensors, gradient_tensors)
-        return gradient_calculate_function
-
-    def _get_current_gradient(self, state0_batch):
-        gradient_calculate_function = self.gradient_calculate_function
-
-        # value
-        gradient_values = gradient_calculate_function(state0_batch)
-        return gradient_values
-
 
 class selfDDPGAgent3(selfDDPGAgent):
     """Adaptive discount factor to approximate exp(- alpha * tau).
@@ -695,7 +682,7 @@ class selfDDPGAgent3(selfDDPGAgent):
                  target_model_update=target_model_update)
         self.alpha = alpha
         
-    def compile(self, optimizer, metrics=[], action_lr=0.001, tau_lr=0.00001):
+    def compile(self, optimizer, metrics=[], action_lr=0.001, tau_lr=0.00001, param_groups=None):
         metrics += [mean_q]
 
         if type(optimizer) in (list, tuple):
@@ -753,16 +740,10 @@ class selfDDPGAgent3(selfDDPGAgent):
 
         self.combined_inputs = combined_inputs
 
-        # action_params_update と tau_params_updateで分ける
-        action_tw, tau_tw = self._split_params()
-        # action params update
-        # ∂Q/∂a
-        action_updates = _get_updates_original(action_tw, -K.mean(combined_output), action_lr)
-        # tau params update
-        # ∂Q/∂τ
-        tau_updates = _get_updates_original(tau_tw, -K.mean(combined_output), tau_lr)
-
-        updates = action_updates + tau_updates
+        # action params (∂Q/∂a) と tau params (∂Q/∂τ) を別々の学習率で一度に更新する
+        self.actor_param_optimizer = optimizers.GroupedAdam(self._param_groups(action_lr, tau_lr, param_groups))
+        updates = self.actor_param_optimizer.get_updates(loss=-K.mean(combined_output),
+                                                         params=self.actor.trainable_weights)
         if self.target_model_update < 1.:
             # Include soft target model updates.
             # target network update operations
@@ -784,21 +765,37 @@ class selfDDPGAgent3(selfDDPGAgent):
         self.compiled = True
 
     def _split_params(self):
-        tw = self.actor.trainable_weights
-        action_tw = []
-        tau_tw = []
-        for i in range(len(tw)):
-            if i % 4 < 2:
-                action_tw.append(tw[i])
-            else:
-                tau_tw.append(tw[i])
-        return action_tw, tau_tw
+        return _split_actor_params(self.actor)
+
+    def _param_groups(self, action_lr, tau_lr, param_groups=None):
+        if param_groups is not None:
+            return param_groups
+        action_tw, tau_tw = self._split_params()
+        return [{'name': 'action', 'params': action_tw, 'lr': action_lr, 'clipnorm': 1.},
+                {'name': 'tau', 'params': tau_tw, 'lr': tau_lr, 'clipnorm': 1.}]
         
+    def reset_states(self):
+        super(selfDDPGAgent3, self).reset_states()
+        self.episode_time = 0.
+
+    def _time_columns(self):
+        """Values of the time columns of the most recent transition that the memory declares."""
+        tau = self.recent_action[1]
+        values = {
+            'tau': tau,
+            'episode_time': self.episode_time,
+            'discount': np.exp(-self.alpha * tau),
+        }
+        return {name: value for name, value in values.items() if name in getattr(self.memory, 'columns', {})}
+
     def backward(self, reward, terminal=False):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
-                               training=self.training)
+                               training=self.training, **self._time_columns())
+            self.timer.stop('memory.append', start)
+        self.episode_time += self.recent_action[1]
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -811,35 +808,19 @@ class selfDDPGAgent3(selfDDPGAgent):
         if can_train_either and self.step % self.train_interval == 0:
             # Make a mini-batch to learn. So batch learning is done in every time steps.
             #This is based on the paper.
-            experiences = self.memory.sample(self.batch_size)
-            assert len(experiences) == self.batch_size
-
-            # Start by extracting the necessary parameters (we use a vectorized implementation).
-            state0_batch = [] # current_state
-            reward_batch = [] # current_reward
-            action_batch = [] # current_action
-            terminal1_batch = []
-            state1_batch = [] # next_state
-            for e in experiences:
-                state0_batch.append(e.state0)
-                state1_batch.append(e.state1)
-                reward_batch.append(e.reward)
-                action_batch.append(e.action)
-                terminal1_batch.append(0. if e.terminal1 else 1.)
-
-            # Prepare and validate parameters.
-            # Change batch class from list to np.ndarray
-            state0_batch = self.process_state_batch(state0_batch)
-            state1_batch = self.process_state_batch(state1_batch)
-            terminal1_batch = np.array(terminal1_batch)
-            reward_batch = np.array(reward_batch)
-            action_batch = np.array(action_batch)
+            if 'discount' in getattr(self.memory, 'columns', {}):
+                state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch, columns = sample_batch(self, columns=True)
+                discount_batch = columns['discount']
+            else:
+                state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch = sample_batch(self)
+                discount_batch = None
             assert reward_batch.shape == (self.batch_size,)
             assert terminal1_batch.shape == reward_batch.shape
             assert action_batch.shape == (self.batch_size, self.nb_actions), (action_batch.shape, (self.batch_size, self.nb_actions))
 
             # Update critic, if warm up is over.
             if self.step > self.nb_steps_warmup_critic:
+                start = self.timer.start()
                 target_actions = self.target_actor.predict_on_batch(state1_batch)
                 assert target_actions.shape == (self.batch_size, self.nb_actions)
                 if len(self.critic.inputs) >= 3:
@@ -848,14 +829,15 @@ class selfDDPGAgent3(selfDDPGAgent):
                     state1_batch_with_action = [state1_batch]
                 state1_batch_with_action.insert(self.critic_action_input_idx, target_actions)
                 target_q_values = self.target_critic.predict_on_batch(state1_batch_with_action).flatten()
+                self.timer.stop('critic.target', start)
                 assert target_q_values.shape == (self.batch_size,)
 
                 # Compute r_t + gamma * max_a Q(s_t+1, a) and update the target ys accordingly,
                 # but only for the affected output units (as given by action_batch).
-                # gamma should be exp(- alpha * tau)
-                tau_mean = np.mean(self.actor.predict_on_batch(state1_batch)[:,1])
-                gamma = np.exp(- self.alpha * tau_mean)
-                discounted_reward_batch = gamma * target_q_values
+                # The discount of each transition is exp(- alpha * tau) of its own interval.
+                if discount_batch is None:
+                    discount_batch = np.exp(- self.alpha * action_batch[:, 1])
+                discounted_reward_batch = discount_batch * target_q_values
                 discounted_reward_batch *= terminal1_batch
                 assert discounted_reward_batch.shape == reward_batch.shape
                 targets = (reward_batch + discounted_reward_batch).reshape(self.batch_size, 1)
@@ -867,7 +849,9 @@ class selfDDPGAgent3(selfDDPGAgent):
                     state0_batch_with_action = [state0_batch]
                 state0_batch_with_action.insert(self.critic_action_input_idx, action_batch)
                 # state0_batch_with_action is input, targets is teacher
+                start = self.timer.start()
                 metrics = self.critic.train_on_batch(state0_batch_with_action, targets)
+                self.timer.stop('critic.train', start)
                 if self.processor is not None:
                     metrics += self.processor.metrics
 
@@ -881,31 +865,56 @@ class selfDDPGAgent3(selfDDPGAgent):
                 if self.uses_learning_phase:
                     inputs += [self.training]
                 self.inputs = inputs
+                start = self.timer.start()
                 action_values = self.actor_train_fn(inputs)[0] # actor update with critics loss
+                self.timer.stop('actor.train', start)
                 assert action_values.shape == (self.batch_size, self.nb_actions)
 
         if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            start = self.timer.start()
             self.update_target_models_hard()
+            self.timer.stop('target_update', start)
         
         return metrics
 
 
-def _get_updates_original(params, loss, lr):
-    optimizer = optimizers.Adam(lr=lr, clipnorm = 1.)
-    updates = optimizer.get_updates(loss=loss, params=params)
-    return updates
-
-def gradient_evaluation(gradient_values):
-    if len(gradient_values[0].shape) == 2:
-        g_array = gradient_values[0].flatten()
-    else:
-        g_array = gradient_values[0]
-    for g in gradient_values[1:]:
-        if len(g.shape) == 2:
-            g = g.flatten()
-        g_array = np.hstack((g_array, g))
-    gradient_eval = np.linalg.norm(g_array)
-    return gradient_eval
+def _ancestor_layers(tensor):
+    """All layers that `tensor` depends on, including the layer that produced it."""
+    layers = []
+    stack = [tensor._keras_history[:2]]
+    seen = set()
+    while stack:
+        layer, node_index = stack.pop()
+        if (id(layer), node_index) in seen:
+            continue
+        seen.add((id(layer), node_index))
+        layers.append(layer)
+        node = layer._inbound_nodes[node_index]
+        stack.extend(zip(node.inbound_layers, node.node_indices))
+    return layers
+
+def _split_actor_params(actor):
+    """Splits the actor weights into those of the action head and those of the tau head.
+
+    The actors of `selfDDPGAgent2/3` end in `concatenate([action, tau])`. A layer belongs to the
+    tau head if only the tau output depends on it, every other weight is trained as an action
+    parameter. Actors of a different structure fall back to the old split, which assumes that
+    the layers of the two heads alternate.
+    """
+    tw = actor.trainable_weights
+    output_layer, node_index = actor.outputs[0]._keras_history[:2]
+    node = output_layer._inbound_nodes[node_index]
+    if len(actor.outputs) != 1 or len(node.input_tensors) != 2:
+        warnings.warn('The actor does not end in `concatenate([action, tau])`, splitting its weights by position.')
+        return [w for i, w in enumerate(tw) if i % 4 < 2], [w for i, w in enumerate(tw) if i % 4 >= 2]
+    action_output, tau_output = node.input_tensors
+    action_layers = set(id(layer) for layer in _ancestor_layers(action_output))
+    tau_tw = []
+    for layer in _ancestor_layers(tau_output):
+        if id(layer) not in action_layers:
+            tau_tw.extend(layer.trainable_weights)
+    tau_ids = set(id(w) for w in tau_tw)
+    return [w for w in tw if id(w) not in tau_ids], [w for w in tw if id(w) in tau_ids]
 
 
 class sampleDDPGAgent(sample_Agent):
@@ -941,7 +950,7 @@ class sampleDDPGAgent(sample_Agent):
             delta_clip = delta_range[1]
 
         if random_process == 'OrnsteinUhlenbeckProcess':
-            random_process = OrnsteinUhlenbeckProcess(1., size=3)
+            random_process = OrnsteinUhlenbeckProcess(1., size=nb_actions)
         elif random_process is None:
             pass
         else:
@@ -1091,8 +1100,9 @@ class sampleDDPGAgent(sample_Agent):
             return batch
         return self.processor.process_state_batch(batch)
 
-    def select_action(self, state):
-        batch = self.process_state_batch([state])
+    def select_action(self, state_batch):
+        # `state_batch` holds the single state of `memory.get_recent_state_batch`.
+        batch = self.process_state_batch(state_batch)
         action = self.actor.predict_on_batch(batch).flatten()
 
         # Apply noise, if a random process is set.
@@ -1105,9 +1115,9 @@ class sampleDDPGAgent(sample_Agent):
 
     def forward(self, observation):
         # Select an action.
-        state = self.memory.get_recent_state(observation)
+        state_batch = self.memory.get_recent_state_batch(observation)
         #TODO: change the law of selecting action
-        action = self.select_action(state)
+        action = self.select_action(state_batch)
         action = np.clip(action, -self.action_clipper, self.action_clipper)
 
         # Book-keeping.
@@ -1130,8 +1140,10 @@ class sampleDDPGAgent(sample_Agent):
     def backward(self, reward, terminal=False):
         # Store most recent experience in memory.
         if self.step % self.memory_interval == 0:
+            start = self.timer.start()
             self.memory.append(self.recent_observation, self.recent_action, reward, terminal,
                                training=self.training)
+            self.timer.stop('memory.append', start)
 
         metrics = [np.nan for _ in self.metrics_names]
         if not self.training:
@@ -1144,35 +1156,14 @@ class sampleDDPGAgent(sample_Agent):
         if can_train_either and self.step % self.train_interval == 0:
             # Make a mini-batch to learn. So batch learning is done in every time steps.
             #This is based on the paper.
-            experiences = self.memory.sample(self.batch_size)
-            assert len(experiences) == self.batch_size
-
-            # Start by extracting the necessary parameters (we use a vectorized implementation).
-            state0_batch = [] # current_state
-            reward_batch = [] # current_reward
-            action_batch = [] # current_action
-            terminal1_batch = []
-            state1_batch = [] # next_state
-            for e in experiences:
-                state0_batch.append(e.state0)
-                state1_batch.append(e.state1)
-                reward_batch.append(e.reward)
-                action_batch.append(e.action)
-                terminal1_batch.append(0. if e.terminal1 else 1.)
-
-            # Prepare and validate parameters.
-            # Change batch class from list to np.ndarray
-            state0_batch = self.process_state_batch(state0_batch)
-            state1_batch = self.process_state_batch(state1_batch)
-            terminal1_batch = np.array(terminal1_batch)
-            reward_batch = np.array(reward_batch)
-            action_batch = np.array(action_batch)
+            state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch = sample_batch(self)
             assert reward_batch.shape == (self.batch_size,), f'{reward_batch.shape}, {(self.batch_size,)}'
             assert terminal1_batch.shape == reward_batch.shape
             assert action_batch.shape == (self.batch_size, self.nb_actions), (action_batch.shape, (self.batch_size, self.nb_actions))
 
             # Update critic, if warm up is over.
             if self.step > self.nb_steps_warmup_critic:
+                start = self.timer.start()
                 target_actions = self.target_actor.predict_on_batch(state1_batch)
                 assert target_actions.shape == (self.batch_size, self.nb_actions)
                 if len(self.critic.inputs) >= 3:
@@ -1181,6 +1172,7 @@ class sampleDDPGAgent(sample_Agent):
                     state1_batch_with_action = [state1_batch]
                 state1_batch_with_action.insert(self.critic_action_input_idx, target_actions)
                 target_q_values = self.target_critic.predict_on_batch(state1_batch_with_action).flatten()
+                self.timer.stop('critic.target', start)
                 assert target_q_values.shape == (self.batch_size,)
 
                 # Compute r_t + gamma * max_a Q(s_t+1, a) and update the target ys accordingly,
@@ -1197,7 +1189,9 @@ class sampleDDPGAgent(sample_Agent):
                     state0_batch_with_action = [state0_batch]
                 state0_batch_with_action.insert(self.critic_action_input_idx, action_batch)
                 # state0_batch_with_action is input, targets is teacher
+                start = self.timer.start()
                 metrics = self.critic.train_on_batch(state0_batch_with_action, targets)
+                self.timer.stop('critic.train', start)
                 if self.processor is not None:
                     metrics += self.processor.metrics
 
@@ -1211,7 +1205,9 @@ class sampleDDPGAgent(sample_Agent):
                     inputs = [state0_batch]
                 if self.uses_learning_phase:
                     inputs += [self.training]
+                start = self.timer.start()
                 action_values = self.actor_train_fn(inputs)[0] # update actor here with critics loss
+                self.timer.stop('actor.train', start)
                 # where is policy gradient?
                 assert action_values.shape == (self.batch_size, self.nb_actions)
             actor_outputlayer_diff = tmp - self.actor.layers[4].get_weights()[0]
@@ -1219,6 +1215,8 @@ class sampleDDPGAgent(sample_Agent):
             self.outputlayer_param_mean.append(diff_mean)
 
         if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            start = self.timer.start()
             self.update_target_models_hard()
+            self.timer.stop('target_update', start)
 
         return metrics
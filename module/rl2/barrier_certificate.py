@@ -53,7 +53,8 @@ def _u_of_x(x, clipper, k=2.6, alpha=set_alpha()):
         p = abs(m*g*np.sin(th)/2)
         ran = [-clipper, -p] if th > 0 else [p, clipper]
     else:
-        u_thres = np.roots([-(6*al*thd)/(m*l**2), -(2*th*thd + 3*al*g/l*thd*np.sin(th) - gamma*h(x, al))])[0]
+        # root of the degree-1 polynomial in u where dh/dt + gamma*h changes sign
+        u_thres = (2*th*thd + 3*al*g/l*thd*np.sin(th) - gamma*h(x, al)) / (-(6*al*thd)/(m*l**2))
         u_thres = np.clip(u_thres, -clipper, clipper)
         if thd < 0:
             u_thres = max(u_thres, -clipper)
@@ -62,3 +63,59 @@ def _u_of_x(x, clipper, k=2.6, alpha=set_alpha()):
             u_thres = min(u_thres, clipper)
             ran = [-clipper, u_thres]
     return ran
+
+
+def u_cbf_batch(x, u_candidate, clipper=10., pure=False, k=2.6, alpha=set_alpha()):
+    """Vectorized `u_cbf` / `u_cbf_pure` over a batch of states.
+
+    # Arguments
+        x (np.ndarray): States of shape `(N, 2)`.
+        u_candidate (np.ndarray): Candidate inputs of shape `(N,)`.
+        clipper (float): Input bound.
+        pure (boolean): If `True`, follow `u_cbf_pure`, i.e. never force the input near the
+            boundary of the safe set.
+
+    # Returns
+        Tuple `(u, active, h)` of arrays of shape `(N,)`: the filtered inputs, a mask of the
+        states where they differ from the candidate, and `h(x)`.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    assert x.ndim == 2 and x.shape[1] == 2, 'shape_error'
+    u_candidate = np.asarray(u_candidate, dtype=np.float64).reshape(-1)
+    rmin, rmax = _u_of_x_batch(x, clipper, k, alpha)
+    hx = h(x.T, alpha)
+
+    below = u_candidate < rmin
+    above = ~below & (u_candidate > rmax)
+    u = np.where(below, rmin, np.where(above, rmax, u_candidate))
+    if not pure:
+        forced = hx < 1e-1
+        u = np.where(forced, np.where(x[:, 0] < 0, rmax, rmin), u)
+    # Same rule as `CBFSafetyFilter.apply`: candidates beyond the input bound count as corrected.
+    active = u_candidate != u
+    return u, active, hx
+
+
+def _u_of_x_batch(x, clipper, k=2.6, alpha=set_alpha()):
+    """Vectorized `_u_of_x`. Returns the lower and upper bounds of the allowed input range."""
+    al = alpha
+    m = 1
+    l = 1
+    g = 10.
+    gamma = pow(10, k)
+    th, thd = x[:, 0], x[:, 1]
+
+    still = thd == 0
+    p = np.abs(m*g*np.sin(th)/2)
+    still_min = np.where(th > 0, -clipper, p)
+    still_max = np.where(th > 0, -p, clipper)
+
+    denom = -(6*al*np.where(still, 1., thd))/(m*l**2)
+    u_thres = (2*th*thd + 3*al*g/l*thd*np.sin(th) - gamma*h(x.T, al)) / denom
+    u_thres = np.clip(u_thres, -clipper, clipper)
+    moving_min = np.where(thd < 0, u_thres, -clipper)
+    moving_max = np.where(thd < 0, clipper, u_thres)
+
+    rmin = np.where(still, still_min, moving_min)
+    rmax = np.where(still, still_max, moving_max)
+    return rmin, rmax
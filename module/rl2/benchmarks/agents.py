@@ -0,0 +1,114 @@
+from __future__ import division
+import argparse
+import timeit
+
+import numpy as np
+
+from keras2.models import Model
+from keras2.layers import concatenate, Dense, Input, Flatten
+from keras2.optimizers import Adam
+
+from gym2.envs.classic_control import LinearEnv, PendulumEnv
+from rl2.agents import eventDDPGAgent, safeDDPGAgent, selfDDPGAgent
+from rl2.memory import SequentialMemory
+from rl2.benchmarks.timing import print_results, rate
+
+
+def _actor(s_shape, activations):
+    observation_input = Input(shape=(1,) + s_shape)
+    x = Flatten()(observation_input)
+    outputs = []
+    for activation in activations:
+        y = Dense(16, activation='relu')(x)
+        y = Dense(16, activation='relu')(y)
+        outputs.append(Dense(1, activation=activation)(y))
+    output = outputs[0] if len(outputs) == 1 else concatenate(outputs)
+    return Model(inputs=observation_input, outputs=output)
+
+
+def _critic(a_shape, s_shape):
+    action_input = Input(a_shape)
+    observation_input = Input(shape=(1,) + s_shape)
+    flattened_observation = Flatten()(observation_input)
+    x = concatenate([action_input, flattened_observation])
+    x = Dense(16, activation='relu')(x)
+    x = Dense(16, activation='relu')(x)
+    x = Dense(1, activation='linear')(x)
+    return Model(inputs=[action_input, observation_input], outputs=x), action_input
+
+
+def make_self_agent(nb_steps_warmup=100):
+    actor = _actor((2,), ['multiple_tanh', 'tau_output'])
+    critic, action_input = _critic((2,), (2,))
+    agent = selfDDPGAgent(2, actor, critic, action_input, SequentialMemory(limit=100000, window_length=1),
+                          nb_steps_warmup_critic=nb_steps_warmup, nb_steps_warmup_actor=nb_steps_warmup)
+    agent.compile(Adam(lr=.001, clipnorm=1.))
+    return agent, LinearEnv()
+
+
+def make_event_agent(nb_steps_warmup=100):
+    actor = _actor((2,), ['multiple_tanh', 'linear', 'linear'])
+    critic, action_input = _critic((3,), (2,))
+    agent = eventDDPGAgent(3, actor, critic, action_input, SequentialMemory(limit=100000, window_length=1),
+                           nb_steps_warmup_critic=nb_steps_warmup, nb_steps_warmup_actor=nb_steps_warmup)
+    agent.compile(Adam(lr=.001, clipnorm=1.))
+    return agent, PendulumEnv()
+
+
+def make_safe_agent(nb_steps_warmup=100):
+    actor = _actor((2,), ['multiple_tanh'])
+    critic, action_input = _critic((1,), (2,))
+    agent = safeDDPGAgent(1, actor, critic, action_input, SequentialMemory(limit=100000, window_length=1),
+                          nb_steps_warmup_critic=nb_steps_warmup, nb_steps_warmup_actor=nb_steps_warmup)
+    agent.compile(Adam(lr=.001, clipnorm=1.))
+    return agent, PendulumEnv()
+
+
+def _fit(agent, env, nb_steps):
+    if isinstance(agent, selfDDPGAgent):
+        return agent.fit(env, nb_steps=nb_steps, verbose=0, episode_time=20.)
+    return agent.fit(env, nb_steps=nb_steps, verbose=0, nb_max_episode_steps=200)
+
+
+def _step(agent, observation):
+    agent.forward(observation)
+    agent.backward(-1., terminal=False)
+    agent.step += 1
+
+
+def run(number=200, nb_fit_steps=2000, nb_steps_warmup=100, verbose=True):
+    """Measures `forward`, a full training step and end-to-end `fit` of the DDPG agents.
+
+    The training step is `forward` followed by `backward` once the warmup is over, i.e. with a
+    minibatch update of actor and critic. `fit` includes the warmup.
+
+    # Returns
+        Dict mapping benchmark names to calls (or fit steps) per second.
+    """
+    results = {}
+    builders = [('selfDDPGAgent', make_self_agent), ('eventDDPGAgent', make_event_agent),
+                ('safeDDPGAgent', make_safe_agent)]
+    for name, make in builders:
+        agent, env = make(nb_steps_warmup)
+        env.seed(0)
+
+        start = timeit.default_timer()
+        _fit(agent, env, nb_fit_steps)
+        results['fit.{}'.format(name)] = nb_fit_steps / (timeit.default_timer() - start)
+
+        observation = env.reset()
+        agent.training = True
+        agent.step = nb_steps_warmup + 1
+        results['agent.{}.forward'.format(name)] = rate(lambda: agent.forward(observation), number)
+        results['agent.{}.train_step'.format(name)] = rate(lambda: _step(agent, observation), number)
+    if verbose:
+        print_results(results)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DDPG agent and fit loop throughput.')
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--nb-fit-steps', type=int, default=2000)
+    args = parser.parse_args()
+    run(number=args.number, nb_fit_steps=args.nb_fit_steps)
@@ -0,0 +1,49 @@
+from __future__ import division
+import argparse
+
+import numpy as np
+
+from gym2.envs.classic_control import LinearEnv, PendulumEnv2
+from rl2.benchmarks.timing import print_results, rate
+
+
+def _interval(env, action, tau, substeps_per_unit=20):
+    # Same sub-stepping as `rl2.rollout.SelfTrigger`.
+    nb_substeps = int(np.ceil(substeps_per_unit * tau))
+    dt = tau / nb_substeps
+    for _ in range(nb_substeps):
+        env.step(action, dt, tau)
+
+
+def run(taus=(.01, .1, 1., 10.), number=2000, verbose=True):
+    """Measures single `step` calls and whole self-triggered intervals of the plants.
+
+    # Returns
+        Dict mapping benchmark names to calls per second (steps or intervals).
+    """
+    results = {}
+    action = np.array([.5])
+    for env in (PendulumEnv2(), LinearEnv()):
+        name = type(env).__name__
+        env.seed(0)
+        env.reset()
+        results['env.{}.step'.format(name)] = rate(lambda: env.step(action, .01, .01), number)
+        for tau in taus:
+            # Long intervals have many sub-steps, keep the total work per measurement similar.
+            nb_intervals = max(1, int(number / np.ceil(20 * tau)))
+            env.reset()
+            results['env.{}.interval[tau={}]'.format(name, tau)] = rate(
+                lambda: _interval(env, action, tau), nb_intervals)
+            if hasattr(env, 'step_interval'):
+                results['env.{}.step_interval[tau={}]'.format(name, tau)] = rate(
+                    lambda: env.step_interval(action, tau), number)
+    if verbose:
+        print_results(results)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Environment step and interval throughput.')
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+    run(number=args.number)
@@ -0,0 +1,122 @@
+from __future__ import division
+import argparse
+import timeit
+
+import numpy as np
+
+from rl2.callbacks import Callback
+from rl2.selfcore import self_Agent
+from gym2.envs.classic_control import LinearEnv
+
+
+class ScheduleAgent(self_Agent):
+    """Network-free agent that replays the step schedule of `selfDDPGAgent.backward`.
+
+    It applies a fixed linear feedback with a constant sampling period and only counts how
+    often the memory, training and hard target update branches would have fired. This keeps
+    the loop itself as the only thing being measured, so long runs finish in seconds.
+    """
+    def __init__(self, gain, tau, nb_steps_warmup_critic=1000, nb_steps_warmup_actor=1000,
+                 train_interval=1, memory_interval=1, target_model_update=10000, **kwargs):
+        super(ScheduleAgent, self).__init__(**kwargs)
+        self.gain = np.array(gain)
+        self.tau = tau
+        self.nb_steps_warmup_critic = nb_steps_warmup_critic
+        self.nb_steps_warmup_actor = nb_steps_warmup_actor
+        self.train_interval = train_interval
+        self.memory_interval = memory_interval
+        self.target_model_update = target_model_update
+        self.compiled = True
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.nb_memory_appends = 0
+        self.nb_critic_updates = 0
+        self.nb_actor_updates = 0
+        self.nb_target_updates = 0
+
+    def forward(self, observation):
+        return np.array([np.dot(self.gain, observation), self.tau])
+
+    def backward(self, reward, terminal=False):
+        if self.step % self.memory_interval == 0:
+            self.nb_memory_appends += 1
+        can_train_either = self.step > self.nb_steps_warmup_critic or self.step > self.nb_steps_warmup_actor
+        if can_train_either and self.step % self.train_interval == 0:
+            if self.step > self.nb_steps_warmup_critic:
+                self.nb_critic_updates += 1
+            if self.step > self.nb_steps_warmup_actor:
+                self.nb_actor_updates += 1
+        if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            self.nb_target_updates += 1
+        return [0.]
+
+
+class EpisodeEndRecorder(Callback):
+    def __init__(self):
+        self.steps = []
+
+    def on_episode_end(self, episode, logs={}):
+        self.steps.append(logs['nb_steps'])
+
+
+def _expected_count(nb_steps, interval, after=-1):
+    """Number of steps `s` in `[0, nb_steps)` with `s > after` and `s % interval == 0`."""
+    first = (after // interval + 1) * interval
+    if first >= nb_steps:
+        return 0
+    return (nb_steps - 1 - first) // interval + 1
+
+
+def run(nb_steps=150000, tau=.05, train_interval=4, memory_interval=2, target_model_update=10000,
+        nb_steps_warmup=1000, verbose=True):
+    """Trains `ScheduleAgent` on `LinearEnv` well past the 16 bit boundary and checks the schedules.
+
+    Every step runs exactly one decision with `ceil(20 * tau)` sub-steps. Terminal steps add one
+    more `backward` call with the same `agent.step`, so they are counted separately.
+
+    # Returns
+        Dict with the final step counter, schedule counts and decisions per second.
+    """
+    env = LinearEnv()
+    agent = ScheduleAgent(gain=[-1., -1.], tau=tau, nb_steps_warmup_critic=nb_steps_warmup,
+                          nb_steps_warmup_actor=nb_steps_warmup, train_interval=train_interval,
+                          memory_interval=memory_interval, target_model_update=target_model_update)
+
+    episode_ends = EpisodeEndRecorder()
+    start = timeit.default_timer()
+    agent.fit(env, nb_steps=nb_steps, callbacks=[episode_ends], verbose=0, episode_time=20.)
+    duration = timeit.default_timer() - start
+
+    assert agent.step == nb_steps, (agent.step, nb_steps)
+    assert isinstance(agent.step, int), type(agent.step)
+
+    def expected(interval, after=-1):
+        # The extra `backward(0., terminal=False)` of a finished episode runs at `nb_steps` of that episode.
+        extra = sum(1 for s in episode_ends.steps if s > after and s % interval == 0)
+        return _expected_count(nb_steps, interval, after) + extra
+
+    results = {
+        'nb_steps': agent.step,
+        'nb_memory_appends': agent.nb_memory_appends,
+        'nb_critic_updates': agent.nb_critic_updates,
+        'nb_actor_updates': agent.nb_actor_updates,
+        'nb_target_updates': agent.nb_target_updates,
+        'decisions_per_second': nb_steps / duration,
+    }
+    assert agent.nb_memory_appends == expected(memory_interval)
+    assert agent.nb_critic_updates == expected(train_interval, nb_steps_warmup)
+    assert agent.nb_actor_updates == expected(train_interval, nb_steps_warmup)
+    assert agent.nb_target_updates == expected(target_model_update)
+    if verbose:
+        for key, value in results.items():
+            print('{}: {}'.format(key, value))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Long-run step counter regression benchmark.')
+    parser.add_argument('--nb-steps', type=int, default=150000)
+    parser.add_argument('--tau', type=float, default=.05)
+    args = parser.parse_args()
+    run(nb_steps=args.nb_steps, tau=args.tau)
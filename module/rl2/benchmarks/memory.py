@@ -0,0 +1,49 @@
+from __future__ import division
+import argparse
+
+import numpy as np
+
+from rl2.memory import CompactSequentialMemory, SequentialMemory
+from rl2.benchmarks.timing import print_results, rate
+
+
+def _filled_memory(memory_class, size):
+    memory = memory_class(limit=size, window_length=1)
+    observations = np.random.uniform(-7., 7., size=(size, 2))
+    actions = np.random.uniform(-1., 1., size=(size, 2))
+    for i in range(size):
+        memory.append(observations[i], actions[i], -1., (i + 1) % 1000 == 0)
+    return memory
+
+
+def run(sizes=(10**4, 10**5, 10**6), batch_size=32, number=2000, verbose=True):
+    """Measures `append` on a full buffer and `sample` of the replay memories at several sizes.
+
+    # Returns
+        Dict mapping benchmark names to appends or sampled minibatches per second.
+    """
+    results = {}
+    observation = np.zeros(2)
+    action = np.zeros(2)
+    for memory_class in (SequentialMemory, CompactSequentialMemory):
+        name = memory_class.__name__
+        for size in sizes:
+            memory = _filled_memory(memory_class, size)
+            results['memory.{}[{}].append'.format(name, size)] = rate(
+                lambda: memory.append(observation, action, -1., False), number)
+            results['memory.{}[{}].sample[{}]'.format(name, size, batch_size)] = rate(
+                lambda: memory.sample(batch_size), max(1, number // 10))
+            if hasattr(memory, 'sample_arrays'):
+                results['memory.{}[{}].sample_arrays[{}]'.format(name, size, batch_size)] = rate(
+                    lambda: memory.sample_arrays(batch_size), max(1, number // 10))
+    if verbose:
+        print_results(results)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay memory throughput.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10**4, 10**5, 10**6])
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+    run(sizes=args.sizes, batch_size=args.batch_size)
@@ -0,0 +1,108 @@
+"""Runs the benchmarks, writes them to JSON and compares them to a stored baseline.
+
+    python -m rl2.benchmarks.suite --output results.json
+    python -m rl2.benchmarks.suite --output new.json --baseline results.json
+
+All numbers are rates (higher is better). With `--baseline`, every benchmark that got slower
+than `1 - tolerance` times its baseline is reported and the exit status is 1.
+"""
+from __future__ import division
+import argparse
+import json
+import platform
+import sys
+
+import numpy as np
+
+SECTIONS = ('env', 'memory', 'loop', 'agents')
+
+
+def _run_section(section, quick):
+    # Imported lazily so that e.g. the env benchmarks run without a keras backend.
+    if section == 'env':
+        from rl2.benchmarks import envs
+        return envs.run(number=200 if quick else 2000, verbose=False)
+    if section == 'memory':
+        from rl2.benchmarks import memory
+        sizes = (10**4,) if quick else (10**4, 10**5, 10**6)
+        return memory.run(sizes=sizes, number=200 if quick else 2000, verbose=False)
+    if section == 'loop':
+        from rl2.benchmarks import long_run
+        result = long_run.run(nb_steps=5000 if quick else 70000, verbose=False)
+        return {'loop.self_Agent.decisions': result['decisions_per_second']}
+    if section == 'agents':
+        from rl2.benchmarks import agents
+        return agents.run(number=20 if quick else 200, nb_fit_steps=300 if quick else 2000, verbose=False)
+    raise ValueError('Unknown benchmark section "{}".'.format(section))
+
+
+def run(sections=SECTIONS, quick=False, verbose=True):
+    """Runs the given benchmark sections.
+
+    # Returns
+        Dict with the machine description under `meta` and the rates under `results`.
+    """
+    results = {}
+    for section in sections:
+        if verbose:
+            print('running {} benchmarks ...'.format(section))
+        results.update(_run_section(section, quick))
+    meta = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'quick': quick,
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare(results, baseline, tolerance=.1):
+    """Compares two `run` outputs benchmark by benchmark.
+
+    # Returns
+        List of `(name, baseline_rate, rate, ratio)` for every benchmark present in both, and
+        the list of names whose ratio is below `1 - tolerance`.
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(results['results']) & set(baseline['results'])):
+        old, new = baseline['results'][name], results['results'][name]
+        ratio = new / old
+        rows.append((name, old, new, ratio))
+        if ratio < 1. - tolerance:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_comparison(rows, regressions):
+    width = max(len(row[0]) for row in rows)
+    for name, old, new, ratio in rows:
+        flag = '  REGRESSION' if name in regressions else ''
+        print('{}  {:>14.1f} -> {:>14.1f}  x{:.2f}{}'.format(name.ljust(width), old, new, ratio, flag))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput benchmarks for the self-triggered RL stack.')
+    parser.add_argument('--output', type=str, default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='compare against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=.1)
+    parser.add_argument('--sections', type=str, nargs='+', default=list(SECTIONS), choices=SECTIONS)
+    parser.add_argument('--quick', action='store_true', help='small sizes for a smoke test')
+    args = parser.parse_args()
+
+    output = run(sections=args.sections, quick=args.quick)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.baseline is None:
+        from rl2.benchmarks.timing import print_results
+        print_results(output['results'])
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(output, baseline, args.tolerance)
+        print_comparison(rows, regressions)
+        if regressions:
+            sys.exit(1)
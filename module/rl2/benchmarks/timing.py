@@ -0,0 +1,18 @@
+from __future__ import division
+import timeit
+
+
+def rate(fn, number, repeat=3):
+    """Calls per second of `fn`, taken from the fastest of `repeat` runs of `number` calls.
+
+    The fastest run is the one least disturbed by other processes, which makes the numbers
+    comparable between runs on the same machine.
+    """
+    best = min(timeit.repeat(fn, number=number, repeat=repeat))
+    return number / best
+
+
+def print_results(results):
+    width = max(len(name) for name in results)
+    for name in sorted(results):
+        print('{}  {:>14.1f} /s'.format(name.ljust(width), results[name]))
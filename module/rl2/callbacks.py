@@ -385,3 +385,152 @@ class ModelIntervalCheckpoint(Callback):
         if self.verbose > 0:
             print('Step {}: saving model to {}'.format(self.total_steps, filepath))
         self.model.save_weights(filepath, overwrite=True)
+
+
+class PhaseTimer(object):
+    """Timer hooks of the fit loops, the agents' `backward` and `rl2.prefetch.sample_batch`.
+
+    Every agent holds one in `agent.timer`. The hooks bracket a phase with
+    `start = timer.start()` and `timer.stop(phase, start)`. This class does nothing, so the
+    hooks cost two method calls unless a callback such as `PhaseProfiler` enables them.
+    """
+    def start(self):
+        return None
+
+    def stop(self, phase, start):
+        pass
+
+
+def reset_timer(agent, timer):
+    """Sets `agent.timer` back to `timer`, or to the class default if `timer` is `None`."""
+    if timer is None:
+        agent.__dict__.pop('timer', None)
+    else:
+        agent.timer = timer
+
+
+class PhaseProfiler(Callback):
+    """Times the phases of a fit loop and aggregates them into fixed log-spaced histograms.
+
+    During training this callback is the agent's `timer` (see `PhaseTimer`), i.e. it records
+    the phases the loop and `backward` report. The agent's previous timer is restored when
+    training ends. Nothing is patched, so other agents and later runs are not affected.
+
+    Phases: `step` (one decision), `forward` (the trigger policy's decision, including
+    `agent.forward`), `env` (integrating the whole interval), `backward`, `memory.append`,
+    `memory.sample` (drawing and stacking one training batch, including waiting for a
+    `PrefetchingMemory`), `critic.target` (target network predictions), `critic.train`,
+    `actor.train` and `target_update`. Agents without networks report the memory phases only.
+
+    # Arguments
+        trace_window (tuple): `(first_step, last_step)` of `agent.step` for which every phase
+            is also recorded as a Chrome trace event, see `export_trace`. `None` for no trace.
+        verbose (integer): If > 0, print the summary at the end of training.
+    """
+    bins = np.logspace(-7, 2, 181)  # 100ns .. 100s, 20 bins per decade
+
+    def __init__(self, trace_window=None, verbose=1):
+        super(PhaseProfiler, self).__init__()
+        self.trace_window = trace_window
+        self.verbose = verbose
+        self.histograms = {}
+        self.totals = {}
+        self.trace_events = []
+        self._tracing = False
+        self._agent = None
+
+    def record(self, phase, start, duration):
+        if phase not in self.histograms:
+            self.histograms[phase] = np.zeros(len(self.bins) + 1, dtype=np.int64)
+            self.totals[phase] = 0.
+        self.histograms[phase][np.searchsorted(self.bins, duration)] += 1
+        self.totals[phase] += duration
+        if self._tracing:
+            self.trace_events.append({
+                'name': phase, 'ph': 'X', 'pid': 0, 'tid': 0,
+                'ts': (start - self.train_start) * 1e6, 'dur': duration * 1e6,
+            })
+
+    def start(self):
+        return timeit.default_timer()
+
+    def stop(self, phase, start):
+        self.record(phase, start, timeit.default_timer() - start)
+
+    def _detach(self):
+        agent = self._agent
+        if agent is not None and agent.__dict__.get('timer') is self:
+            reset_timer(agent, self._previous_timer)
+        self._agent = None
+
+    def on_train_begin(self, logs={}):
+        agent = self.model
+        self._tracing = False
+        self.train_start = timeit.default_timer()
+        self.nb_steps = 0
+        self.nb_substeps = 0
+        self._agent = agent
+        self._previous_timer = agent.__dict__.get('timer')
+        agent.timer = self
+
+    def on_step_begin(self, step, logs={}):
+        window = self.trace_window
+        self._tracing = window is not None and window[0] <= self.model.step <= window[1]
+        self.step_start = timeit.default_timer()
+
+    def on_action_end(self, action, logs={}):
+        self.nb_substeps += 1
+
+    def on_step_end(self, step, logs={}):
+        self.stop('step', self.step_start)
+        self.nb_steps += 1
+
+    def on_train_end(self, logs={}):
+        self.train_duration = timeit.default_timer() - self.train_start
+        self._tracing = False
+        self._detach()
+        if self.verbose > 0:
+            self.print_summary()
+
+    def percentile(self, phase, q):
+        """Upper bin edge below which `q` percent of the durations of `phase` fall."""
+        counts = self.histograms[phase]
+        rank = np.searchsorted(np.cumsum(counts), q / 100. * counts.sum())
+        return self.bins[min(rank, len(self.bins) - 1)]
+
+    def summary(self):
+        """Returns a dict with per-phase statistics, steps per second and sub-steps per decision."""
+        phases = {}
+        for phase, counts in self.histograms.items():
+            count = int(counts.sum())
+            phases[phase] = {
+                'count': count,
+                'total': self.totals[phase],
+                'mean': self.totals[phase] / count,
+                'p50': self.percentile(phase, 50),
+                'p90': self.percentile(phase, 90),
+                'p99': self.percentile(phase, 99),
+            }
+        return {
+            'phases': phases,
+            'steps_per_second': self.nb_steps / self.train_duration,
+            'substeps_per_decision': self.nb_substeps / max(self.nb_steps, 1),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print('{:.1f} steps/s, {:.1f} sub-steps per decision'.format(
+            summary['steps_per_second'], summary['substeps_per_decision']))
+        print('{:<16}{:>10}{:>12}{:>12}{:>12}{:>12}{:>10}'.format(
+            'phase', 'count', 'mean [ms]', 'p50 [ms]', 'p90 [ms]', 'p99 [ms]', 'share'))
+        step_total = self.totals.get('step', self.train_duration)
+        for phase in sorted(summary['phases'], key=lambda p: -self.totals[p]):
+            stats = summary['phases'][phase]
+            print('{:<16}{:>10}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}{:>9.1f}%'.format(
+                phase, stats['count'], stats['mean'] * 1e3, stats['p50'] * 1e3, stats['p90'] * 1e3,
+                stats['p99'] * 1e3, 100. * stats['total'] / step_total))
+
+    def export_trace(self, filepath):
+        """Writes the events of `trace_window` in the Chrome trace event format (chrome://tracing)."""
+        with open(filepath, 'w') as f:
+            json.dump({'traceEvents': self.trace_events, 'displayTimeUnit': 'ms'}, f)
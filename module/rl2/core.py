@@ -7,11 +7,14 @@ from keras2.callbacks import History
 
 from rl2.callbacks import (
     CallbackList,
+    PhaseTimer,
     TestLogger,
     TrainEpisodeLogger,
     TrainIntervalLogger,
-    Visualizer
+    Visualizer,
+    reset_timer
 )
+from rl2.prefetch import stop_prefetching
 
 
 class Agent(object):
@@ -36,9 +39,15 @@ class Agent(object):
 
     # Arguments
         processor (`Processor` instance): See [Processor](#processor) for details.
+        check_observations (boolean): If `True`, verify that environments declaring
+            `fresh_observations` never reuse their observation arrays. See `ObservationCopier`.
     """
-    def __init__(self, processor=None):
+    # Timer hooks of `fit` and `backward`, enabled by `rl2.callbacks.PhaseProfiler`.
+    timer = PhaseTimer()
+
+    def __init__(self, processor=None, check_observations=False):
         self.processor = processor
+        self.check_observations = check_observations
         self.training = False
         self.step = 0
 
@@ -87,6 +96,7 @@ class Agent(object):
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
         self.training = True
+        copy_observation = ObservationCopier(env, check=self.check_observations)
 
         callbacks = [] if not callbacks else callbacks[:]
 
@@ -112,10 +122,12 @@ class Agent(object):
         else:
             callbacks._set_params(params)
         self._on_train_begin()
+        previous_timer = self.__dict__.get('timer')
         callbacks.on_train_begin()
+        timer = self.timer
 
-        episode = np.int16(0)
-        self.step = np.int16(0)
+        episode = 0
+        self.step = 0
         observation = None
         episode_reward = None
         episode_step = None
@@ -124,12 +136,12 @@ class Agent(object):
             while self.step < nb_steps:
                 if observation is None:  # start of a new episode
                     callbacks.on_episode_begin(episode)
-                    episode_step = np.int16(0)
+                    episode_step = 0
                     episode_reward = np.float32(0)
 
                     # Obtain the initial observation by resetting the environment.
                     self.reset_states()
-                    observation = deepcopy(env.reset())
+                    observation = copy_observation(env.reset())
                     if self.processor is not None:
                         observation = self.processor.process_observation(observation)
                     assert observation is not None
@@ -146,13 +158,13 @@ class Agent(object):
                             action = self.processor.process_action(action)
                         callbacks.on_action_begin(action)
                         observation, reward, done, info = env.step(action)
-                        observation = deepcopy(observation)
+                        observation = copy_observation(observation)
                         if self.processor is not None:
                             observation, reward, done, info = self.processor.process_step(observation, reward, done, info)
                         callbacks.on_action_end(action)
                         if done:
                             warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                            observation = deepcopy(env.reset())
+                            observation = copy_observation(env.reset())
                             if self.processor is not None:
                                 observation = self.processor.process_observation(observation)
                             break
@@ -166,16 +178,19 @@ class Agent(object):
                 callbacks.on_step_begin(episode_step)
                 # This is were all of the work happens. We first perceive and compute the action
                 # (forward step) and then use the reward to improve (backward step).
+                start = timer.start()
                 action = self.forward(observation)
+                timer.stop('forward', start)
                 if self.processor is not None:
                     action = self.processor.process_action(action)
                 reward = np.float32(0)
                 accumulated_info = {}
                 done = False
+                start = timer.start()
                 for _ in range(action_repetition):
                     callbacks.on_action_begin(action)
                     observation, r, done, info = env.step(action)
-                    observation = deepcopy(observation)
+                    observation = copy_observation(observation)
                     if self.processor is not None:
                         observation, r, done, info = self.processor.process_step(observation, r, done, info)
                     for key, value in info.items():
@@ -188,10 +203,13 @@ class Agent(object):
                     reward += r
                     if done:
                         break
+                timer.stop('env', start)
                 if nb_max_episode_steps and episode_step >= nb_max_episode_steps - 1:
                     # Force a terminal state.
                     done = True
+                start = timer.start()
                 metrics = self.backward(reward, terminal=done)
+                timer.stop('backward', start)
                 episode_reward += reward
 
                 step_logs = {
@@ -212,8 +230,12 @@ class Agent(object):
                     # resetting the environment. We need to pass in `terminal=False` here since
                     # the *next* state, that is the state of the newly reset environment, is
                     # always non-terminal by convention.
+                    start = timer.start()
                     self.forward(observation)
+                    timer.stop('forward', start)
+                    start = timer.start()
                     self.backward(0., terminal=False)
+                    timer.stop('backward', start)
 
                     # This episode is finished, report and reset.
                     episode_logs = {
@@ -232,6 +254,10 @@ class Agent(object):
             # This is so common that we've built this right into this function, which ensures that
             # the `on_train_end` method is properly called.
             did_abort = True
+        finally:
+            # A timer enabled by a callback (e.g. `PhaseProfiler`) ends with the run, also if the
+            # loop raises and `on_train_end` is skipped.
+            reset_timer(self, previous_timer)
         callbacks.on_train_end(logs={'did_abort': did_abort})
         self._on_train_end()
 
@@ -273,6 +299,7 @@ class Agent(object):
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
         self.training = False
+        copy_observation = ObservationCopier(env, check=self.check_observations)
         self.step = 0
 
         callbacks = [] if not callbacks else callbacks[:]
@@ -306,7 +333,7 @@ class Agent(object):
 
             # Obtain the initial observation by resetting the environment.
             self.reset_states()
-            observation = deepcopy(env.reset())
+            observation = copy_observation(env.reset())
             if self.processor is not None:
                 observation = self.processor.process_observation(observation)
             assert observation is not None
@@ -323,13 +350,13 @@ class Agent(object):
                     action = self.processor.process_action(action)
                 callbacks.on_action_begin(action)
                 observation, r, done, info = env.step(action)
-                observation = deepcopy(observation)
+                observation = copy_observation(observation)
                 if self.processor is not None:
                     observation, r, done, info = self.processor.process_step(observation, r, done, info)
                 callbacks.on_action_end(action)
                 if done:
                     warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                    observation = deepcopy(env.reset())
+                    observation = copy_observation(env.reset())
                     if self.processor is not None:
                         observation = self.processor.process_observation(observation)
                     break
@@ -347,7 +374,7 @@ class Agent(object):
                 for _ in range(action_repetition):
                     callbacks.on_action_begin(action)
                     observation, r, d, info = env.step(action)
-                    observation = deepcopy(observation)
+                    observation = copy_observation(observation)
                     if self.processor is not None:
                         observation, r, d, info = self.processor.process_step(observation, r, d, info)
                     callbacks.on_action_end(action)
@@ -482,7 +509,7 @@ class Agent(object):
     def _on_train_end(self):
         """Callback that is called after training ends."
         """
-        pass
+        stop_prefetching(self)
 
     def _on_test_begin(self):
         """Callback that is called before testing begins."
@@ -600,6 +627,49 @@ class Processor(object):
         return []
 
 
+class ObservationCopier(object):
+    """Copies observations only if the environment may hand out buffers it mutates later.
+
+    Environments that set `fresh_observations = True` return a new array from every `reset` and
+    `step`, so the observation is passed on as is. All other environments are copied with
+    `deepcopy`.
+
+    # Arguments
+        env (`Env` instance): The environment the observations come from.
+        check (boolean): If `True`, verify the `fresh_observations` promise. An observation that
+            is the previous object again, shares memory with `env.state` or was changed in place
+            since it was returned triggers a warning, and every later observation is copied.
+    """
+    def __init__(self, env, check=False):
+        self.env = env
+        self.check = check
+        self.copy = not getattr(env, 'fresh_observations', False)
+        self._last = None
+        self._snapshot = None
+
+    def __call__(self, observation):
+        if not self.copy and self.check:
+            self._check(observation)
+        if self.copy:
+            return deepcopy(observation)
+        return observation
+
+    def _check(self, observation):
+        aliased = observation is self._last
+        if self._last is not None and not np.array_equal(self._last, self._snapshot):
+            aliased = True
+        state = getattr(self.env, 'state', None)
+        if isinstance(observation, np.ndarray) and isinstance(state, np.ndarray):
+            aliased = aliased or np.may_share_memory(observation, state)
+        if aliased:
+            warnings.warn('{} sets `fresh_observations` but reuses or mutates its observations. Falling back to copying every observation.'.format(type(self.env).__name__))
+            self.copy = True
+            self._last = self._snapshot = None
+            return
+        self._last = observation
+        self._snapshot = np.array(observation, copy=True)
+
+
 # Note: the API of the `Env` and `Space` classes are taken from the OpenAI Gym implementation.
 # https://github.com/openai/gym/blob/master/gym/core.py
 
@@ -622,6 +692,8 @@ class Env(object):
     reward_range = (-np.inf, np.inf)
     action_space = None
     observation_space = None
+    # Set to `True` if `step` and `reset` always return a newly allocated observation.
+    fresh_observations = False
 
     def step(self, action):
         """Run one timestep of the environment's dynamics.
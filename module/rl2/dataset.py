@@ -0,0 +1,348 @@
+"""Columnar on-disk datasets of transitions for offline RL.
+
+A dataset is a directory with a `header.json` and one `.npy` file per column:
+
+    s     observation before the decision
+    u     input held over the interval (the action without `tau`)
+    tau   length of the interval
+    r     reward of the decision
+    s1    observation after the interval
+    done  1 if `s1` is terminal
+    t     episode time at the decision (NaN if unknown)
+
+`TransitionWriter` appends rows and keeps the `.npy` headers up to date, so a dataset can be
+read (memory-mapped) while it grows and extended later. `TransitionDataset` maps the columns
+with `np.load(mmap_mode='r')`, so only the rows of a minibatch are read from disk.
+"""
+from __future__ import division
+import json
+import os
+import struct
+
+import numpy as np
+from keras2.utils.data_utils import Sequence
+
+from rl2.callbacks import Callback
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+COLUMNS = ('s', 'u', 'tau', 'r', 's1', 'done', 't')
+HEADER = 'header.json'
+
+# Fixed size of the `.npy` headers, so that the shape can be rewritten in place.
+_NPY_HEADER_SIZE = 128
+
+
+def _npy_header(dtype, shape):
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple(shape))
+    header = header.ljust(_NPY_HEADER_SIZE - 11) + '\n'
+    if len(header) > _NPY_HEADER_SIZE - 10:
+        raise ValueError('The .npy header of shape {} does not fit into {} bytes.'.format(
+            tuple(shape), _NPY_HEADER_SIZE))
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class TransitionWriter(object):
+    """Appends transitions to a dataset directory, creating it if needed
+
+    The shapes of the columns are taken from the first row. Rows are buffered and written every
+    `buffer_size` rows, by `flush` and by `close`.
+
+    # Arguments
+        path (str): Dataset directory. If it holds a dataset, rows are appended to it.
+        dtype (str): Type of the float columns.
+        metadata (dict): JSON-serializable description stored in the header, e.g. env and
+            reward parameters.
+        buffer_size (integer): Number of rows kept in memory before writing.
+    """
+    def __init__(self, path, dtype='float32', metadata=None, buffer_size=4096):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = {name: [] for name in COLUMNS}
+        self.files = {}
+        if os.path.exists(os.path.join(path, HEADER)):
+            with open(os.path.join(path, HEADER)) as f:
+                self.header = json.load(f)
+            if metadata:
+                self.header['metadata'].update(metadata)
+        else:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self.header = {'version': 1, 'length': 0, 'dtype': dtype, 'columns': None,
+                           'metadata': dict(metadata or {})}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.header['length'] + len(self.buffer['r'])
+
+    def append(self, s, u, tau, r, s1, done, t=np.nan):
+        """Appends one transition, see the module docstring for the columns."""
+        row = {'s': s, 'u': u, 'tau': tau, 'r': r, 's1': s1, 'done': done, 't': t}
+        for name in COLUMNS:
+            self.buffer[name].append(row[name])
+        if len(self.buffer['r']) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, s, u, tau, r, s1, done, t=None):
+        """Appends a batch of transitions given as stacked arrays."""
+        self.flush()
+        t = np.full(len(r), np.nan) if t is None else t
+        self._write({'s': s, 'u': u, 'tau': tau, 'r': r, 's1': s1, 'done': done, 't': t})
+
+    def _open(self, rows):
+        dtype = self.header['dtype']
+        if self.header['columns'] is None:
+            self.header['columns'] = {}
+            for name in COLUMNS:
+                shape = np.shape(rows[name])[1:]
+                self.header['columns'][name] = {'dtype': 'uint8' if name == 'done' else dtype,
+                                                'shape': list(shape)}
+        for name, spec in self.header['columns'].items():
+            filepath = os.path.join(self.path, name + '.npy')
+            if not os.path.exists(filepath):
+                with open(filepath, 'wb') as f:
+                    f.write(_npy_header(spec['dtype'], [0] + spec['shape']))
+            f = open(filepath, 'r+b')
+            f.seek(_NPY_HEADER_SIZE + self.header['length'] * np.dtype(spec['dtype']).itemsize *
+                   int(np.prod(spec['shape'])))
+            self.files[name] = f
+
+    def _write(self, rows):
+        if len(rows['r']) == 0:
+            return
+        if not self.files:
+            self._open(rows)
+        length = None
+        for name, spec in self.header['columns'].items():
+            data = np.asarray(rows[name], dtype=spec['dtype'])
+            if list(data.shape[1:]) != spec['shape']:
+                raise ValueError('Column "{}" has shape {}, expected {}.'.format(
+                    name, list(data.shape[1:]), spec['shape']))
+            if length is not None and len(data) != length:
+                raise ValueError('All columns need the same number of rows.')
+            length = len(data)
+            self.files[name].write(np.ascontiguousarray(data).tobytes())
+        self.header['length'] += length
+        self._write_headers()
+
+    def _write_headers(self):
+        for name, spec in self.header['columns'].items():
+            f = self.files[name]
+            position = f.tell()
+            f.seek(0)
+            f.write(_npy_header(spec['dtype'], [self.header['length']] + spec['shape']))
+            f.seek(position)
+            f.flush()
+        with open(os.path.join(self.path, HEADER), 'w') as f:
+            json.dump(self.header, f, indent=2, sort_keys=True)
+
+    def flush(self):
+        rows = self.buffer
+        self.buffer = {name: [] for name in COLUMNS}
+        self._write(rows)
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+def write_memory(writer, memory, tau_index=1, chunk_size=10000):
+    """Appends all transitions of a replay memory to `writer`
+
+    `tau` and `t` are taken from the memory's `tau` and `episode_time` columns if it has them
+    (see `rl2.memory.TIME_COLUMNS`), otherwise `tau` is the action's entry `tau_index` and `t`
+    is unknown. The window axis of the states is dropped for `window_length` 1.
+
+    # Arguments
+        writer (`TransitionWriter` instance): Destination.
+        memory (`SequentialMemory` instance): Source, e.g. `agent.memory`.
+        tau_index (integer): Entry of the action that holds `tau`, `None` if it has none.
+        chunk_size (integer): Number of transitions read from the memory at once.
+    """
+    # Same transitions as the memory samples from: the first ones and the ones that start right
+    # after a reset are left out.
+    idxs = np.arange(memory.window_length, memory.nb_entries - 1)
+    if hasattr(memory, '_terminal'):
+        restart = memory._terminal(idxs - 1)
+    else:
+        restart = np.array([memory.terminals[idx - 1] for idx in idxs], dtype=bool)
+    all_idxs = idxs[~restart]
+    for start in range(0, len(all_idxs), chunk_size):
+        idxs = all_idxs[start:start + chunk_size]
+        if hasattr(memory, 'sample_arrays'):
+            state0, action, reward, state1, terminal1, columns = memory.sample_arrays(len(idxs), idxs, columns=True)
+        else:
+            experiences, columns = memory.sample_columns(len(idxs), idxs)
+            state0 = np.array([e.state0 for e in experiences])
+            action = np.array([e.action for e in experiences])
+            reward = np.array([e.reward for e in experiences])
+            state1 = np.array([e.state1 for e in experiences])
+            terminal1 = np.array([0. if e.terminal1 else 1. for e in experiences])
+        if memory.window_length == 1:
+            state0, state1 = state0[:, 0], state1[:, 0]
+        action = np.asarray(action).reshape(len(idxs), -1)
+        if 'tau' in columns:
+            tau = columns['tau']
+        else:
+            tau = action[:, tau_index] if tau_index is not None else np.full(len(idxs), np.nan)
+        if tau_index is not None:
+            action = np.delete(action, tau_index, axis=1)
+        t = columns.get('episode_time')
+        writer.extend(state0, action, tau, reward, state1, 1. - np.asarray(terminal1), t)
+
+
+class DatasetRecorder(Callback):
+    """Writes every decision of a `RolloutEngine` run (e.g. `agent.fit`) to a `TransitionWriter`
+
+    The state before a decision is the observation after the previous one, or the observation
+    the episode starts from, which the engine passes to `on_step_begin`. The rest is read from
+    the step logs. The writer is flushed, not closed, when training ends.
+    """
+    def __init__(self, writer):
+        super(DatasetRecorder, self).__init__()
+        self.writer = writer
+        self.pending = None
+        self.state = None
+        self.time = 0.
+
+    def _write_pending(self, done):
+        if self.pending is not None:
+            self.writer.append(done=done, **self.pending)
+        self.pending = None
+
+    def on_episode_begin(self, episode, logs={}):
+        self.state = None
+        self.time = 0.
+
+    def on_step_begin(self, step, logs={}):
+        self._write_pending(False)
+        if self.state is None:
+            self.state = np.array(logs['observation'], dtype=np.float64)
+
+    def on_step_end(self, step, logs={}):
+        decision = logs['decision']
+        tau = np.nan if decision.tau is None else decision.tau
+        u = np.ravel(decision.action)
+        observation = np.array(logs['observation'], dtype=np.float64)
+        self.pending = {'s': self.state, 'u': u, 'tau': tau, 'r': logs['reward'],
+                        's1': observation, 't': self.time}
+        self.state = observation
+        if decision.tau is not None:
+            self.time += decision.tau
+
+    def on_episode_end(self, episode, logs={}):
+        self._write_pending(True)
+
+    def on_train_end(self, logs={}):
+        self._write_pending(False)
+        self.writer.flush()
+
+
+class TransitionDataset(object):
+    """Memory-mapped reader of a dataset written by `TransitionWriter`
+
+    # Arguments
+        path (str): Dataset directory.
+        mmap_mode (str): Passed to `np.load`, `None` loads the columns into memory.
+    """
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        with open(os.path.join(path, HEADER)) as f:
+            self.header = json.load(f)
+        self.metadata = self.header['metadata']
+        self.columns = {}
+        if self.header['columns'] is not None:
+            for name in self.header['columns']:
+                self.columns[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return self.header['length']
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def get(self, idxs, columns=COLUMNS):
+        """Returns the given rows of the given columns as a tuple of arrays."""
+        # Sorted reads touch the memory-mapped files front to back.
+        order = np.argsort(idxs)
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        sorted_idxs = np.asarray(idxs)[order]
+        return tuple(np.asarray(self.columns[name][sorted_idxs])[inverse] for name in columns)
+
+    def sample(self, batch_size, columns=COLUMNS):
+        """Returns a random minibatch, drawn with replacement, see `get`."""
+        return self.get(np.random.randint(0, len(self), size=batch_size), columns)
+
+    def batches(self, batch_size, columns=COLUMNS, shuffle=True):
+        """Yields the minibatches of one epoch, see `get`."""
+        idxs = np.random.permutation(len(self)) if shuffle else np.arange(len(self))
+        for start in range(0, len(self), batch_size):
+            yield self.get(idxs[start:start + batch_size], columns)
+
+    def arrays(self, tau_index=1):
+        """Returns `(state0, action, reward, state1, terminal1)` like `memory.sample_arrays`
+
+        The states stay memory-mapped. `action` has `tau` inserted back at `tau_index`, so the
+        result can be passed to `rl2.offline.OfflineCriticTrainer.fit`.
+        """
+        action = np.asarray(self.columns['u'])
+        if tau_index is not None:
+            action = np.insert(action, tau_index, np.asarray(self.columns['tau']), axis=1)
+        return (self.columns['s'], action, np.asarray(self.columns['r']), self.columns['s1'],
+                1. - np.asarray(self.columns['done'], dtype=np.float64))
+
+    def to_hdf5(self, filepath, chunk_size=65536):
+        """Copies the columns into one HDF5 file, e.g. to read them with
+        `keras.utils.io_utils.HDF5Matrix(filepath, 's')`.
+        """
+        if h5py is None:
+            raise ImportError('`to_hdf5` requires h5py.')
+        with h5py.File(filepath, 'w') as f:
+            for key, value in self.metadata.items():
+                f.attrs[key] = json.dumps(value)
+            for name, data in self.columns.items():
+                dataset = f.create_dataset(name, shape=data.shape, dtype=data.dtype)
+                for start in range(0, len(data), chunk_size):
+                    dataset[start:start + chunk_size] = data[start:start + chunk_size]
+
+
+class TransitionSequence(Sequence):
+    """Shuffled epochs of a `TransitionDataset` as a keras `Sequence`
+
+    Each item is a tuple of minibatch arrays of `columns`, so it can be consumed by the keras
+    enqueuers, e.g. to prepare batches in background workers.
+
+    # Arguments
+        dataset (`TransitionDataset` instance): Source of the rows.
+        batch_size (integer): Rows per item.
+        columns (tuple): Columns of each item.
+        shuffle (boolean): Draw a new permutation at the end of every epoch.
+    """
+    def __init__(self, dataset, batch_size=32, columns=COLUMNS, shuffle=True):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.columns = columns
+        self.shuffle = shuffle
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.dataset) / self.batch_size))
+
+    def __getitem__(self, idx):
+        rows = self.idxs[idx * self.batch_size:(idx + 1) * self.batch_size]
+        return self.dataset.get(rows, self.columns)
+
+    def on_epoch_end(self):
+        self.idxs = np.random.permutation(len(self.dataset)) if self.shuffle else np.arange(len(self.dataset))
@@ -0,0 +1,347 @@
+"""Ground-truth Q tables of the 2-D plants by dynamic programming on (state, u, tau) grids.
+
+Every grid state is rolled out for every grid input and interval at once (`pendulum_interval`,
+`linear_interval`), the end states are mapped to interpolation indices and weights of the
+state grid, and Bellman backups become gathers (`GridDP.backup`) or one sparse linear solve
+per policy (`GridDP.evaluate`). Results are stored as a `QTable` in one `.npz` file.
+
+Rewards follow `rl2.evaluation`: one decision earns `dt * sum_p exp(-alpha * p * dt) * r_p - beta`
+and the next one is discounted by `exp(-alpha * tau)`. The DP plants are noise free.
+"""
+from __future__ import division
+import functools
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+from rl2.evaluation import INPUT_COST, STATE_COST
+
+
+def _nb_substeps(tau, dt, substeps_per_unit):
+    if dt is not None:
+        nb = np.maximum(1, np.ceil(np.round(tau / dt, 9))).astype(int)
+        return nb, np.full(nb.shape, dt, dtype=np.float64)
+    nb = np.maximum(1, np.ceil(substeps_per_unit * tau)).astype(int)
+    return nb, tau / nb
+
+
+def _angle_normalize(x):
+    return ((x + np.pi) % (2 * np.pi)) - np.pi
+
+
+def pendulum_interval(states, u, tau, alpha=.4, dt=None, substeps_per_unit=20, g=10., m=1., l=1.,
+                      max_speed=2 * np.pi, ln=0., random_state=None):
+    """Holds `u` for `tau` on `PendulumEnv2` for a batch of rows
+
+    # Arguments
+        states (np.ndarray): `(N, 2)` rows `(theta, theta_dot)`.
+        u (np.ndarray): `(N,)` inputs.
+        tau (np.ndarray): `(N,)` intervals.
+        alpha (float): Discount rate per unit of time.
+        dt, substeps_per_unit: See `rl2.evaluation.substeps`.
+        ln (float): Noise level, as passed to `env.step`. Noise free by default.
+        random_state (np.random.RandomState): Source of the noise, `np.random` if `None`.
+
+    # Returns
+        `(next_states, reward)`, where `reward` is the discounted integral of the running reward.
+    """
+    rng = np.random if random_state is None else random_state
+    th, thdot = np.array(states, dtype=np.float64).T
+    u = np.asarray(u, dtype=np.float64)
+    nb, h = _nb_substeps(np.asarray(tau, dtype=np.float64), dt, substeps_per_unit)
+    reward = np.zeros(len(th))
+    for p in range(nb.max()):
+        active = p < nb
+        costs = _angle_normalize(th) ** 2 + .1 * thdot ** 2 + .01 * (u ** 2)
+        reward -= np.where(active, np.exp(-alpha * p * h) * costs, 0.)
+        newthdot = thdot + (- 3 * g / (2 * l) * np.sin(th + np.pi) + 3. / (m * l ** 2) * u) * h
+        newth = th + newthdot * h
+        if ln:
+            newth += ln * 0.5 * rng.randn(len(th)) * np.sqrt(h)
+            newthdot += ln * 0.5 * rng.randn(len(th)) * np.sqrt(h)
+        newth = _angle_normalize(newth)
+        newthdot = np.clip(newthdot, -max_speed, max_speed)
+        th = np.where(active, newth, th)
+        thdot = np.where(active, newthdot, thdot)
+    return np.stack([th, thdot], axis=1), reward * h
+
+
+def linear_interval(states, u, tau, alpha=.4, dt=None, substeps_per_unit=20, A=None, B=None, D=None, clip=7.,
+                    ln=0., random_state=None):
+    """Holds `u` for `tau` on `LinearEnv` for a batch of rows, see `pendulum_interval`."""
+    rng = np.random if random_state is None else random_state
+    A = np.array([[-1, 4], [2, -3]], dtype=np.float64) if A is None else np.asarray(A, dtype=np.float64)
+    B = np.array([2, 4], dtype=np.float64) if B is None else np.asarray(B, dtype=np.float64)
+    D = np.array([.6, .3], dtype=np.float64) if D is None else np.asarray(D, dtype=np.float64)
+    x = np.array(states, dtype=np.float64)
+    u = np.asarray(u, dtype=np.float64)
+    nb, h = _nb_substeps(np.asarray(tau, dtype=np.float64), dt, substeps_per_unit)
+    reward = np.zeros(len(x))
+    for p in range(nb.max()):
+        active = p < nb
+        costs = STATE_COST * np.sum(x ** 2, axis=1) + INPUT_COST * u ** 2
+        reward -= np.where(active, np.exp(-alpha * p * h) * costs, 0.)
+        x_prime = x + h[:, None] * (np.dot(x, A.T) + u[:, None] * B)
+        if ln:
+            # One scalar disturbance on both states, as in `LinearEnv.step`.
+            x_prime += (ln * np.sqrt(h) * np.dot(rng.randn(len(x), len(D)), D))[:, None]
+        x_prime = np.clip(x_prime, -clip, clip)
+        x = np.where(active[:, None], x_prime, x)
+    return x, reward * h
+
+
+class StateGrid(object):
+    """Regular grid over a box of states with multilinear interpolation
+
+    # Arguments
+        low (np.ndarray): Lower corner of the box.
+        high (np.ndarray): Upper corner of the box.
+        num (tuple): Number of points per dimension.
+        periodic (tuple): Per dimension, `True` if it wraps around (e.g. an angle). The last
+            point of a periodic dimension is then `high - (high - low) / num`.
+    """
+    def __init__(self, low, high, num, periodic=None):
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.num = tuple(int(n) for n in num)
+        self.periodic = tuple(bool(p) for p in periodic) if periodic is not None else (False,) * len(self.num)
+        self.step = np.array([(hi - lo) / (n if p else n - 1)
+                              for lo, hi, n, p in zip(self.low, self.high, self.num, self.periodic)])
+
+    @property
+    def size(self):
+        return int(np.prod(self.num))
+
+    def axes(self):
+        return [lo + s * np.arange(n) for lo, s, n in zip(self.low, self.step, self.num)]
+
+    def points(self):
+        """Returns the `(size, d)` grid states in C order."""
+        mesh = np.meshgrid(*self.axes(), indexing='ij')
+        return np.stack([m.reshape(-1) for m in mesh], axis=1)
+
+    def interpolation(self, states):
+        """Flat indices and weights of the `2**d` grid points around each state
+
+        States outside a non-periodic dimension are clipped to the box.
+
+        # Returns
+            `(idxs, weights)`, both `(N, 2**d)`.
+        """
+        states = np.atleast_2d(states)
+        d = len(self.num)
+        lower, frac = [], []
+        for i in range(d):
+            pos = (states[:, i] - self.low[i]) / self.step[i]
+            if not self.periodic[i]:
+                pos = np.clip(pos, 0., self.num[i] - 1.)
+            base = np.floor(pos)
+            if not self.periodic[i]:
+                base = np.minimum(base, self.num[i] - 2)
+            lower.append(base.astype(np.int64))
+            frac.append(pos - base)
+        idxs = np.zeros((len(states), 2 ** d), dtype=np.int64)
+        weights = np.ones((len(states), 2 ** d))
+        for corner in range(2 ** d):
+            for i in range(d):
+                bit = (corner >> (d - 1 - i)) & 1
+                index = lower[i] + bit
+                index = index % self.num[i] if self.periodic[i] else index
+                idxs[:, corner] = idxs[:, corner] * self.num[i] + index
+                weights[:, corner] *= frac[i] if bit else 1. - frac[i]
+        return idxs, weights
+
+    def get_config(self):
+        return {'low': self.low, 'high': self.high, 'num': np.array(self.num),
+                'periodic': np.array(self.periodic)}
+
+
+class GridDP(object):
+    """Bellman backups of a plant on a grid of states, inputs and intervals
+
+    The constructor rolls out all `grid.size * len(us) * len(taus)` decisions once and keeps
+    their rewards and interpolated successors as `(S, U, T)` and `(S, U, T, 2**d)` arrays.
+
+    # Arguments
+        interval (function): Batched plant, e.g. `functools.partial(pendulum_interval, alpha=.4)`.
+        grid (`StateGrid` instance): Grid of states.
+        us (np.ndarray): Grid of inputs.
+        taus (np.ndarray): Grid of intervals.
+        alpha (float): Discount rate per unit of time, must match the one of `interval`.
+        beta (float): Cost per decision.
+    """
+    def __init__(self, interval, grid, us, taus, alpha=.4, beta=1.):
+        self.interval = interval
+        self.grid = grid
+        self.us = np.asarray(us, dtype=np.float64)
+        self.taus = np.asarray(taus, dtype=np.float64)
+        self.alpha = alpha
+        self.beta = beta
+        self.discounts = np.exp(-alpha * self.taus)
+
+        shape = (grid.size, len(self.us), len(self.taus))
+        states = np.repeat(grid.points(), len(self.us) * len(self.taus), axis=0)
+        u = np.tile(np.repeat(self.us, len(self.taus)), grid.size)
+        tau = np.tile(self.taus, grid.size * len(self.us))
+        next_states, reward = interval(states, u, tau)
+        idxs, weights = grid.interpolation(next_states)
+        self.rewards = (reward - beta).reshape(shape)
+        self.idxs = idxs.astype(np.int32).reshape(shape + (-1,))
+        self.weights = weights.astype(np.float32).reshape(shape + (-1,))
+
+    def backup(self, V):
+        """Returns the `(S, U, T)` Q values of one grid decision followed by `V`."""
+        next_values = np.sum(self.weights * V[self.idxs], axis=-1)
+        return self.rewards + self.discounts * next_values
+
+    def _solve(self, rewards, discounts, idxs, weights):
+        # V = r + gamma P V as one sparse system.
+        S = self.grid.size
+        rows = np.repeat(np.arange(S), idxs.shape[-1])
+        P = scipy.sparse.csr_matrix((weights.reshape(-1).astype(np.float64), (rows, idxs.reshape(-1))), shape=(S, S))
+        system = scipy.sparse.identity(S, format='csr') - scipy.sparse.diags(discounts).dot(P)
+        return scipy.sparse.linalg.spsolve(system.tocsc(), rewards)
+
+    def evaluate(self, policy):
+        """Exact value of a policy on the grid states
+
+        # Arguments
+            policy (function or np.ndarray): Either a function mapping a `(N, d)` batch of
+                states to `(N, 2)` rows `(u, tau)`, e.g. an actor, whose decisions are rolled
+                out as they are, or `(S, 2)` indices into `us` and `taus`.
+
+        # Returns
+            `(S,)` array of values.
+        """
+        if callable(policy):
+            actions = np.asarray(policy(self.grid.points()), dtype=np.float64)
+            next_states, reward = self.interval(self.grid.points(), actions[:, 0], actions[:, 1])
+            idxs, weights = self.grid.interpolation(next_states)
+            return self._solve(reward - self.beta, np.exp(-self.alpha * actions[:, 1]), idxs, weights)
+        policy = np.asarray(policy)
+        s = np.arange(self.grid.size)
+        return self._solve(self.rewards[s, policy[:, 0], policy[:, 1]], self.discounts[policy[:, 1]],
+                           self.idxs[s, policy[:, 0], policy[:, 1]], self.weights[s, policy[:, 0], policy[:, 1]])
+
+    def greedy(self, Q):
+        """Returns the `(S, 2)` indices of the best `(u, tau)` per state."""
+        flat = np.argmax(Q.reshape(len(Q), -1), axis=1)
+        return np.stack(np.unravel_index(flat, Q.shape[1:]), axis=1)
+
+    def policy_iteration(self, policy=None, max_iterations=100, verbose=False):
+        """Optimal values by policy iteration, starting from `policy` (indices, default all zeros)
+
+        # Returns
+            A `QTable` of the optimal Q values.
+        """
+        policy = np.zeros((self.grid.size, 2), dtype=np.int64) if policy is None else np.asarray(policy)
+        for iteration in range(max_iterations):
+            V = self.evaluate(policy)
+            Q = self.backup(V)
+            new_policy = self.greedy(Q)
+            changed = np.sum(np.any(new_policy != policy, axis=1))
+            if verbose:
+                print('iteration {}: {} states changed their decision'.format(iteration, changed))
+            policy = new_policy
+            if changed == 0:
+                break
+        return self.table(Q)
+
+    def value_iteration(self, V=None, tol=1e-6, max_iterations=10000, verbose=False):
+        """Optimal values by value iteration until the largest change is below `tol`
+
+        # Returns
+            A `QTable` of the optimal Q values.
+        """
+        V = np.zeros(self.grid.size) if V is None else V
+        for iteration in range(max_iterations):
+            Q = self.backup(V)
+            new_V = Q.reshape(len(Q), -1).max(axis=1)
+            delta = np.max(np.abs(new_V - V))
+            V = new_V
+            if verbose and iteration % 100 == 0:
+                print('iteration {}: max change {:.3e}'.format(iteration, delta))
+            if delta < tol:
+                break
+        return self.table(self.backup(V))
+
+    def policy_q(self, policy):
+        """Returns the `QTable` of one grid decision followed by `policy`, see `evaluate`."""
+        return self.table(self.backup(self.evaluate(policy)))
+
+    def table(self, Q):
+        return QTable(self.grid, self.us, self.taus, Q, alpha=self.alpha, beta=self.beta)
+
+
+def pendulum_dp(env=None, num=(61, 61), us=None, taus=None, alpha=.4, beta=1., dt=None, substeps_per_unit=20):
+    """`GridDP` of `PendulumEnv2` over `[-pi, pi) x [-2 pi, 2 pi]`, with the env's parameters if given."""
+    params = {} if env is None else {'g': env.g, 'm': env.m, 'l': env.l, 'max_speed': env.max_speed}
+    max_speed = params.get('max_speed', 2 * np.pi)
+    grid = StateGrid([-np.pi, -max_speed], [np.pi, max_speed], num, periodic=(True, False))
+    us = np.linspace(-10., 10., 21) if us is None else us
+    taus = np.linspace(.01, 1., 12) if taus is None else taus
+    interval = functools.partial(pendulum_interval, alpha=alpha, dt=dt, substeps_per_unit=substeps_per_unit, **params)
+    return GridDP(interval, grid, us, taus, alpha=alpha, beta=beta)
+
+
+def linear_dp(env=None, num=(57, 57), us=None, taus=None, alpha=.4, beta=1., dt=None, substeps_per_unit=20):
+    """`GridDP` of `LinearEnv` over `[-7, 7]^2`, with the env's `A` and `B` if given."""
+    params = {} if env is None else {'A': env.A, 'B': env.B}
+    grid = StateGrid([-7., -7.], [7., 7.], num)
+    us = np.linspace(-10., 10., 21) if us is None else us
+    taus = np.linspace(.01, 1., 12) if taus is None else taus
+    interval = functools.partial(linear_interval, alpha=alpha, dt=dt, substeps_per_unit=substeps_per_unit, **params)
+    return GridDP(interval, grid, us, taus, alpha=alpha, beta=beta)
+
+
+class QTable(object):
+    """Q values on a `(state, u, tau)` grid, for validating critics
+
+    # Arguments
+        grid (`StateGrid` instance): Grid of states.
+        us (np.ndarray): Grid of inputs.
+        taus (np.ndarray): Grid of intervals.
+        Q (np.ndarray): `(grid.size, len(us), len(taus))` values.
+    """
+    def __init__(self, grid, us, taus, Q, alpha=.4, beta=1.):
+        self.grid = grid
+        self.us = np.asarray(us)
+        self.taus = np.asarray(taus)
+        self.Q = np.asarray(Q)
+        self.alpha = alpha
+        self.beta = beta
+
+    @property
+    def V(self):
+        return self.Q.reshape(len(self.Q), -1).max(axis=1)
+
+    def _nearest(self, grid, values):
+        idxs = np.clip(np.searchsorted(grid, values), 1, len(grid) - 1)
+        return np.where(np.abs(values - grid[idxs - 1]) <= np.abs(values - grid[idxs]), idxs - 1, idxs)
+
+    def q_value(self, states, u, tau):
+        """Q values of a batch, multilinear in the state and nearest on the `u` and `tau` grids."""
+        idxs, weights = self.grid.interpolation(states)
+        u = np.broadcast_to(u, (len(idxs),))
+        tau = np.broadcast_to(tau, (len(idxs),))
+        q = self.Q[idxs, self._nearest(self.us, u)[:, None], self._nearest(self.taus, tau)[:, None]]
+        return np.sum(weights * q, axis=1)
+
+    def value(self, states):
+        """Optimal values of a batch of states, multilinear in the state."""
+        idxs, weights = self.grid.interpolation(states)
+        return np.sum(weights * self.V[idxs], axis=1)
+
+    def save(self, filepath):
+        """Stores the table as a compressed `.npz` file with float32 values."""
+        config = self.grid.get_config()
+        np.savez_compressed(filepath, Q=self.Q.astype(np.float32), us=self.us, taus=self.taus,
+                            alpha=self.alpha, beta=self.beta, **config)
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath) as data:
+            grid = StateGrid(data['low'], data['high'], data['num'], periodic=data['periodic'])
+            return cls(grid, data['us'], data['taus'], data['Q'],
+                       alpha=float(data['alpha']), beta=float(data['beta']))
@@ -0,0 +1,246 @@
+"""Ground-truth value functions of self-triggered policies on `LinearEnv`.
+
+For a linear feedback `u = K x` held for a fixed interval `tau`, the discounted cost of the
+Euler-discretized plant is a quadratic form plus a constant, which one discrete Lyapunov equation
+gives for all states at once (`LinearPolicyEvaluator`). Any other policy, e.g. an actor network,
+is evaluated by simulating all states of a grid side by side (`monte_carlo_value`).
+
+Rewards follow the notebooks: one decision earns
+`dt * sum_p exp(-alpha * p * dt) * r_p - beta` over its sub-steps and is discounted by
+`exp(-alpha * t)` at its start time `t`.
+"""
+from __future__ import division
+
+import numpy as np
+import scipy.linalg
+
+# Running cost of `LinearEnv`: .1 * |x|^2 + .01 * u^2
+STATE_COST = .1
+INPUT_COST = .01
+
+
+def substeps(tau, dt=None, substeps_per_unit=20):
+    """Number and length of the Euler sub-steps of one interval
+
+    # Arguments
+        tau (float): Length of the interval.
+        dt (float): Fixed sub-step length as in the notebooks (`ceil(tau / dt)` sub-steps).
+            If `None`, the interval is split like `rl2.rollout.SelfTrigger` does.
+        substeps_per_unit (integer): See `rl2.rollout.SelfTrigger`.
+
+    # Returns
+        `(nb_substeps, dt)`
+    """
+    if dt is not None:
+        return max(1, int(np.ceil(np.round(tau / dt, 9)))), dt
+    nb_substeps = max(1, int(np.ceil(substeps_per_unit * tau)))
+    return nb_substeps, tau / nb_substeps
+
+
+def state_grid(low=-7., high=7., num=20):
+    """Returns the `(num**2, 2)` states of the meshgrid used in the notebooks."""
+    s1, s2 = np.meshgrid(np.linspace(low, high, num), np.linspace(low, high, num))
+    return np.stack([s1.flatten(), s2.flatten()], axis=1)
+
+
+def linearize_policy(policy, x0=None, eps=1e-4):
+    """Linearizes a policy around `x0` by central differences
+
+    # Arguments
+        policy (function): Maps a `(N, n)` batch of states to `(N, 2)` rows `(u, tau)`.
+        x0 (np.ndarray): Linearization point, the origin by default.
+        eps (float): Finite difference step.
+
+    # Returns
+        `(K, tau)` with `u ~= u(x0) + K (x - x0)` and the interval chosen at `x0`.
+    """
+    x0 = np.zeros(2) if x0 is None else np.asarray(x0, dtype=np.float64)
+    n = x0.shape[0]
+    probes = np.concatenate([x0[None], x0 + eps * np.eye(n), x0 - eps * np.eye(n)])
+    out = np.asarray(policy(probes), dtype=np.float64)
+    K = (out[1:n + 1, 0] - out[n + 1:, 0]) / (2. * eps)
+    return K, float(out[0, 1])
+
+
+class LinearPolicyEvaluator(object):
+    """Exact V(x) and Q(x, u, tau) of a linear feedback on `LinearEnv`
+
+    Within an interval the env integrates `x <- (I + dt A) x + dt B u + ln D.w sqrt(dt)`,
+    where `D.w` is one scalar disturbance added to both states. Over the sub-steps, mean and
+    covariance of the state are linear in `(x, u)`, so the expected reward of a decision is
+    `-[x; u]^T M [x; u] - c(tau)` and the next state is `Phi [x; u]` plus noise. With `u = K x`
+    and a fixed `tau` the value is `V(x) = -x^T P x - v0`, where `P` solves the discrete
+    Lyapunov equation `P = M_K + gamma Phi_K^T P Phi_K` with `gamma = exp(-alpha tau)`.
+
+    The clipping of the state to `[-7, 7]` is not modelled, i.e. the result is exact as long as
+    the trajectories stay inside the box (always the case without noise for a stabilizing `K`
+    started inside the region where `|x|` decreases).
+
+    # Arguments
+        env (LinearEnv): Plant providing `A`, `B` and `D`.
+        K (np.ndarray): Feedback gain, `u = K x`.
+        tau (float): Interval the input is held for.
+        alpha (float): Discount rate per unit of time.
+        beta (float): Cost per decision.
+        ln (float): Noise level, as passed to `env.step`.
+        dt (float): See `substeps`.
+        substeps_per_unit (integer): See `substeps`.
+        nb_decisions (integer): Horizon in decisions. If `None`, the infinite horizon value.
+    """
+    def __init__(self, env, K, tau, alpha=.4, beta=1., ln=1., dt=None, substeps_per_unit=20, nb_decisions=None):
+        self.A = np.asarray(env.A, dtype=np.float64)
+        self.B = np.asarray(env.B, dtype=np.float64).reshape(-1)
+        self.D = np.asarray(env.D, dtype=np.float64).reshape(-1)
+        self.K = np.asarray(K, dtype=np.float64).reshape(-1)
+        self.tau = tau
+        self.alpha = alpha
+        self.beta = beta
+        self.ln = ln
+        self.dt = dt
+        self.substeps_per_unit = substeps_per_unit
+        self.nb_decisions = nb_decisions
+        self._intervals = {}
+        self.P, self.v0 = self._solve()
+
+    def interval(self, tau):
+        """Moments of one decision held for `tau`, cached per `tau`
+
+        # Returns
+            `(M, c, Phi, Sigma)`: the expected cost of the decision is `z^T M z + c` for
+            `z = [x; u]`, the next state has mean `Phi z` and covariance `Sigma`.
+        """
+        tau = float(tau)
+        if tau not in self._intervals:
+            self._intervals[tau] = self._interval(tau)
+        return self._intervals[tau]
+
+    def _interval(self, tau):
+        n = self.A.shape[0]
+        nb_substeps, dt = substeps(tau, self.dt, self.substeps_per_unit)
+        Ad = np.eye(n) + dt * self.A
+        Bd = dt * self.B
+        noise = self.ln**2 * dt * np.dot(self.D, self.D) * np.ones((n, n))
+        cost = np.diag(np.concatenate([STATE_COST * np.ones(n), [INPUT_COST]]))
+
+        F = np.eye(n, n + 1)  # state after p sub-steps is F [x; u] + noise
+        Sigma = np.zeros((n, n))
+        M = np.zeros((n + 1, n + 1))
+        c = 0.
+        for p in range(nb_substeps):
+            weight = dt * np.exp(-self.alpha * p * dt)
+            Fu = np.vstack([F, np.eye(1, n + 1, n)])
+            M += weight * np.dot(np.dot(Fu.T, cost), Fu)
+            c += weight * STATE_COST * np.trace(Sigma)
+            F = np.dot(Ad, F)
+            F[:, n] += Bd
+            Sigma = np.dot(np.dot(Ad, Sigma), Ad.T) + noise
+        return M, c, F, Sigma
+
+    def _solve(self):
+        M, c, Phi, Sigma = self.interval(self.tau)
+        gamma = np.exp(-self.alpha * self.tau)
+        closed = np.vstack([np.eye(len(self.K)), self.K[None]])
+        M = np.dot(np.dot(closed.T, M), closed)
+        Phi = np.dot(Phi, closed)
+        c = c + self.beta
+        if self.nb_decisions is not None:
+            P = np.zeros_like(M)
+            v0 = 0.
+            for _ in range(self.nb_decisions):
+                P, v0 = M + gamma * np.dot(np.dot(Phi.T, P), Phi), c + gamma * (v0 + np.trace(np.dot(P, Sigma)))
+            return P, v0
+        radius = np.max(np.abs(np.linalg.eigvals(np.sqrt(gamma) * Phi)))
+        if gamma >= 1. or radius >= 1.:
+            raise ValueError('The discounted cost of this policy is unbounded '
+                             '(gamma={}, spectral radius {}).'.format(gamma, radius))
+        P = scipy.linalg.solve_discrete_lyapunov(np.sqrt(gamma) * Phi.T, M)
+        v0 = (c + gamma * np.trace(np.dot(P, Sigma))) / (1. - gamma)
+        return P, v0
+
+    def value(self, states):
+        """Value of the policy for a `(N, n)` batch of states, as a `(N,)` array."""
+        states = np.atleast_2d(states)
+        return -np.einsum('ij,jk,ik->i', states, self.P, states) - self.v0
+
+    def q_value(self, states, actions, taus=None):
+        """Value of applying `u` for `tau` once and following the policy afterwards
+
+        # Arguments
+            states (np.ndarray): `(N, n)` batch of states.
+            actions (np.ndarray): `(N,)` inputs, or `(N, 2)` rows `(u, tau)` if `taus` is `None`.
+            taus (np.ndarray): `(N,)` intervals.
+
+        # Returns
+            `(N,)` array of Q values.
+        """
+        states = np.atleast_2d(states)
+        actions = np.asarray(actions, dtype=np.float64)
+        if taus is None:
+            actions, taus = actions[:, 0], actions[:, 1]
+        actions = np.broadcast_to(actions.reshape(-1), states.shape[:1])
+        taus = np.broadcast_to(np.asarray(taus, dtype=np.float64).reshape(-1), states.shape[:1])
+        z = np.concatenate([states, actions[:, None]], axis=1)
+        q = np.empty(len(states))
+        for tau in np.unique(taus):
+            idxs = np.nonzero(taus == tau)[0]
+            M, c, Phi, Sigma = self.interval(tau)
+            zi = z[idxs]
+            reward = -np.einsum('ij,jk,ik->i', zi, M, zi) - c - self.beta
+            mean = np.dot(zi, Phi.T)
+            next_value = self.value(mean) - np.trace(np.dot(self.P, Sigma))
+            q[idxs] = reward + np.exp(-self.alpha * tau) * next_value
+        return q
+
+
+def monte_carlo_value(states, policy, env, nb_decisions=200, nb_episodes=1, alpha=.4, beta=1., ln=1.,
+                      dt=None, substeps_per_unit=20, clip=7., random_state=None):
+    """Discounted return of an arbitrary policy on `LinearEnv` from every state of a batch
+
+    All `nb_episodes * N` trajectories are integrated side by side with the env's Euler scheme
+    and clipping; trajectories whose interval is over wait for the longest one of the decision.
+    This is the vectorized counterpart of the notebooks' `value_function`.
+
+    # Arguments
+        states (np.ndarray): `(N, n)` batch of initial states.
+        policy (function): Maps a `(N, n)` batch of states to `(N, 2)` rows `(u, tau)`, e.g.
+            `lambda s: actor.predict_on_batch(s[:, None])`.
+        env (LinearEnv): Plant providing `A`, `B` and `D`.
+        nb_decisions (integer): Number of decisions per episode (`step_limit`).
+        nb_episodes (integer): Number of noisy episodes averaged per state.
+        alpha, beta, ln, dt, substeps_per_unit: See `LinearPolicyEvaluator`.
+        clip (float): Bound of the state, as in `LinearEnv.step`. `None` to disable.
+        random_state (np.random.RandomState): Source of the noise.
+
+    # Returns
+        `(N,)` array of mean discounted returns.
+    """
+    rng = np.random if random_state is None else random_state
+    A = np.asarray(env.A, dtype=np.float64)
+    B = np.asarray(env.B, dtype=np.float64).reshape(-1)
+    D = np.asarray(env.D, dtype=np.float64).reshape(-1)
+    states = np.atleast_2d(np.asarray(states, dtype=np.float64))
+    x = np.tile(states, (nb_episodes, 1))
+    elapsed = np.zeros(len(x))
+    total = np.zeros(len(x))
+    for _ in range(nb_decisions):
+        action = np.asarray(policy(x), dtype=np.float64)
+        u, tau = action[:, 0], action[:, 1]
+        if dt is None:
+            nb = np.maximum(1, np.ceil(substeps_per_unit * tau)).astype(int)
+            h = tau / nb
+        else:
+            nb = np.maximum(1, np.ceil(np.round(tau / dt, 9))).astype(int)
+            h = np.full(len(x), dt)
+        reward = np.zeros(len(x))
+        for p in range(nb.max()):
+            active = p < nb
+            cost = STATE_COST * np.sum(x**2, axis=1) + INPUT_COST * u**2
+            reward -= np.where(active, np.exp(-alpha * p * h) * cost, 0.)
+            x_prime = x + h[:, None] * (np.dot(x, A.T) + u[:, None] * B)
+            x_prime += (ln * np.sqrt(h) * np.dot(rng.randn(len(x), len(D)), D))[:, None]
+            if clip is not None:
+                x_prime = np.clip(x_prime, -clip, clip)
+            x = np.where(active[:, None], x_prime, x)
+        total += np.exp(-alpha * elapsed) * (reward * h - beta)
+        elapsed += tau
+    return total.reshape(nb_episodes, -1).mean(axis=0)
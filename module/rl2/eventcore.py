@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import warnings
-from copy import deepcopy
 
 import numpy as np
 from keras2.callbacks import History
@@ -9,12 +8,21 @@ import matplotlib.pyplot as plt
 import rl2.barrier_certificate as bc
 
 from rl2.callbacks import (
+    Callback,
     CallbackList,
+    PhaseTimer,
     TestLogger,
-    TrainEpisodeLogger,
-    TrainIntervalLogger,
     Visualizer
 )
+from rl2.core import ObservationCopier
+from rl2.prefetch import stop_prefetching
+from rl2.rollout import (
+    CBFSafetyFilter,
+    CommunicationPenalty,
+    EventTrigger,
+    RolloutEngine,
+    StateMemoryRecorder
+)
 
 def _obs_to_rad(observation):
         assert observation.shape[0] == 3, 'shape error'
@@ -26,6 +34,26 @@ def _obs_to_rad(observation):
             theta = np.arccos(cos) if sc == -1 else -np.arccos(cos)
         return theta
 
+
+class _EpisodeLossRecorder(Callback):
+    """Keeps the episode rewards and the mean critic loss per episode after `warmup` steps."""
+    def __init__(self, warmup=1000):
+        self.warmup = warmup
+        self.episode_rewards = []
+        self.losses = []
+        self.loss_sum = 0
+
+    def on_step_end(self, step, logs={}):
+        if self.model.step > self.warmup:
+            self.loss_sum += logs['metrics'][0]
+
+    def on_episode_end(self, episode, logs={}):
+        self.episode_rewards.append(logs['episode_reward'])
+        if self.model.step > self.warmup:
+            self.losses.append(self.loss_sum / logs['nb_episode_steps'])
+        self.loss_sum = 0
+
+
 class event_Agent(object):
     """Abstract base class for all implemented agents.
 
@@ -48,9 +76,15 @@ class event_Agent(object):
 
     # Arguments
         processor (`Processor` instance): See [Processor](#processor) for details.
+        check_observations (boolean): If `True`, verify that environments declaring
+            `fresh_observations` never reuse their observation arrays. See `ObservationCopier`.
     """
-    def __init__(self, processor=None):
+    # Timer hooks of `fit` and `backward`, enabled by `rl2.callbacks.PhaseProfiler`.
+    timer = PhaseTimer()
+
+    def __init__(self, processor=None, check_observations=False):
         self.processor = processor
+        self.check_observations = check_observations
         self.training = False
         self.step = 0
         self.epsilon = 0.02
@@ -65,7 +99,7 @@ class event_Agent(object):
 
     def fit(self, env, nb_steps, lam=1, action_repetition=1, callbacks=None, verbose=1,
             visualize=False, nb_max_start_steps=0, start_step_policy=None, log_interval=10000,
-            nb_max_episode_steps=None, loss_graph=False, time_mode=False, pure=False):
+            nb_max_episode_steps=None, loss_graph=False, time_mode=False, pure=False, condition=None):
         """Trains the agent on the given environment.
 
         # Arguments
@@ -90,6 +124,10 @@ class event_Agent(object):
             nb_max_episode_steps (integer): Number of steps per episode that the agent performs before
                 automatically resetting the environment. Set to `None` if each episode should run
                 (potentially indefinitely) until the environment signals a terminal state.
+            condition (`rl2.triggers.TriggerCondition` instance): If set, decides when to transmit
+                instead of the actor heads, and the actor is only queried when it fires. The
+                `c_1`/`c_0` heads stored on the other steps are those of the last query, see
+                `rl2.rollout.EventTrigger`.
 
         # Returns
             A `keras.callbacks.History` instance that recorded the entire training process.
@@ -99,196 +137,14 @@ class event_Agent(object):
         if action_repetition < 1:
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
-        self.training = True
-        ratio = env.action_space.high
-
-        self.state_memory = []
-        episode_memory = []
-
-        episode_rewards = []
-
         callbacks = [] if not callbacks else callbacks[:]
-
-        if verbose == 1:
-            callbacks += [TrainIntervalLogger(interval=log_interval)]
-        elif verbose > 1:
-            callbacks += [TrainEpisodeLogger()]
-        if visualize:
-            callbacks += [Visualizer()]
-        history = History()
-        callbacks += [history]
-        callbacks = CallbackList(callbacks)
-        if hasattr(callbacks, 'set_model'):
-            callbacks.set_model(self)
-        else:
-            callbacks._set_model(self)
-        callbacks._set_env(env)
-        params = {
-            'nb_steps': nb_steps,
-        }
-        if hasattr(callbacks, 'set_params'):
-            callbacks.set_params(params)
-        else:
-            callbacks._set_params(params)
-        self._on_train_begin()
-        callbacks.on_train_begin()
-
-        episode = np.int16(0)
-        self.step = np.int16(0)
-        observation = None
-        episode_reward = None
-        episode_step = None
-        did_abort = False
-        #In the firststep of each episode, we must communicate.
-        episode_start_step = 0
-        csv_content = []
-        try:
-            while self.step < nb_steps:
-                if observation is None:  # start of a new episode
-                    callbacks.on_episode_begin(episode)
-                    episode_step = np.int16(0)
-                    episode_reward = np.float32(0)
-
-                    # Obtain the initial observation by resetting the environment.
-                    self.reset_states()
-                    observation = deepcopy(env.reset())
-                    if self.processor is not None:
-                        observation = self.processor.process_observation(observation)
-                    assert observation is not None
-
-                    # Perform random starts at beginning of episode and do not record them into the experience.
-                    # This slightly changes the start position between games.
-                    nb_random_start_steps = 0 if nb_max_start_steps == 0 else np.random.randint(nb_max_start_steps)
-                    for _ in range(nb_random_start_steps):
-                        if start_step_policy is None:
-                            action = env.action_space.sample()
-                        else:
-                            action = start_step_policy(observation)
-                        if self.processor is not None:
-                            action = self.processor.process_action(action)
-                        callbacks.on_action_begin(action)
-                        observation, reward, done, info = env.step(action)
-                        observation = deepcopy(observation)
-                        if self.processor is not None:
-                            observation, reward, done, info = self.processor.process_step(observation, reward, done, info)
-                        callbacks.on_action_end(action)
-                        if done:
-                            warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                            observation = deepcopy(env.reset())
-                            if self.processor is not None:
-                                observation = self.processor.process_observation(observation)
-                            break
-
-                # At this point, we expect to be fully initialized.
-                assert episode_reward is not None
-                assert episode_step is not None
-                assert observation is not None
-
-                # Run a single step.
-                callbacks.on_step_begin(episode_step)
-                # This is were all of the work happens. We first perceive and compute the action
-                # (forward step) and then use the reward to improve (backward step).
-
-                #action caluculate area
-                if self.step == episode_start_step:
-                    gama = 1
-                    action = np.array([self.forward(observation)[0]])
-                else:
-                    epsi = np.random.rand()
-                    explore = False
-                    if epsi < self.epsilon:
-                        if np.random.binomial(2,0.5,1)[0] == 1:
-                            explore = True
-                    gama = 0
-                    action_with_decision = self.recent_action
-                    # if communication is not needed, this action will be input
-                    action = np.array([action_with_decision[0]])
-
-                    action_candidate = self.forward(observation)
-                    if action_candidate[1] > action_candidate[2] or explore or time_mode:
-                        gama = 1
-                        action_with_decision = action_candidate
-                        action = np.array([action_candidate[0]])
-                    self.recent_action = action_with_decision
-                if self.processor is not None:
-                    action = self.processor.process_action(action)
-
-
-                episode_memory.append(env.state)
-                # input to environment
-                reward = np.float32(0)
-                accumulated_info = {}
-                done = False
-                for _ in range(action_repetition):
-                    callbacks.on_action_begin(action)
-                    observation, r, done, info = env.step(action)
-                    observation = deepcopy(observation)
-                    if self.processor is not None:
-                        observation, r, done, info = self.processor.process_step(observation, r, done, info)
-                    for key, value in info.items():
-                        if not np.isreal(value):
-                            continue
-                        if key not in accumulated_info:
-                            accumulated_info[key] = np.zeros_like(value)
-                        accumulated_info[key] += value
-                    callbacks.on_action_end(action)
-                    r -= lam * gama
-                    reward += r
-                    if done:
-                        break
-                if nb_max_episode_steps and episode_step >= nb_max_episode_steps - 1:
-                    # Force a terminal state.
-                    done = True
-                metrics = self.backward(reward, terminal=done)
-                episode_reward += reward
-
-                step_logs = {
-                    'action': action,
-                    'observation': observation,
-                    'reward': reward,
-                    'metrics': metrics,
-                    'episode': episode,
-                    'info': accumulated_info,
-                }
-                callbacks.on_step_end(episode_step, step_logs)
-                episode_step += 1
-                self.step += 1
-
-                if done:
-                    # We are in a terminal state but the agent hasn't yet seen it. We therefore
-                    # perform one more forward-backward call and simply ignore the action before
-                    # resetting the environment. We need to pass in `terminal=False` here since
-                    # the *next* state, that is the state of the newly reset environment, is
-                    # always non-terminal by convention.
-                    self.forward(observation)
-                    self.backward(0., terminal=False)
-                    episode_start_step = self.step
-
-                    # This episode is finished, report and reset.
-                    episode_logs = {
-                        'episode_reward': episode_reward,
-                        'nb_episode_steps': episode_step,
-                        'nb_steps': self.step,
-                    }
-                    callbacks.on_episode_end(episode, episode_logs)
-                    episode_rewards.append(episode_reward)
-
-                    episode += 1
-                    observation = None
-                    episode_step = None
-                    self.state_memory.append(np.array(episode_memory))
-                    episode_memory = []
-                    episode_reward = None
-        except KeyboardInterrupt:
-            # We catch keyboard interrupts here so that training can be be safely aborted.
-            # This is so common that we've built this right into this function, which ensures that
-            # the `on_train_end` method is properly called.
-            did_abort = True
-            self.state_memory.append(np.array(episode_memory))
-        callbacks.on_train_end(logs={'did_abort': did_abort})
-        self._on_train_end()
-
-        return history
+        callbacks += [StateMemoryRecorder(before_step=True)]
+        engine = RolloutEngine(EventTrigger(time_mode=time_mode, action_repetition=action_repetition,
+                                            condition=condition),
+                               shaper=CommunicationPenalty(lam))
+        return engine.fit(self, env, nb_steps, callbacks=callbacks, verbose=verbose, visualize=visualize,
+                          nb_max_start_steps=nb_max_start_steps, start_step_policy=start_step_policy,
+                          log_interval=log_interval, nb_max_episode_steps=nb_max_episode_steps)
 
     def test(self, env, nb_episodes=1, lam=1, action_repetition=1, callbacks=None, visualize=False,
              nb_max_episode_steps=None, nb_max_start_steps=0, start_step_policy=None, verbose=1, graph=False,
@@ -327,6 +183,7 @@ class event_Agent(object):
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
         self.training = False
+        copy_observation = ObservationCopier(env, check=self.check_observations)
         self.step = 0
         ratio = env.action_space.high
 
@@ -365,7 +222,7 @@ class event_Agent(object):
 
             # Obtain the initial observation by resetting the environment.
             self.reset_states()
-            observation = deepcopy(env.reset())
+            observation = copy_observation(env.reset())
             if self.processor is not None:
                 observation = self.processor.process_observation(observation)
             assert observation is not None
@@ -382,13 +239,13 @@ class event_Agent(object):
                     action = self.processor.process_action(action)
                 callbacks.on_action_begin(action)
                 observation, r, done, info = env.step(action)
-                observation = deepcopy(observation)
+                observation = copy_observation(observation)
                 if self.processor is not None:
                     observation, r, done, info = self.processor.process_step(observation, r, done, info)
                 callbacks.on_action_end(action)
                 if done:
                     warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                    observation = deepcopy(env.reset())
+                    observation = copy_observation(env.reset())
                     if self.processor is not None:
                         observation = self.processor.process_observation(observation)
                     break
@@ -445,7 +302,7 @@ class event_Agent(object):
                 for _ in range(action_repetition):
                     callbacks.on_action_begin(action)
                     observation, r, d, info = env.step(action)
-                    observation = deepcopy(observation)
+                    observation = copy_observation(observation)
                     if self.processor is not None:
                         observation, r, d, info = self.processor.process_step(observation, r, d, info)
                     callbacks.on_action_end(action)
@@ -593,7 +450,7 @@ class event_Agent(object):
     def _on_train_end(self):
         """Callback that is called after training ends."
         """
-        pass
+        stop_prefetching(self)
 
     def _on_test_begin(self):
         """Callback that is called before testing begins."
@@ -627,9 +484,15 @@ class event_safe_Agent(object):
 
     # Arguments
         processor (`Processor` instance): See [Processor](#processor) for details.
+        check_observations (boolean): If `True`, verify that environments declaring
+            `fresh_observations` never reuse their observation arrays. See `ObservationCopier`.
     """
-    def __init__(self, processor=None):
+    # Timer hooks of `fit` and `backward`, enabled by `rl2.callbacks.PhaseProfiler`.
+    timer = PhaseTimer()
+
+    def __init__(self, processor=None, check_observations=False):
         self.processor = processor
+        self.check_observations = check_observations
         self.training = False
         self.step = 0
         self.epsilon = 0.02
@@ -644,7 +507,7 @@ class event_safe_Agent(object):
 
     def fit(self, env, nb_steps, lam=1, action_repetition=1, callbacks=None, verbose=1,
             visualize=False, nb_max_start_steps=0, start_step_policy=None, log_interval=10000,
-            nb_max_episode_steps=None, loss_graph=False, time_mode=False, pure=False):
+            nb_max_episode_steps=None, loss_graph=False, time_mode=False, pure=False, condition=None):
         """Trains the agent on the given environment.
 
         # Arguments
@@ -669,6 +532,10 @@ class event_safe_Agent(object):
             nb_max_episode_steps (integer): Number of steps per episode that the agent performs before
                 automatically resetting the environment. Set to `None` if each episode should run
                 (potentially indefinitely) until the environment signals a terminal state.
+            condition (`rl2.triggers.TriggerCondition` instance): If set, decides when to transmit
+                instead of the actor heads, and the actor is only queried when it fires. The
+                `c_1`/`c_0` heads stored on the other steps are those of the last query, see
+                `rl2.rollout.EventTrigger`.
 
         # Returns
             A `keras.callbacks.History` instance that recorded the entire training process.
@@ -678,226 +545,24 @@ class event_safe_Agent(object):
         if action_repetition < 1:
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
-        self.training = True
-        ratio = env.action_space.high
-
+        # This agent never recorded states, but `state_memory` is reset as before.
         self.state_memory = []
-        episode_memory = []
-
-        lo = []
-        loss_ave = 0
-        epi = 0
-        cbf_log = np.zeros((nb_steps, 2))
-        episode_rewards = []
-
+        # Stores `[h(x), 1 if the barrier certificate corrected the input else 0]` for every step.
+        safety_filter = CBFSafetyFilter(pure=pure, log=True)
+        recorder = _EpisodeLossRecorder()
         callbacks = [] if not callbacks else callbacks[:]
-
-        if verbose == 1:
-            callbacks += [TrainIntervalLogger(interval=log_interval)]
-        elif verbose > 1:
-            callbacks += [TrainEpisodeLogger()]
-        if visualize:
-            callbacks += [Visualizer()]
-        history = History()
-        callbacks += [history]
-        callbacks = CallbackList(callbacks)
-        if hasattr(callbacks, 'set_model'):
-            callbacks.set_model(self)
-        else:
-            callbacks._set_model(self)
-        callbacks._set_env(env)
-        params = {
-            'nb_steps': nb_steps,
-        }
-        if hasattr(callbacks, 'set_params'):
-            callbacks.set_params(params)
-        else:
-            callbacks._set_params(params)
-        self._on_train_begin()
-        callbacks.on_train_begin()
-
-        episode = np.int16(0)
-        self.step = np.int16(0)
-        observation = None
-        episode_reward = None
-        episode_step = None
-        did_abort = False
-        #In the firststep of each episode, we must communicate.
-        episode_start_step = 0
-        csv_content = []
-        try:
-            while self.step < nb_steps:
-                if observation is None:  # start of a new episode
-                    callbacks.on_episode_begin(episode)
-                    episode_step = np.int16(0)
-                    episode_reward = np.float32(0)
-
-                    # Obtain the initial observation by resetting the environment.
-                    self.reset_states()
-                    observation = deepcopy(env.reset())
-                    if self.processor is not None:
-                        observation = self.processor.process_observation(observation)
-                    assert observation is not None
-
-                    # Perform random starts at beginning of episode and do not record them into the experience.
-                    # This slightly changes the start position between games.
-                    nb_random_start_steps = 0 if nb_max_start_steps == 0 else np.random.randint(nb_max_start_steps)
-                    for _ in range(nb_random_start_steps):
-                        if start_step_policy is None:
-                            action = env.action_space.sample()
-                        else:
-                            action = start_step_policy(observation)
-                        if self.processor is not None:
-                            action = self.processor.process_action(action)
-                        callbacks.on_action_begin(action)
-                        observation, reward, done, info = env.step(action)
-                        observation = deepcopy(observation)
-                        if self.processor is not None:
-                            observation, reward, done, info = self.processor.process_step(observation, reward, done, info)
-                        callbacks.on_action_end(action)
-                        if done:
-                            warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                            observation = deepcopy(env.reset())
-                            if self.processor is not None:
-                                observation = self.processor.process_observation(observation)
-                            break
-
-                # At this point, we expect to be fully initialized.
-                assert episode_reward is not None
-                assert episode_step is not None
-                assert observation is not None
-
-                # store whether current state is danger. 1 for danger, 0 for safe.
-                cbf_log[self.step][0] = bc.h(observation)
-
-                # Run a single step.
-                callbacks.on_step_begin(episode_step)
-                # This is were all of the work happens. We first perceive and compute the action
-                # (forward step) and then use the reward to improve (backward step).
-
-                #action caluculate area
-                if self.step == episode_start_step:
-                    gama = 1
-                    action = np.array([self.forward(observation)[0]])
-                    clip = np.clip(action, -ratio, ratio)
-                    x = observation
-                    if pure:
-                        action = bc.u_cbf_pure(x, action[0], ratio)
-                    else:
-                        action = bc.u_cbf(x, action[0], ratio)
-                    cbf_action = 1 if clip != action else 0
-                else:
-                    epsi = np.random.rand()
-                    explore = False
-                    if epsi < self.epsilon:
-                        if np.random.binomial(2,0.5,1)[0] == 1:
-                            explore = True
-                    gama = 0
-                    action_with_decision = self.recent_action
-                    action = np.array([action_with_decision[0]])
-                    action_candidate = self.forward(observation)
-                    dif = np.abs(action_candidate[0] - action)
-                    if action_candidate[1] > action_candidate[2] or explore or time_mode:
-                        gama = 1
-                        action_with_decision = action_candidate
-                        action = np.array([action_candidate[0]])
-                    x = observation
-                    # barrier certification
-                    clip = np.clip(action, -ratio, ratio)
-                    if pure:
-                        action = bc.u_cbf_pure(x, action[0], ratio)
-                    else:
-                        action = bc.u_cbf(x, action[0], ratio)
-                    cbf_action = 1 if clip != action else 0
-                    if cbf_action == 1:
-                        gama = 1
-                    cbf_log[self.step][1] = cbf_action
-                    action_with_decision[0] = action
-                    self.recent_action = action_with_decision
-                if self.processor is not None:
-                    action = self.processor.process_action(action)
-
-                reward = np.float32(0)
-                accumulated_info = {}
-                done = False
-                for _ in range(action_repetition):
-                    callbacks.on_action_begin(action)
-                    observation, r, done, info = env.step(action)
-                    observation = deepcopy(observation)
-                    if self.processor is not None:
-                        observation, r, done, info = self.processor.process_step(observation, r, done, info)
-                    for key, value in info.items():
-                        if not np.isreal(value):
-                            continue
-                        if key not in accumulated_info:
-                            accumulated_info[key] = np.zeros_like(value)
-                        accumulated_info[key] += value
-                    callbacks.on_action_end(action)
-                    r -= lam * gama
-                    reward += r
-                    if done:
-                        break
-                if nb_max_episode_steps and episode_step >= nb_max_episode_steps - 1:
-                    # Force a terminal state.
-                    done = True
-                metrics = self.backward(reward, terminal=done)
-                episode_reward += reward
-
-                step_logs = {
-                    'action': action,
-                    'observation': observation,
-                    'reward': reward,
-                    'metrics': metrics,
-                    'episode': episode,
-                    'info': accumulated_info,
-                }
-                if self.step > 1000 and loss_graph:
-                    loss_ave += metrics[0]
-                callbacks.on_step_end(episode_step, step_logs)
-                episode_step += 1
-                self.step += 1
-
-                if done:
-                    # We are in a terminal state but the agent hasn't yet seen it. We therefore
-                    # perform one more forward-backward call and simply ignore the action before
-                    # resetting the environment. We need to pass in `terminal=False` here since
-                    # the *next* state, that is the state of the newly reset environment, is
-                    # always non-terminal by convention.
-                    self.forward(observation)
-                    self.backward(0., terminal=False)
-                    episode_start_step = self.step
-                    epi += 1
-                    if self.step > 1000 and loss_graph:
-                        lo.append(loss_ave/episode_step)
-                    loss_ave = 0
-
-                    # This episode is finished, report and reset.
-                    episode_logs = {
-                        'episode_reward': episode_reward,
-                        'nb_episode_steps': episode_step,
-                        'nb_steps': self.step,
-                    }
-                    callbacks.on_episode_end(episode, episode_logs)
-                    episode_rewards.append(episode_reward)
-
-                    episode += 1
-                    observation = None
-                    episode_step = None
-                    episode_reward = None
-        except KeyboardInterrupt:
-            # We catch keyboard interrupts here so that training can be be safely aborted.
-            # This is so common that we've built this right into this function, which ensures that
-            # the `on_train_end` method is properly called.
-            did_abort = True
-        callbacks.on_train_end(logs={'did_abort': did_abort})
-        self._on_train_end()
-        self.cbf_log = np.array(cbf_log)
-        self.episode_rewards = episode_rewards
-        print(callbacks.callbacks[0])
+        callbacks += [recorder]
+        engine = RolloutEngine(EventTrigger(time_mode=time_mode, action_repetition=action_repetition,
+                                            condition=condition),
+                               shaper=CommunicationPenalty(lam), safety_filter=safety_filter)
+        history = engine.fit(self, env, nb_steps, callbacks=callbacks, verbose=verbose, visualize=visualize,
+                             nb_max_start_steps=nb_max_start_steps, start_step_policy=start_step_policy,
+                             log_interval=log_interval, nb_max_episode_steps=nb_max_episode_steps)
+        self.cbf_log = np.array(safety_filter.history)
+        self.episode_rewards = recorder.episode_rewards
 
         if loss_graph:
-            #the number of episode - first warming up 5 episodes
-            plt.plot(range(epi-int(1000/nb_max_episode_steps)), lo)
+            plt.plot(range(len(recorder.losses)), recorder.losses)
             plt.xlabel('episodes')
             plt.ylabel('loss')
             plt.show()
@@ -941,6 +606,7 @@ class event_safe_Agent(object):
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
         self.training = False
+        copy_observation = ObservationCopier(env, check=self.check_observations)
         self.step = 0
         ratio = env.action_space.high
 
@@ -979,7 +645,7 @@ class event_safe_Agent(object):
 
             # Obtain the initial observation by resetting the environment.
             self.reset_states()
-            observation = deepcopy(env.reset())
+            observation = copy_observation(env.reset())
             if self.processor is not None:
                 observation = self.processor.process_observation(observation)
             assert observation is not None
@@ -996,13 +662,13 @@ class event_safe_Agent(object):
                     action = self.processor.process_action(action)
                 callbacks.on_action_begin(action)
                 observation, r, done, info = env.step(action)
-                observation = deepcopy(observation)
+                observation = copy_observation(observation)
                 if self.processor is not None:
                     observation, r, done, info = self.processor.process_step(observation, r, done, info)
                 callbacks.on_action_end(action)
                 if done:
                     warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                    observation = deepcopy(env.reset())
+                    observation = copy_observation(env.reset())
                     if self.processor is not None:
                         observation = self.processor.process_observation(observation)
                     break
@@ -1059,7 +725,7 @@ class event_safe_Agent(object):
                 for _ in range(action_repetition):
                     callbacks.on_action_begin(action)
                     observation, r, d, info = env.step(action)
-                    observation = deepcopy(observation)
+                    observation = copy_observation(observation)
                     if self.processor is not None:
                         observation, r, d, info = self.processor.process_step(observation, r, d, info)
                     callbacks.on_action_end(action)
@@ -1207,7 +873,7 @@ class event_safe_Agent(object):
     def _on_train_end(self):
         """Callback that is called after training ends."
         """
-        pass
+        stop_prefetching(self)
 
     def _on_test_begin(self):
         """Callback that is called before testing begins."
@@ -1347,6 +1013,8 @@ class Env(object):
     reward_range = (-np.inf, np.inf)
     action_space = None
     observation_space = None
+    # Set to `True` if `step` and `reset` always return a newly allocated observation.
+    fresh_observations = False
 
     def step(self, action):
         """Run one timestep of the environment's dynamics.
@@ -0,0 +1,143 @@
+"""Exact running cost of linear plants over one inter-event interval.
+
+Under zero-order hold the state of `dx = (A x + B u) dt + G dW` and the discounted integral
+of a quadratic running cost follow from matrix exponentials of augmented systems (Van Loan),
+so an interval costs a few small matrix products however long it is.
+"""
+from __future__ import division
+
+import numpy as np
+import scipy.linalg
+
+
+def van_loan_integral(A, Q, alpha, tau):
+    """Returns `int_0^tau exp(-alpha t) exp(A^T t) Q exp(A t) dt` and `exp(A tau)`."""
+    n = A.shape[0]
+    shifted = A - .5 * alpha * np.eye(n)
+    C = np.zeros((2 * n, 2 * n))
+    C[:n, :n] = -shifted.T
+    C[:n, n:] = Q
+    C[n:, n:] = shifted
+    E = scipy.linalg.expm(C * tau)
+    F22 = E[n:, n:]
+    return np.dot(F22.T, E[:n, n:]), F22 * np.exp(.5 * alpha * tau)
+
+
+class QuadraticIntervalCost(object):
+    """Discounted cost `int_0^tau exp(-alpha t) (x^T Q x + R u^2) dt` of holding `u` for `tau`
+
+    For `z = [x0; u]` the deterministic part is `z^T W(tau) z`. The Wiener disturbance `G dW`
+    adds the constant `c(tau)` in expectation and makes the state at `tau` Gaussian around
+    `Phi(tau) z` with covariance `Sigma(tau)`. `W`, `c`, `Phi` and `Sigma` are computed once per
+    quantized `tau` and cached.
+
+    # Arguments
+        A (np.ndarray): `(n, n)` system matrix.
+        B (np.ndarray): `(n,)` input vector.
+        state_cost (float or np.ndarray): `Q`, a scalar multiple of the identity or `(n, n)`.
+        input_cost (float): `R`.
+        alpha (float): Discount rate per unit of time.
+        G (np.ndarray): `(n,)` or `(n, k)` noise input, `None` for a noise-free plant.
+        resolution (float): `tau` is rounded to a multiple of this before the lookup.
+        max_cache_size (integer): The cache is emptied once it holds this many intervals.
+    """
+    def __init__(self, A, B, state_cost=.1, input_cost=.01, alpha=0., G=None, resolution=1e-4,
+                 max_cache_size=100000):
+        self.A = np.asarray(A, dtype=np.float64)
+        self.B = np.asarray(B, dtype=np.float64).reshape(-1)
+        n = self.A.shape[0]
+        self.Q = np.asarray(state_cost, dtype=np.float64) * np.eye(n) if np.ndim(state_cost) == 0 \
+            else np.asarray(state_cost, dtype=np.float64)
+        self.R = float(input_cost)
+        self.alpha = alpha
+        self.noise = None if G is None else np.dot(np.reshape(G, (n, -1)), np.reshape(G, (n, -1)).T)
+        self.resolution = resolution
+        self.max_cache_size = max_cache_size
+        self._cache = {}
+
+    def quantize(self, tau):
+        """Returns the key of `tau` in the cache."""
+        return int(np.round(tau / self.resolution))
+
+    def interval(self, tau):
+        """Returns `(W, c, Phi, Sigma)` for the quantized `tau`."""
+        key = self.quantize(tau)
+        if key not in self._cache:
+            if len(self._cache) >= self.max_cache_size:
+                self._cache.clear()
+            self._cache[key] = self._interval(key * self.resolution)
+        return self._cache[key]
+
+    def _interval(self, tau):
+        n = self.A.shape[0]
+        # Zero-order hold: u is a state with zero dynamics.
+        Az = np.zeros((n + 1, n + 1))
+        Az[:n, :n] = self.A
+        Az[:n, n] = self.B
+        Qz = np.zeros((n + 1, n + 1))
+        Qz[:n, :n] = self.Q
+        Qz[n, n] = self.R
+        W, transition = van_loan_integral(Az, Qz, self.alpha, tau)
+        Phi = transition[:n]
+        if self.noise is None:
+            return W, 0., Phi, np.zeros((n, n))
+
+        # vec(Sigma) follows the linear system with generator A (+) A driven by vec(G G^T), so
+        # its discounted integral is the top-right block of one more matrix exponential.
+        m = n * n
+        As = np.zeros((m + 1, m + 1))
+        As[:m, :m] = np.kron(np.eye(n), self.A) + np.kron(self.A, np.eye(n))
+        As[:m, m] = self.noise.reshape(-1)
+        C = np.zeros((2 * (m + 1), 2 * (m + 1)))
+        C[:m + 1, :m + 1] = As - self.alpha * np.eye(m + 1)
+        C[:m + 1, m + 1:] = np.eye(m + 1)
+        E = scipy.linalg.expm(C * tau)
+        c = np.dot(self.Q.reshape(-1), E[:m, -1])
+        Sigma = scipy.linalg.expm(As * tau)[:m, m].reshape(n, n)
+        return W, c, Phi, .5 * (Sigma + Sigma.T)
+
+    def _grouped(self, taus, size):
+        keys = np.array([self.quantize(tau) for tau in np.broadcast_to(taus, (size,)).reshape(-1)])
+        for key in np.unique(keys):
+            yield np.nonzero(keys == key)[0], self.interval(key * self.resolution)
+
+    def cost(self, states, actions, taus):
+        """Exact expected cost of a batch of intervals
+
+        # Arguments
+            states (np.ndarray): `(N, n)` states at the start of the intervals.
+            actions (np.ndarray): `(N,)` inputs held over the intervals.
+            taus (np.ndarray): `(N,)` interval lengths, or one length for all.
+
+        # Returns
+            `(N,)` array of discounted costs.
+        """
+        states = np.atleast_2d(states)
+        z = np.concatenate([states, np.reshape(actions, (-1, 1))], axis=1)
+        costs = np.empty(len(z))
+        for idxs, (W, c, _, _) in self._grouped(taus, len(z)):
+            costs[idxs] = np.einsum('ij,jk,ik->i', z[idxs], W, z[idxs]) + c
+        return costs
+
+    def transition(self, states, actions, taus, random_state=None):
+        """States at the end of a batch of intervals
+
+        # Arguments
+            states, actions, taus: See `cost`.
+            random_state (np.random.RandomState): Source of the disturbance. If `None`, the
+                mean is returned.
+
+        # Returns
+            `(N, n)` array of states.
+        """
+        states = np.atleast_2d(states)
+        z = np.concatenate([states, np.reshape(actions, (-1, 1))], axis=1)
+        next_states = np.empty_like(states, dtype=np.float64)
+        for idxs, (_, _, Phi, Sigma) in self._grouped(taus, len(z)):
+            next_states[idxs] = np.dot(z[idxs], Phi.T)
+            if random_state is not None and self.noise is not None:
+                # Sigma may be singular, e.g. for noise along a single direction.
+                w, v = np.linalg.eigh(Sigma)
+                root = v * np.sqrt(np.clip(w, 0., None))
+                next_states[idxs] += np.dot(random_state.randn(len(idxs), len(w)), root.T)
+        return next_states
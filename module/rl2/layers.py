@@ -0,0 +1,108 @@
+from __future__ import division
+
+import keras2.backend as K
+from keras2.layers import Layer
+from keras2.models import Model
+
+from rl2.barrier_certificate import set_alpha
+
+
+class CBFProjection(Layer):
+    """Backend version of `rl2.barrier_certificate.u_cbf` (or `u_cbf_pure`).
+
+    Takes `[observation, action]` and returns `action` with its first column replaced by the
+    safe input. The remaining columns (e.g. `tau`) are passed through unchanged, so appending
+    this layer to an actor yields safe `(u, tau)` for a whole batch in one graph call.
+
+    Inside the allowed input range the projection is the identity, so the actor gradient passes
+    through. At an active constraint the output depends only on the state.
+
+    # Arguments
+        clipper (float): Input bound.
+        pure (boolean): If `True`, follow `u_cbf_pure`, i.e. never force the input near the
+            boundary of the safe set.
+        k (float): `log10` of the class-K gain of the barrier condition.
+        alpha (float): Weight of the angular velocity in `h(x) = 1 - th^2 - alpha*thd^2`.
+    """
+    def __init__(self, clipper=10., pure=False, k=2.6, alpha=set_alpha(), **kwargs):
+        self.clipper = clipper
+        self.pure = pure
+        self.k = k
+        self.alpha = alpha
+        super(CBFProjection, self).__init__(**kwargs)
+
+    def call(self, x, mask=None):
+        assert len(x) == 2
+        observation, action = x
+        if K.ndim(observation) == 3:
+            # (batch, window_length, 2): the barrier is evaluated at the most recent state.
+            observation = observation[:, -1, :]
+        th, thd = observation[:, 0], observation[:, 1]
+        u = action[:, 0]
+
+        al = self.alpha
+        m = 1.
+        l = 1.
+        g = 10.
+        gamma = pow(10, self.k)
+        clipper = self.clipper
+        h = 1. - K.square(th) - al * K.square(thd)
+
+        zeros = K.zeros_like(u)
+        ones = K.ones_like(u)
+        lower = zeros - clipper
+        upper = zeros + clipper
+
+        # thd == 0: the bound follows from gravity alone.
+        still = K.equal(thd, 0.)
+        p = K.abs(m * g * K.sin(th) / 2.)
+        th_positive = K.greater(th, 0.)
+        still_min = K.switch(th_positive, lower, p)
+        still_max = K.switch(th_positive, -p, upper)
+
+        # thd != 0: root of the degree-1 polynomial in u of the barrier condition.
+        denom = -(6. * al * K.switch(still, ones, thd)) / (m * l ** 2)
+        u_thres = (2. * th * thd + 3. * al * g / l * thd * K.sin(th) - gamma * h) / denom
+        u_thres = K.clip(u_thres, -clipper, clipper)
+        thd_negative = K.less(thd, 0.)
+        moving_min = K.switch(thd_negative, u_thres, lower)
+        moving_max = K.switch(thd_negative, upper, u_thres)
+
+        rmin = K.switch(still, still_min, moving_min)
+        rmax = K.switch(still, still_max, moving_max)
+
+        below = K.less(u, rmin)
+        safe_u = K.switch(below, rmin, K.switch(K.greater(u, rmax), rmax, u))
+        if not self.pure:
+            forced = K.switch(K.less(observation[:, 0], 0.), rmax, rmin)
+            safe_u = K.switch(K.less(h, 1e-1), forced, safe_u)
+
+        safe_u = K.expand_dims(safe_u, axis=-1)
+        return K.concatenate([safe_u, action[:, 1:]], axis=-1)
+
+    def compute_output_shape(self, input_shape):
+        if len(input_shape) != 2:
+            raise RuntimeError("Expects 2 inputs: observation, action")
+        return input_shape[1]
+
+    def get_config(self):
+        config = {
+            'clipper': self.clipper,
+            'pure': self.pure,
+            'k': self.k,
+            'alpha': self.alpha,
+        }
+        base_config = super(CBFProjection, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+def append_cbf_projection(actor, clipper=10., pure=False):
+    """Returns a model that computes `actor` followed by `CBFProjection`.
+
+    The returned model shares its weights with `actor`, so it can be used for acting and
+    for batched safe-policy evaluation while `actor` is trained as usual.
+    """
+    if len(actor.inputs) != 1:
+        raise ValueError('The actor must have a single observation input.')
+    safe_action = CBFProjection(clipper=clipper, pure=pure)([actor.inputs[0], actor.output])
+    return Model(inputs=actor.inputs, outputs=safe_action)
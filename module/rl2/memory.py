@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 from collections import deque, namedtuple
 import warnings
+import multiprocessing as mp
 import random
 
 import numpy as np
@@ -110,12 +111,42 @@ class Memory(object):
         self.recent_observations = deque(maxlen=window_length)
         self.recent_terminals = deque(maxlen=window_length)
 
+        # The last `window_length - 1` observations for `get_recent_state_batch`. Every
+        # observation is written twice, at `recent_next` and `recent_next + window_length - 1`,
+        # so that the newest ones always form one contiguous slice ending at
+        # `recent_next + window_length - 1`. `recent_valid` counts how many of them belong to the
+        # state with the episode boundary rule of `get_recent_state`. `recent_history` is set to
+        # False if the observations do not fit into an array.
+        self.recent_history = None
+        self.recent_next = 0
+        self.recent_valid = 0
+        self.recent_state_batch = None
+
     def sample(self, batch_size, batch_idxs=None):
         raise NotImplementedError()
 
     def append(self, observation, action, reward, terminal, training=True):
+        previous_terminal = self.recent_terminals[-1] if self.recent_terminals else False
         self.recent_observations.append(observation)
         self.recent_terminals.append(terminal)
+        if self.window_length > 1 and self.recent_history is not False:
+            self._append_recent_history(observation, previous_terminal)
+
+    def _append_recent_history(self, observation, previous_terminal):
+        n = self.window_length - 1
+        if self.recent_history is None:
+            self.recent_history = np.zeros((2 * n,) + np.shape(observation))
+        try:
+            self.recent_history[self.recent_next] = observation
+            self.recent_history[self.recent_next + n] = observation
+        except (ValueError, TypeError):
+            self.recent_history = False
+            return
+        self.recent_next = (self.recent_next + 1) % n
+        if previous_terminal and not self.ignore_episode_boundaries:
+            self.recent_valid = 0
+        else:
+            self.recent_valid = min(self.recent_valid + 1, n)
 
     def get_recent_state(self, current_observation):
         """Return list of last observations
@@ -126,6 +157,8 @@ class Memory(object):
         # Returns
             A list of the last observations
         """
+        if self.window_length == 1:
+            return [current_observation]
         # This code is slightly complicated by the fact that subsequent observations might be
         # from different episodes. We ensure that an experience never spans multiple episodes.
         # This is probably not that important in practice but it seems cleaner.
@@ -143,6 +176,39 @@ class Memory(object):
             state.insert(0, zeroed_observation(state[0]))
         return state
 
+    def get_recent_state_batch(self, current_observation):
+        """Return the last observations as a batch of one state
+
+        Same content as `get_recent_state`, without building lists. For `window_length == 1`
+        the batch is a view of `current_observation`, otherwise a preallocated array that is
+        overwritten by the next call.
+
+        # Argument
+            current_observation (np.ndarray): Last observation
+
+        # Returns
+            A np.ndarray of shape (1, window_length) + observation shape
+        """
+        if self.window_length == 1:
+            # The state is just the current observation, a view of it is enough.
+            return np.asarray(current_observation)[np.newaxis, np.newaxis]
+        batch = self.recent_state_batch
+        if batch is None or batch.shape[2:] != np.shape(current_observation):
+            batch = self.recent_state_batch = np.zeros((1, self.window_length) + np.shape(current_observation))
+        history = self.recent_history
+        if history is False or (history is not None and history.shape[1:] != batch.shape[2:]):
+            batch[0] = self.get_recent_state(current_observation)
+            return batch
+
+        n = self.window_length - 1
+        end = self.recent_next + n
+        if self.recent_valid < n:
+            batch[0, :n - self.recent_valid] = 0.
+        if self.recent_valid > 0:
+            batch[0, n - self.recent_valid:n] = history[end - self.recent_valid:end]
+        batch[0, -1] = current_observation
+        return batch
+
     def get_config(self):
         """Return configuration (window_length, ignore_episode_boundaries) for Memory
         
@@ -155,11 +221,25 @@ class Memory(object):
         }
         return config
 
+# Extra columns for self-triggered control: executed interval `tau`, episode time elapsed before
+# the transition and the discount `exp(-alpha * tau)` of the transition.
+TIME_COLUMNS = {'tau': 'float32', 'episode_time': 'float32', 'discount': 'float32'}
+
+
 class SequentialMemory(Memory):
-    def __init__(self, limit, **kwargs):
+    """Replay memory of `(observation, action, reward, terminal)` transitions.
+
+    # Arguments
+        limit (int): Maximum number of stored transitions.
+        columns (dict): Optional extra per-transition columns, mapping name to dtype, e.g.
+            `TIME_COLUMNS`. Their values are passed to `append` as keyword arguments and come
+            back stacked from `sample_columns`.
+    """
+    def __init__(self, limit, columns=None, **kwargs):
         super(SequentialMemory, self).__init__(**kwargs)
         
         self.limit = limit
+        self.columns = dict(columns) if columns else {}
 
         # Do not use deque to implement the memory. This data structure may seem convenient but
         # it is way too slow on random access. Instead, we use our own ring buffer implementation.
@@ -167,6 +247,7 @@ class SequentialMemory(Memory):
         self.rewards = RingBuffer(limit)
         self.terminals = RingBuffer(limit)
         self.observations = RingBuffer(limit)
+        self.column_data = {name: RingBuffer(limit) for name in self.columns}
 
     def sample(self, batch_size, batch_idxs=None):
         """Return a randomized batch of experiences
@@ -177,6 +258,27 @@ class SequentialMemory(Memory):
         # Returns
             A list of experiences randomly selected
         """
+        experiences, _ = self._sample(batch_size, batch_idxs)
+        return experiences
+
+    def sample_columns(self, batch_size, batch_idxs=None):
+        """Return a randomized batch of experiences together with their extra columns
+
+        # Argument
+            batch_size (int): Size of the all batch
+            batch_idxs (int): Indexes to extract
+        # Returns
+            A list of experiences randomly selected and a dict mapping each column name to an
+            array of shape (batch_size,) with the values of the same transitions
+        """
+        experiences, transition_idxs = self._sample(batch_size, batch_idxs)
+        columns = {}
+        for name, dtype in self.columns.items():
+            data = self.column_data[name]
+            columns[name] = np.array([data[idx] for idx in transition_idxs], dtype=dtype)
+        return experiences, columns
+
+    def _sample(self, batch_size, batch_idxs=None):
         # It is not possible to tell whether the first state in the memory is terminal, because it
         # would require access to the "terminal" flag associated to the previous state. As a result
         # we will never return this first state (only using `self.terminals[0]` to know whether the
@@ -196,6 +298,7 @@ class SequentialMemory(Memory):
 
         # Create experiences
         experiences = []
+        transition_idxs = []
         for idx in batch_idxs:
             terminal0 = self.terminals[idx - 2]
             while terminal0:
@@ -235,10 +338,11 @@ class SequentialMemory(Memory):
             assert len(state1) == len(state0)
             experiences.append(Experience(state0=state0, action=action, reward=reward,
                                           state1=state1, terminal1=terminal1))
+            transition_idxs.append(idx - 1)
         assert len(experiences) == batch_size
-        return experiences
+        return experiences, transition_idxs
 
-    def append(self, observation, action, reward, terminal, training=True):
+    def append(self, observation, action, reward, terminal, training=True, **columns):
         """Append an observation to the memory
 
         # Argument
@@ -246,8 +350,12 @@ class SequentialMemory(Memory):
             action (int): Action taken to obtain this observation
             reward (float): Reward obtained by taking this action
             terminal (boolean): Is the state terminal
+            columns: Values of the extra columns of this transition. Missing columns are stored as 0
         """ 
         super(SequentialMemory, self).append(observation, action, reward, terminal, training=training)
+        for name in columns:
+            if name not in self.columns:
+                raise ValueError('Unknown memory column "{}". Declared columns are {}.'.format(name, sorted(self.columns)))
         
         # This needs to be understood as follows: in `observation`, take `action`, obtain `reward`
         # and weather the next state is `terminal` or not.
@@ -256,6 +364,8 @@ class SequentialMemory(Memory):
             self.actions.append(action)
             self.rewards.append(reward)
             self.terminals.append(terminal)
+            for name, data in self.column_data.items():
+                data.append(columns.get(name, 0))
 
     @property
     def nb_entries(self):
@@ -274,6 +384,7 @@ class SequentialMemory(Memory):
         """
         config = super(SequentialMemory, self).get_config()
         config['limit'] = self.limit
+        config['columns'] = self.columns
         return config
 
 
@@ -330,6 +441,18 @@ class EpisodeParameterMemory(Memory):
         self.params.append(params)
         self.intermediate_rewards = []
 
+    def append_episodes(self, params, total_rewards):
+        """Stores several finished episodes at once, e.g. a whole evaluated population
+
+        # Argument
+            params (list): Parameters of each episode
+            total_rewards (list): Summed up reward of each episode
+        """
+        assert len(params) == len(total_rewards)
+        for p, total_reward in zip(params, total_rewards):
+            self.params.append(p)
+            self.total_rewards.append(total_reward)
+
     @property
     def nb_entries(self):
         """Return number of episode rewards
@@ -348,3 +471,399 @@ class EpisodeParameterMemory(Memory):
         config = super(SequentialMemory, self).get_config()
         config['limit'] = self.limit
         return config
+
+
+def _quantize(x, dtype, scale):
+    if scale is None:
+        return x
+    info = np.iinfo(dtype)
+    return np.clip(np.round(np.asarray(x) / scale), info.min, info.max)
+
+
+def _dequantize(x, scale):
+    x = x.astype('float64')
+    if scale is None:
+        return x
+    return x * scale
+
+
+class CompactSequentialMemory(SequentialMemory):
+    """`SequentialMemory` that keeps transitions in preallocated, compactly typed arrays.
+
+    Observations and actions are stored as `float32`, `float16` or fixed point integers, rewards
+    as `float32` and terminals as one bit each. Samples are upcast to `float64` only when a batch
+    is drawn. A million `PendulumEnv2` transitions take about 12 MB with `float16` storage,
+    compared to hundreds of bytes per transition in `SequentialMemory`.
+
+    # Arguments
+        limit (int): Maximum number of stored transitions.
+        observation_dtype (str): Storage type of the observations. For integer types such as
+            `'int16'` the observations are stored in fixed point, i.e. as `round(x / scale)`.
+        observation_scale (float or np.ndarray): Quantization step of integer observations,
+            either scalar or one value per observation dimension.
+        action_dtype (str): Storage type of the actions, see `observation_dtype`.
+        action_scale (float or np.ndarray): Quantization step of integer actions.
+        columns (dict): Optional extra per-transition columns, see `SequentialMemory`.
+    """
+    def __init__(self, limit, observation_dtype='float32', observation_scale=None,
+                 action_dtype='float32', action_scale=None, columns=None, **kwargs):
+        # Skip the ring buffers of `SequentialMemory`, the arrays are allocated on the first append.
+        super(SequentialMemory, self).__init__(**kwargs)
+        for dtype, scale in ((observation_dtype, observation_scale), (action_dtype, action_scale)):
+            if np.issubdtype(np.dtype(dtype), np.integer) and scale is None:
+                raise ValueError('Fixed point storage as "{}" needs a scale.'.format(dtype))
+        self.limit = limit
+        self.columns = dict(columns) if columns else {}
+        self.observation_dtype = observation_dtype
+        self.observation_scale = observation_scale
+        self.action_dtype = action_dtype
+        self.action_scale = action_scale
+        if not np.issubdtype(np.dtype(observation_dtype), np.integer):
+            self.observation_scale = None
+        if not np.issubdtype(np.dtype(action_dtype), np.integer):
+            self.action_scale = None
+
+        self.start = 0
+        self.length = 0
+        self.observations = None
+        self.actions = None
+        self.rewards = np.zeros(limit, dtype='float32')
+        self.terminals = np.zeros((limit + 7) // 8, dtype='uint8')
+        self.column_data = {name: np.zeros(limit, dtype=dtype) for name, dtype in self.columns.items()}
+
+    def _positions(self, idxs):
+        return (self.start + idxs) % self.limit
+
+    def _terminal(self, idxs):
+        positions = self._positions(idxs)
+        return ((self.terminals[positions >> 3] >> (positions & 7)) & 1).astype(bool)
+
+    def _observation(self, idxs):
+        return _dequantize(self.observations[self._positions(idxs)], self.observation_scale)
+
+    def _sample_idxs(self, batch_size, batch_idxs):
+        assert self.nb_entries >= self.window_length + 2, 'not enough entries in the memory'
+        if batch_idxs is None:
+            batch_idxs = sample_batch_indexes(
+                self.window_length, self.nb_entries - 1, size=batch_size)
+        batch_idxs = np.array(batch_idxs) + 1
+        assert np.min(batch_idxs) >= self.window_length + 1
+        assert np.max(batch_idxs) < self.nb_entries
+        assert len(batch_idxs) == batch_size
+
+        # Transitions that start right after a reset are replaced by random ones, like in
+        # `SequentialMemory`.
+        restart = self._terminal(batch_idxs - 2)
+        while np.any(restart):
+            batch_idxs[restart] = sample_batch_indexes(
+                self.window_length + 1, self.nb_entries, size=int(np.sum(restart)))
+            restart = self._terminal(batch_idxs - 2)
+        return batch_idxs
+
+    def sample_arrays(self, batch_size, batch_idxs=None, columns=False):
+        """Return a randomized batch of transitions as stacked arrays
+
+        # Argument
+            batch_size (int): Size of the all batch
+            batch_idxs (int): Indexes to extract
+            columns (boolean): Also return the extra columns of the transitions
+        # Returns
+            `(state0, action, reward, state1, terminal1)` with states of shape
+            `(batch_size, window_length) + observation_shape` and `terminal1` being 0. for
+            terminal and 1. for non-terminal transitions, followed by a dict of the extra columns
+            if `columns` is set
+        """
+        idxs = self._sample_idxs(batch_size, batch_idxs)
+
+        # Window slot `window_length - 1 - k` holds the observation `k` steps before the
+        # transition, slots that reach into the previous episode are zeroed.
+        offsets = np.arange(self.window_length)[::-1]
+        state0 = self._observation(idxs[:, None] - 1 - offsets[None, :])
+        if self.window_length > 1 and not self.ignore_episode_boundaries:
+            breaks = self._terminal(idxs[:, None] - 3 - np.arange(self.window_length - 1)[None, :])
+            cut = np.logical_or.accumulate(breaks, axis=1)[:, ::-1]
+            state0[np.hstack([cut, np.zeros((batch_size, 1), dtype=bool)])] = 0.
+        state1 = np.concatenate([state0[:, 1:], self._observation(idxs)[:, None]], axis=1)
+
+        positions = self._positions(idxs - 1)
+        action = _dequantize(self.actions[positions], self.action_scale)
+        reward = self.rewards[positions].astype('float64')
+        terminal1 = 1. - self._terminal(idxs - 1)
+        batch = (state0, action, reward, state1, terminal1)
+        if columns:
+            batch += ({name: data[positions] for name, data in self.column_data.items()},)
+        return batch
+
+    def _sample(self, batch_size, batch_idxs=None):
+        state0, action, reward, state1, terminal1, columns = self.sample_arrays(batch_size, batch_idxs, columns=True)
+        experiences = [Experience(state0=list(state0[i]), action=action[i], reward=reward[i],
+                                  state1=list(state1[i]), terminal1=terminal1[i] == 0.)
+                       for i in range(batch_size)]
+        return experiences, columns
+
+    def sample_columns(self, batch_size, batch_idxs=None):
+        """Return a randomized batch of experiences together with their extra columns
+
+        # Argument
+            batch_size (int): Size of the all batch
+            batch_idxs (int): Indexes to extract
+        # Returns
+            A list of experiences randomly selected and a dict mapping each column name to an
+            array of shape (batch_size,) with the values of the same transitions
+        """
+        return self._sample(batch_size, batch_idxs)
+
+    def append(self, observation, action, reward, terminal, training=True, **columns):
+        """Append an observation to the memory
+
+        # Argument
+            observation (np.ndarray): Observation returned by environment
+            action (np.ndarray): Action taken to obtain this observation
+            reward (float): Reward obtained by taking this action
+            terminal (boolean): Is the state terminal
+            columns: Values of the extra columns of this transition. Missing columns are stored as 0
+        """
+        super(SequentialMemory, self).append(observation, action, reward, terminal, training=training)
+        for name in columns:
+            if name not in self.columns:
+                raise ValueError('Unknown memory column "{}". Declared columns are {}.'.format(name, sorted(self.columns)))
+        if not training:
+            return
+
+        if self.observations is None:
+            self.observations = np.zeros((self.limit,) + np.shape(observation), dtype=self.observation_dtype)
+            self.actions = np.zeros((self.limit,) + np.shape(action), dtype=self.action_dtype)
+        position = (self.start + self.length) % self.limit
+        if self.length < self.limit:
+            self.length += 1
+        else:
+            self.start = (self.start + 1) % self.limit
+        self.observations[position] = _quantize(observation, self.observation_dtype, self.observation_scale)
+        self.actions[position] = _quantize(action, self.action_dtype, self.action_scale)
+        self.rewards[position] = reward
+        bit = 1 << (position & 7)
+        if terminal:
+            self.terminals[position >> 3] |= bit
+        else:
+            self.terminals[position >> 3] &= 255 ^ bit
+        for name, data in self.column_data.items():
+            data[position] = columns.get(name, 0)
+
+    @property
+    def nb_entries(self):
+        """Return number of observations
+
+        # Returns
+            Number of observations
+        """
+        return self.length
+
+    @property
+    def nbytes(self):
+        """Return the number of bytes allocated for the stored transitions"""
+        arrays = [self.observations, self.actions, self.rewards, self.terminals] + list(self.column_data.values())
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def get_config(self):
+        """Return configurations of CompactSequentialMemory
+
+        # Returns
+            Dict of config
+        """
+        config = super(CompactSequentialMemory, self).get_config()
+        config['observation_dtype'] = self.observation_dtype
+        config['observation_scale'] = np.asarray(self.observation_scale).tolist() if self.observation_scale is not None else None
+        config['action_dtype'] = self.action_dtype
+        config['action_scale'] = np.asarray(self.action_scale).tolist() if self.action_scale is not None else None
+        return config
+
+
+class _SegmentWriter(CompactSequentialMemory):
+    # Appends to one segment of a `SharedSequentialMemory` and publishes the new `start` and
+    # `length` after the transition has been written, so that readers never see a half-written
+    # slot at the newest end of the segment.
+    def __init__(self, bounds, **kwargs):
+        super(_SegmentWriter, self).__init__(**kwargs)
+        self.bounds = bounds
+
+    def append(self, observation, action, reward, terminal, training=True, **columns):
+        super(_SegmentWriter, self).append(observation, action, reward, terminal, training=training, **columns)
+        self.bounds[0] = self.start
+        self.bounds[1] = self.length
+
+
+class SharedSequentialMemory(CompactSequentialMemory):
+    """Replay memory whose transitions live in `multiprocessing` shared memory.
+
+    The buffer is split into one segment per writer. Writer `i` appends through `writer(i)`
+    without any locking, the memory's own `append` writes to segment 0, so an agent that owns
+    the memory works unchanged. `sample` draws from all segments in proportion to their size
+    and reads the shared arrays directly. The memory has to be handed to the collector
+    processes as an argument of `multiprocessing.Process` (or inherited by forking), each
+    writer index must only be used by a single process.
+
+    Once a segment is full, a writer overwrites its oldest slot. Readers therefore skip the
+    `margin` oldest transitions of a full segment, which leaves a writer `margin` appends
+    before it can touch a slot that is being sampled.
+
+    # Arguments
+        limit (int): Maximum number of stored transitions over all segments.
+        observation_shape (tuple): Shape of a single observation.
+        action_shape (tuple): Shape of a single action.
+        nb_writers (int): Number of segments.
+        margin (int): Number of oldest transitions of a full segment that are never sampled.
+        observation_dtype, observation_scale, action_dtype, action_scale, columns: See
+            `CompactSequentialMemory`.
+    """
+    def __init__(self, limit, observation_shape, action_shape, nb_writers=1, margin=64,
+                 observation_dtype='float32', observation_scale=None, action_dtype='float32',
+                 action_scale=None, columns=None, **kwargs):
+        super(SharedSequentialMemory, self).__init__(
+            limit, observation_dtype=observation_dtype, observation_scale=observation_scale,
+            action_dtype=action_dtype, action_scale=action_scale, columns=columns, **kwargs)
+        # The arrays of `CompactSequentialMemory` are replaced by the shared segments.
+        self.rewards = self.terminals = None
+        self.column_data = {}
+        self.segment_limit = limit // nb_writers
+        if self.segment_limit <= margin + self.window_length + 2:
+            raise ValueError('Segments of {} transitions are too small for a margin of {}.'.format(self.segment_limit, margin))
+        self.observation_shape = tuple(observation_shape)
+        self.action_shape = tuple(action_shape)
+        self.nb_writers = nb_writers
+        self.margin = margin
+
+        n = self.segment_limit
+        self.specs = {
+            'observations': ((nb_writers, n) + self.observation_shape, observation_dtype),
+            'actions': ((nb_writers, n) + self.action_shape, action_dtype),
+            'rewards': ((nb_writers, n), 'float32'),
+            'terminals': ((nb_writers, (n + 7) // 8), 'uint8'),
+            'bounds': ((nb_writers, 2), 'int64'),
+        }
+        for name, dtype in self.columns.items():
+            self.specs['column:' + name] = ((nb_writers, n), dtype)
+        self.buffers = {name: mp.RawArray('b', int(np.prod(shape)) * np.dtype(dtype).itemsize)
+                        for name, (shape, dtype) in self.specs.items()}
+        self._bind()
+
+    def _bind(self):
+        arrays = {name: np.frombuffer(self.buffers[name], dtype=dtype).reshape(shape)
+                  for name, (shape, dtype) in self.specs.items()}
+        self.bounds = arrays['bounds']
+        # Every segment is read through its own `CompactSequentialMemory` view of the shared
+        # arrays, and written through a `_SegmentWriter` with its own copy of the bounds.
+        self.readers = []
+        self.writers = []
+        for i in range(self.nb_writers):
+            segment = []
+            for memory in (CompactSequentialMemory(**self._segment_config()),
+                           _SegmentWriter(self.bounds[i], **self._segment_config())):
+                memory.observations = arrays['observations'][i]
+                memory.actions = arrays['actions'][i]
+                memory.rewards = arrays['rewards'][i]
+                memory.terminals = arrays['terminals'][i]
+                memory.column_data = {name: arrays['column:' + name][i] for name in self.columns}
+                memory.start, memory.length = (int(x) for x in self.bounds[i])
+                segment.append(memory)
+            self.readers.append(segment[0])
+            self.writers.append(segment[1])
+
+    def _segment_config(self):
+        return {
+            'limit': self.segment_limit,
+            'observation_dtype': self.observation_dtype,
+            'observation_scale': self.observation_scale,
+            'action_dtype': self.action_dtype,
+            'action_scale': self.action_scale,
+            'columns': self.columns,
+            'window_length': self.window_length,
+            'ignore_episode_boundaries': self.ignore_episode_boundaries,
+        }
+
+    def __getstate__(self):
+        # The shared buffers are passed on, the numpy views and segment objects are rebuilt.
+        state = self.__dict__.copy()
+        for name in ('bounds', 'readers', 'writers'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._bind()
+
+    def writer(self, i):
+        """Return the memory that appends to segment `i`
+
+        # Argument
+            i (int): Index of the segment, in `[0, nb_writers)`
+
+        # Returns
+            An object with the `append` method of `SequentialMemory`
+        """
+        return self.writers[i]
+
+    def append(self, observation, action, reward, terminal, training=True, **columns):
+        """Append an observation to segment 0, see `SequentialMemory.append`"""
+        super(SequentialMemory, self).append(observation, action, reward, terminal, training=training)
+        self.writers[0].append(observation, action, reward, terminal, training=training, **columns)
+
+    def _snapshot(self):
+        # Point the readers at the currently published bounds, without the margin of full segments.
+        sizes = np.zeros(self.nb_writers, dtype=int)
+        for i, reader in enumerate(self.readers):
+            start, length = (int(x) for x in self.bounds[i])
+            if length == self.segment_limit:
+                start, length = (start + self.margin) % self.segment_limit, length - self.margin
+            reader.start, reader.length = start, length
+            if length >= self.window_length + 2:
+                sizes[i] = length
+        return sizes
+
+    def sample_arrays(self, batch_size, batch_idxs=None, columns=False):
+        """Return a randomized batch of transitions from all segments as stacked arrays
+
+        # Argument
+            batch_size (int): Size of the all batch
+            batch_idxs: Not supported, transitions are always drawn at random
+            columns (boolean): Also return the extra columns of the transitions
+        # Returns
+            See `CompactSequentialMemory.sample_arrays`
+        """
+        if batch_idxs is not None:
+            raise ValueError('`SharedSequentialMemory` cannot sample given indexes.')
+        sizes = self._snapshot()
+        assert np.sum(sizes) > 0, 'not enough entries in the memory'
+        counts = np.random.multinomial(batch_size, sizes / float(np.sum(sizes)))
+        parts = [reader.sample_arrays(count, columns=columns)
+                 for reader, count in zip(self.readers, counts) if count > 0]
+        batch = tuple(np.concatenate(arrays) for arrays in list(zip(*parts))[:5])
+        if columns:
+            batch += ({name: np.concatenate([part[5][name] for part in parts]) for name in self.columns},)
+        return batch
+
+    @property
+    def nb_entries(self):
+        """Return number of observations over all segments
+
+        # Returns
+            Number of observations
+        """
+        return int(np.sum(self.bounds[:, 1]))
+
+    @property
+    def nbytes(self):
+        """Return the number of bytes of shared memory"""
+        return sum(len(buffer) for buffer in self.buffers.values())
+
+    def get_config(self):
+        """Return configurations of SharedSequentialMemory
+
+        # Returns
+            Dict of config
+        """
+        config = super(SharedSequentialMemory, self).get_config()
+        config['observation_shape'] = self.observation_shape
+        config['action_shape'] = self.action_shape
+        config['nb_writers'] = self.nb_writers
+        config['margin'] = self.margin
+        return config
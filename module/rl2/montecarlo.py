@@ -0,0 +1,246 @@
+"""Parallel Monte-Carlo estimates of V and Q of a policy, with an on-disk result cache.
+
+Rows (a state, optionally with a first decision `(u, tau)` for Q) are split into chunks that a
+process pool simulates. Every chunk runs whole batches of noisy episodes side by side with the
+plants of `rl2.dp`, queries the actor once per decision for all of them, and stops adding
+episodes once the standard error of every row is below `tol`. Results are stored under a hash
+of the policy (for keras models its architecture and weights), the plant, the reward setup and
+the rows, so asking for the same table again only reads a file.
+"""
+from __future__ import division
+import functools
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import pickle
+
+import numpy as np
+
+from rl2.dp import linear_interval, pendulum_interval
+
+_worker_policy = None
+
+
+class LinearPolicy(object):
+    """Picklable policy `u = K x` held for the constant interval `tau`."""
+    def __init__(self, K, tau):
+        self.K = np.asarray(K, dtype=np.float64)
+        self.tau = float(tau)
+
+    def __call__(self, states):
+        return np.stack([np.dot(states, self.K), np.full(len(states), self.tau)], axis=1)
+
+
+class ActorPolicy(object):
+    """Policy of a keras actor, built from its JSON config and weights so it can be sent to workers
+
+    # Arguments
+        actor (`keras.models.Model` instance): Actor mapping `(N, 1, d)` states to `(N, 2)`.
+    """
+    def __init__(self, actor):
+        self.config = actor.to_json()
+        self.weights = actor.get_weights()
+        self.actor = actor
+
+    def __getstate__(self):
+        return {'config': self.config, 'weights': self.weights}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.actor = None
+
+    def __call__(self, states):
+        if self.actor is None:
+            from keras2.models import model_from_json
+            self.actor = model_from_json(self.config)
+            self.actor.set_weights(self.weights)
+        return self.actor.predict_on_batch(states[:, None])
+
+    def fingerprint(self):
+        digest = hashlib.sha1(self.config.encode('utf-8'))
+        for w in self.weights:
+            digest.update(np.ascontiguousarray(w).tobytes())
+        return digest.hexdigest()
+
+
+def policy_fingerprint(policy):
+    """Content hash of a policy: `fingerprint()` if it has one, its pickle otherwise."""
+    if hasattr(policy, 'fingerprint'):
+        return policy.fingerprint()
+    return hashlib.sha1(pickle.dumps(policy, protocol=2)).hexdigest()
+
+
+def plant_of(env):
+    """Returns the batched plant of `env` (`LinearEnv` or `PendulumEnv2`) and its parameters."""
+    if hasattr(env, 'A'):
+        params = {'A': np.asarray(env.A).tolist(), 'B': np.asarray(env.B).tolist(), 'D': np.asarray(env.D).tolist()}
+        return 'linear', params
+    if hasattr(env, 'g'):
+        return 'pendulum', {'g': env.g, 'm': env.m, 'l': env.l, 'max_speed': env.max_speed}
+    raise ValueError('No batched plant for environment {}.'.format(type(env).__name__))
+
+
+def _interval(plant, params, **kwargs):
+    interval = linear_interval if plant == 'linear' else pendulum_interval
+    return functools.partial(interval, **dict(params, **kwargs))
+
+
+def _init_worker(policy):
+    global _worker_policy
+    _worker_policy = policy
+
+
+def _estimate_chunk(job):
+    """Discounted returns of one chunk of rows, in batches of episodes until `tol` is met."""
+    states, first_actions, seed, setup = job
+    policy = _worker_policy if setup['policy'] is None else setup['policy']
+    rng = np.random.RandomState(seed)
+    interval = _interval(setup['plant'], setup['params'], alpha=setup['alpha'], dt=setup['dt'],
+                         substeps_per_unit=setup['substeps_per_unit'], ln=setup['ln'], random_state=rng)
+    nb_rows = len(states)
+    total = np.zeros(nb_rows)
+    total_sq = np.zeros(nb_rows)
+    nb_episodes = 0
+    while nb_episodes < setup['max_episodes']:
+        batch = min(setup['batch_episodes'], setup['max_episodes'] - nb_episodes)
+        x = np.tile(states, (batch, 1))
+        elapsed = np.zeros(len(x))
+        returns = np.zeros(len(x))
+        for step in range(setup['nb_decisions']):
+            if step == 0 and first_actions is not None:
+                action = np.tile(first_actions, (batch, 1))
+            else:
+                action = np.asarray(policy(x), dtype=np.float64)
+            tau = np.clip(action[:, 1], setup['tau_min'], setup['tau_max'])
+            x, reward = interval(x, action[:, 0], tau)
+            returns += np.exp(-setup['alpha'] * elapsed) * (reward - setup['beta'])
+            elapsed += tau
+        returns = returns.reshape(batch, nb_rows)
+        total += returns.sum(axis=0)
+        total_sq += (returns ** 2).sum(axis=0)
+        nb_episodes += batch
+        if setup['tol'] is not None and nb_episodes > 1:
+            mean = total / nb_episodes
+            var = np.maximum(total_sq / nb_episodes - mean ** 2, 0.) * nb_episodes / (nb_episodes - 1)
+            if np.max(np.sqrt(var / nb_episodes)) < setup['tol']:
+                break
+    mean = total / nb_episodes
+    var = np.maximum(total_sq / nb_episodes - mean ** 2, 0.) * nb_episodes / max(1, nb_episodes - 1)
+    return mean, np.sqrt(var / nb_episodes), np.full(nb_rows, nb_episodes)
+
+
+class MonteCarloEstimator(object):
+    """Monte-Carlo V and Q tables of a policy on `LinearEnv` or `PendulumEnv2`
+
+    Rewards follow `rl2.evaluation`: one decision earns the discounted integral of the running
+    reward minus `beta`, and decisions are discounted by `exp(-alpha * t)`.
+
+    # Arguments
+        env (Env): Plant whose parameters are used, see `plant_of`.
+        alpha (float): Discount rate per unit of time.
+        beta (float): Cost per decision.
+        ln (float): Noise level, as passed to `env.step`.
+        nb_decisions (integer): Number of decisions per episode (`step_limit` of the notebooks).
+        max_episodes (integer): Largest number of episodes per row.
+        batch_episodes (integer): Episodes simulated side by side between two checks of `tol`.
+        tol (float): Stop once the standard error of all rows of a chunk is below this. If
+            `None`, always run `max_episodes`.
+        nb_workers (integer): Size of the process pool. `0` runs in this process.
+        chunk_size (integer): Rows per job. Together with `seed` it fixes the random streams,
+            so results do not depend on `nb_workers`.
+        cache_dir (str): Directory of the result cache, `None` to disable it.
+        dt, substeps_per_unit: See `rl2.evaluation.substeps`.
+        tau_min, tau_max (float): Bounds of the intervals returned by the policy.
+        seed (integer): Base seed of the chunks.
+    """
+    def __init__(self, env, alpha=.4, beta=1., ln=1., nb_decisions=200, max_episodes=64, batch_episodes=8,
+                 tol=None, nb_workers=0, chunk_size=64, cache_dir=None, dt=None, substeps_per_unit=20,
+                 tau_min=.01, tau_max=10., seed=0):
+        self.plant, self.params = plant_of(env)
+        self.alpha = alpha
+        self.beta = beta
+        self.ln = ln
+        self.nb_decisions = nb_decisions
+        self.max_episodes = max_episodes
+        self.batch_episodes = batch_episodes
+        self.tol = tol
+        self.nb_workers = nb_workers
+        self.chunk_size = chunk_size
+        self.cache_dir = cache_dir
+        self.dt = dt
+        self.substeps_per_unit = substeps_per_unit
+        self.tau_min = tau_min
+        self.tau_max = tau_max
+        self.seed = seed
+
+    def get_config(self):
+        config = {k: getattr(self, k) for k in ('plant', 'params', 'alpha', 'beta', 'ln', 'nb_decisions',
+                                                'max_episodes', 'batch_episodes', 'tol', 'chunk_size',
+                                                'dt', 'substeps_per_unit', 'tau_min', 'tau_max', 'seed')}
+        return config
+
+    def cache_key(self, policy, states, first_actions=None):
+        digest = hashlib.sha1(json.dumps(self.get_config(), sort_keys=True, default=str).encode('utf-8'))
+        digest.update(policy_fingerprint(policy).encode('utf-8'))
+        digest.update(np.ascontiguousarray(states, dtype=np.float64).tobytes())
+        if first_actions is not None:
+            digest.update(b'q')
+            digest.update(np.ascontiguousarray(first_actions, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def _estimate(self, policy, states, first_actions=None):
+        if not callable(getattr(policy, 'fingerprint', None)) and hasattr(policy, 'predict_on_batch'):
+            policy = ActorPolicy(policy)
+        states = np.atleast_2d(np.asarray(states, dtype=np.float64))
+        if first_actions is not None:
+            first_actions = np.asarray(first_actions, dtype=np.float64).reshape(len(states), 2)
+
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, 'mc_{}.npz'.format(self.cache_key(policy, states, first_actions)))
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    return data['mean'], data['stderr'], data['nb_episodes']
+
+        setup = dict(self.get_config(), policy=None if self.nb_workers else policy)
+        jobs = []
+        for i, start in enumerate(range(0, len(states), self.chunk_size)):
+            rows = slice(start, start + self.chunk_size)
+            jobs.append((states[rows], None if first_actions is None else first_actions[rows],
+                         self.seed + i, setup))
+        if self.nb_workers:
+            # Spawned workers rebuild the actor once and do not share a backend session with us.
+            pool = mp.get_context('spawn').Pool(self.nb_workers, initializer=_init_worker, initargs=(policy,))
+            try:
+                results = pool.map(_estimate_chunk, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_estimate_chunk(job) for job in jobs]
+        mean, stderr, nb_episodes = [np.concatenate(r) for r in zip(*results)]
+
+        if path is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            np.savez(path, mean=mean, stderr=stderr, nb_episodes=nb_episodes)
+        return mean, stderr, nb_episodes
+
+    def value(self, policy, states):
+        """Estimates V of `policy` at a `(N, d)` batch of states
+
+        # Arguments
+            policy (function or `keras.models.Model` instance): Maps `(N, d)` states to `(N, 2)`
+                rows `(u, tau)`. A keras actor is wrapped in `ActorPolicy`. With `nb_workers`,
+                the policy has to be picklable.
+            states (np.ndarray): States to evaluate, e.g. `rl2.evaluation.state_grid()`.
+
+        # Returns
+            `(mean, stderr, nb_episodes)`, each of shape `(N,)`.
+        """
+        return self._estimate(policy, states)
+
+    def q_value(self, policy, states, actions):
+        """Estimates Q of `policy` for `(N, 2)` first decisions `(u, tau)` at `(N, d)` states, see `value`."""
+        return self._estimate(policy, states, actions)
@@ -0,0 +1,128 @@
+"""Offline TD(0) / fitted-Q training of a critic on a fixed dataset of transitions."""
+from __future__ import division
+
+import numpy as np
+from keras2.callbacks import Callback
+
+
+class _BatchLossRecorder(Callback):
+    def __init__(self, losses):
+        super(_BatchLossRecorder, self).__init__()
+        self.losses = losses
+
+    def on_batch_end(self, batch, logs=None):
+        self.losses.append(logs['loss'])
+
+
+def _with_window(states):
+    # The critics take `(batch, window_length) + observation_shape`.
+    states = np.asarray(states)
+    return states[:, None] if states.ndim == 2 else states
+
+
+class OfflineCriticTrainer(object):
+    """Learns the Q (or V) function of a fixed policy from stacked transition arrays
+
+    Training runs in rounds of `target_model_update` minibatch steps. At the start of a round
+    the targets `r + exp(-alpha * tau) * terminal1 * Q(s1, policy(s1))` of the whole dataset are
+    computed from the current critic in a few large batched `predict` calls, i.e. the critic
+    acts as its own hard-updated target network for that round. The round's steps then run as
+    one `fit` call over the next rows of shuffled permutations of the dataset, so no batch is
+    assembled in Python.
+
+    # Arguments
+        critic (`keras.models.Model` instance): Compiled critic. With `actor`, its inputs are
+            `[action, state]` (or see `critic_action_input`), without it only `state`.
+        actor (`keras.models.Model` instance or function): Policy whose value is learned. Its
+            actions on all `state1` are computed once. `None` to learn a state value function.
+        critic_action_input (tensor): Action input of `critic`, as for the DDPG agents. Defaults
+            to the first input.
+        alpha (float): Discount rate per unit of time; a transition whose action is held for
+            `tau` is discounted by `exp(-alpha * tau)`.
+        batch_size (integer): Minibatch size of the critic updates.
+        target_model_update (integer): Number of updates between two target refreshes.
+        tau_index (integer): Column of the action that holds `tau`.
+        predict_batch_size (integer): Batch size of the target computation.
+    """
+    def __init__(self, critic, actor=None, critic_action_input=None, alpha=.4, batch_size=64,
+                 target_model_update=1000, tau_index=1, predict_batch_size=4096):
+        self.critic = critic
+        self.actor = actor
+        if actor is not None and critic_action_input is not None:
+            self.critic_action_input_idx = critic.input.index(critic_action_input)
+        else:
+            self.critic_action_input_idx = 0
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.target_model_update = target_model_update
+        self.tau_index = tau_index
+        self.predict_batch_size = predict_batch_size
+
+    def _inputs(self, action, state):
+        if self.actor is None:
+            return state
+        inputs = [state, state]
+        inputs[self.critic_action_input_idx] = action
+        inputs[1 - self.critic_action_input_idx] = state
+        return inputs
+
+    def _predict(self, action, state):
+        return self.critic.predict(self._inputs(action, state), batch_size=self.predict_batch_size).reshape(-1)
+
+    def fit(self, state0, action, reward, state1, terminal1=None, nb_steps=10000, verbose=0):
+        """Trains the critic for `nb_steps` minibatch updates
+
+        The arguments match the arrays of `memory.sample_arrays`, so a whole memory can be
+        trained on with `trainer.fit(*memory.sample_arrays(n)[:5])`.
+
+        # Arguments
+            state0 (np.ndarray): `(N, d)` or `(N, window_length, d)` states.
+            action (np.ndarray): `(N, nb_actions)` actions, including `tau`.
+            reward (np.ndarray): `(N,)` rewards of the transitions.
+            state1 (np.ndarray): Next states, shaped like `state0`.
+            terminal1 (np.ndarray): `(N,)`, 0. for terminal and 1. for non-terminal transitions.
+                All non-terminal if `None`.
+            nb_steps (integer): Number of minibatch updates.
+            verbose (integer): 1 prints the TD loss after every round.
+
+        # Returns
+            Dict with the training loss of every update under `loss` and the mean squared TD
+            error of the whole dataset at the start of every round under `td_loss`.
+        """
+        state0 = _with_window(state0)
+        state1 = _with_window(state1)
+        action = np.asarray(action)
+        reward = np.asarray(reward, dtype=np.float64).reshape(-1)
+        nb_transitions = len(reward)
+        mask = np.ones(nb_transitions) if terminal1 is None else np.asarray(terminal1, dtype=np.float64).reshape(-1)
+        discount = mask * np.exp(-self.alpha * action[:, self.tau_index])
+
+        next_action = None
+        if self.actor is not None:
+            if hasattr(self.actor, 'predict'):
+                next_action = self.actor.predict(state1, batch_size=self.predict_batch_size)
+            else:
+                next_action = np.asarray(self.actor(state1))
+
+        losses = []
+        td_losses = []
+        recorder = _BatchLossRecorder(losses)
+        order = np.zeros(0, dtype=np.int64)
+        step = 0
+        while step < nb_steps:
+            nb_round = min(self.target_model_update, nb_steps - step)
+            targets = reward + discount * self._predict(next_action, state1)
+            td_losses.append(np.mean((targets - self._predict(action, state0)) ** 2))
+            if verbose:
+                print('step {}: td loss {:.5f}'.format(step, td_losses[-1]))
+
+            # Rows of the next `nb_round` minibatches, continuing the current permutation.
+            nb_rows = nb_round * self.batch_size
+            while len(order) < nb_rows:
+                order = np.concatenate([order, np.random.permutation(nb_transitions)])
+            rows, order = order[:nb_rows], order[nb_rows:]
+            self.critic.fit(self._inputs(action[rows], state0[rows]), targets[rows, None],
+                            batch_size=self.batch_size, epochs=1, shuffle=False, verbose=0,
+                            callbacks=[recorder])
+            step += nb_round
+        return {'loss': np.array(losses), 'td_loss': np.array(td_losses)}
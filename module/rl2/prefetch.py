@@ -0,0 +1,175 @@
+from __future__ import absolute_import
+import threading
+
+import numpy as np
+from keras2.utils.data_utils import GeneratorEnqueuer
+
+
+def experience_batch(experiences, process_state_batch):
+    """Stacks sampled experiences into the arrays the DDPG agents train on
+
+    # Argument
+        experiences (list): `Experience` tuples as returned by `memory.sample`
+        process_state_batch (function): The agent's `process_state_batch`
+
+    # Returns
+        `(state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch)`, where
+        `terminal1_batch` is 0. for terminal and 1. for non-terminal transitions
+    """
+    state0_batch = []
+    reward_batch = []
+    action_batch = []
+    terminal1_batch = []
+    state1_batch = []
+    for e in experiences:
+        state0_batch.append(e.state0)
+        state1_batch.append(e.state1)
+        reward_batch.append(e.reward)
+        action_batch.append(e.action)
+        terminal1_batch.append(0. if e.terminal1 else 1.)
+    return (process_state_batch(state0_batch), np.array(action_batch), np.array(reward_batch),
+            process_state_batch(state1_batch), np.array(terminal1_batch))
+
+
+def array_batch(arrays, process_state_batch):
+    """Applies `process_state_batch` to the states of a `sample_arrays` batch"""
+    state0, action, reward, state1, terminal1 = arrays[:5]
+    return (process_state_batch(state0), action, reward, process_state_batch(state1), terminal1) + tuple(arrays[5:])
+
+
+def sample_batch(agent, columns=False):
+    """Returns the next training batch of `agent`
+
+    If the agent's memory is a `PrefetchingMemory`, the batch was prepared in the background,
+    otherwise it is sampled and stacked now. The time this takes is reported to `agent.timer`
+    as `memory.sample`.
+
+    # Argument
+        agent (Agent): Agent with `memory`, `batch_size`, `process_state_batch` and `timer`
+        columns (boolean): Also return the extra memory columns of the batch, see
+            `SequentialMemory.sample_columns`
+
+    # Returns
+        The arrays of `experience_batch`, followed by the dict of columns if `columns` is set
+    """
+    start = agent.timer.start()
+    batch = _sample_batch(agent, columns)
+    agent.timer.stop('memory.sample', start)
+    return batch
+
+
+def _sample_batch(agent, columns):
+    memory = agent.memory
+    if isinstance(memory, PrefetchingMemory):
+        return memory.get_batch(agent.batch_size, agent.process_state_batch, columns=columns)
+    if hasattr(memory, 'sample_arrays'):
+        return array_batch(memory.sample_arrays(agent.batch_size, columns=columns), agent.process_state_batch)
+    if columns:
+        experiences, column_batch = memory.sample_columns(agent.batch_size)
+        assert len(experiences) == agent.batch_size
+        return experience_batch(experiences, agent.process_state_batch) + (column_batch,)
+    experiences = memory.sample(agent.batch_size)
+    assert len(experiences) == agent.batch_size
+    return experience_batch(experiences, agent.process_state_batch)
+
+
+def stop_prefetching(agent):
+    """Stops the worker thread of the agent's memory if it is a `PrefetchingMemory`"""
+    memory = getattr(agent, 'memory', None)
+    if isinstance(memory, PrefetchingMemory):
+        memory.stop()
+
+
+class PrefetchingMemory(object):
+    """Replay memory wrapper that prepares training batches in a background thread
+
+    While the agent runs its network updates, a worker thread samples from the wrapped memory
+    and stacks the next batches, so `sample_batch` only has to pop one from a queue. Sampling
+    and appending are serialized by a lock, hence every batch is consistent, but it may miss the
+    last `max_queue_size` transitions that were appended after it was drawn.
+
+    Everything else (`append`, `get_recent_state`, `nb_entries`, ...) behaves like the wrapped
+    memory. The agents stop the worker at the end of `fit`, see `stop_prefetching`.
+
+    The worker samples with the global `random` and `np.random` generators, like the wrapped
+    memory, but from another thread and at times that depend on the scheduling. Hence runs are
+    not reproducible with a fixed seed, neither the batches nor the exploration noise drawn in
+    the main thread.
+
+    # Arguments
+        memory (Memory): The replay memory to sample from, e.g. a `SequentialMemory`.
+        max_queue_size (int): Number of batches prepared in advance.
+    """
+    def __init__(self, memory, max_queue_size=2):
+        self.memory = memory
+        self.max_queue_size = max_queue_size
+        self.lock = threading.Lock()
+        self.enqueuer = None
+        self._batches = None
+        self._batch_spec = None
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not found on the wrapper itself.
+        if name == 'memory':
+            raise AttributeError(name)
+        return getattr(self.memory, name)
+
+    def append(self, *args, **kwargs):
+        with self.lock:
+            self.memory.append(*args, **kwargs)
+
+    def sample(self, batch_size, batch_idxs=None):
+        with self.lock:
+            return self.memory.sample(batch_size, batch_idxs)
+
+    def sample_columns(self, batch_size, batch_idxs=None):
+        with self.lock:
+            return self.memory.sample_columns(batch_size, batch_idxs)
+
+    def sample_arrays(self, batch_size, batch_idxs=None, columns=False):
+        with self.lock:
+            return self.memory.sample_arrays(batch_size, batch_idxs, columns=columns)
+
+    def _generate(self, batch_size, process_state_batch, columns):
+        while True:
+            if hasattr(self.memory, 'sample_arrays'):
+                yield array_batch(self.sample_arrays(batch_size, columns=columns), process_state_batch)
+            elif columns:
+                experiences, column_batch = self.sample_columns(batch_size)
+                yield experience_batch(experiences, process_state_batch) + (column_batch,)
+            else:
+                yield experience_batch(self.sample(batch_size), process_state_batch)
+
+    def get_batch(self, batch_size, process_state_batch, columns=False):
+        """Returns the next prepared batch, starting the worker on the first call
+
+        # Argument
+            batch_size (int): Size of the batch
+            process_state_batch (function): The agent's `process_state_batch`
+            columns (boolean): Also return the extra memory columns of the batch
+
+        # Returns
+            The same as `sample_batch`
+        """
+        spec = (batch_size, process_state_batch, columns)
+        if self.enqueuer is not None and spec != self._batch_spec:
+            self.stop()
+        if self.enqueuer is None:
+            self._batch_spec = spec
+            self.enqueuer = GeneratorEnqueuer(self._generate(*spec), use_multiprocessing=False)
+            self.enqueuer.start(workers=1, max_queue_size=self.max_queue_size)
+            self._batches = self.enqueuer.get()
+        return next(self._batches)
+
+    def stop(self):
+        """Stops the worker thread. It is restarted by the next `get_batch`."""
+        if self.enqueuer is not None:
+            self.enqueuer.stop()
+        self.enqueuer = None
+        self._batches = None
+        self._batch_spec = None
+
+    def get_config(self):
+        config = self.memory.get_config()
+        config['max_queue_size'] = self.max_queue_size
+        return config
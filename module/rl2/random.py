@@ -56,3 +56,88 @@ class OrnsteinUhlenbeckProcess(AnnealedGaussianProcess):
 
     def reset_states(self):
         self.x_prev = np.random.normal(self.mu,self.current_sigma,self.size)
+
+
+class NoiseBank(RandomProcess):
+    """Exploration noise of `nb_processes` independent processes, sampled in one call.
+
+    With `theta=0.` every sample is white Gaussian noise `mu + sigma * z`, otherwise each process
+    follows the Ornstein-Uhlenbeck update of `OrnsteinUhlenbeckProcess`. The standard normal
+    draws are generated `block_size` steps ahead, so that most calls to `sample` do not touch
+    the random number generator at all.
+
+    # Arguments
+        nb_processes (int): Number of independent processes, e.g. one per environment.
+        size (int): Dimension of each process, e.g. 2 for `(u, tau)`.
+        theta (float): Mean reversion rate, 0. for white noise.
+        mu (float or np.ndarray): Mean, scalar or per dimension.
+        sigma (float or np.ndarray): Initial standard deviation, scalar or per dimension.
+        sigma_min (float or np.ndarray): Standard deviation after annealing, `None` to keep
+            `sigma` constant.
+        n_steps_annealing (int): Number of `sample` calls over which sigma is linearly annealed.
+        dt (float): Time step of the Ornstein-Uhlenbeck update.
+        block_size (int): Number of steps of standard normal draws generated at once.
+        seed (int): Seed of a private `np.random.RandomState`. If `None`, the global numpy
+            generator is used, so `np.random.seed` applies.
+    """
+    def __init__(self, nb_processes, size, theta=0., mu=0., sigma=1., sigma_min=None,
+                 n_steps_annealing=1000, dt=1e-2, block_size=1024, seed=None):
+        self.nb_processes = nb_processes
+        self.size = size
+        self.theta = theta
+        self.mu = np.broadcast_to(np.asarray(mu, dtype=float), (size,))
+        self.sigma = np.broadcast_to(np.asarray(sigma, dtype=float), (size,))
+        if sigma_min is not None:
+            self.sigma_min = np.broadcast_to(np.asarray(sigma_min, dtype=float), (size,))
+            self.m = -(self.sigma - self.sigma_min) / float(n_steps_annealing)
+        else:
+            self.sigma_min = self.sigma
+            self.m = np.zeros(size)
+        self.dt = dt
+        self.block_size = block_size
+        self.random_state = np.random if seed is None else np.random.RandomState(seed)
+        self.n_steps = 0
+        self.block = None
+        self.block_index = block_size
+        self.x_prev = None
+        self.reset_states()
+
+    @property
+    def current_sigma(self):
+        return np.maximum(self.sigma_min, self.m * float(self.n_steps) + self.sigma)
+
+    def _normal(self):
+        if self.block_index == self.block_size:
+            self.block = self.random_state.standard_normal((self.block_size, self.nb_processes, self.size))
+            self.block_index = 0
+        z = self.block[self.block_index]
+        self.block_index += 1
+        return z
+
+    def sample(self):
+        """Advances all processes by one step
+
+        # Returns
+            A np.ndarray of shape (nb_processes, size)
+        """
+        z = self._normal()
+        if self.theta == 0.:
+            x = self.mu + self.current_sigma * z
+        else:
+            x = self.x_prev + self.theta * (self.mu - self.x_prev) * self.dt + self.current_sigma * np.sqrt(self.dt) * z
+        self.x_prev = x
+        self.n_steps += 1
+        return x
+
+    def reset_states(self, idxs=None):
+        """Restarts the given processes, all of them if `idxs` is `None`
+
+        # Argument
+            idxs (list): Indexes of the processes whose episode ended
+        """
+        x = self.mu + self.current_sigma * self.random_state.standard_normal((self.nb_processes, self.size))
+        if idxs is None or self.x_prev is None:
+            self.x_prev = x
+        else:
+            self.x_prev = self.x_prev.copy()
+            self.x_prev[idxs] = x[idxs]
@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+import warnings
+
+import numpy as np
+from keras2.callbacks import History
+
+import rl2.barrier_certificate as bc
+
+from rl2.callbacks import (
+    Callback,
+    CallbackList,
+    TrainEpisodeLogger,
+    TrainIntervalLogger,
+    Visualizer,
+    reset_timer
+)
+from rl2.core import ObservationCopier
+
+
+class Decision(object):
+    """The input the agent commits to at one decision instant.
+
+    # Arguments
+        action (np.ndarray): Input applied to the plant until the next decision.
+        tau (float): Length of the interval. `None` for plants that integrate with their own
+            fixed time step, i.e. whose `step` only takes the action.
+        nb_substeps (integer): Number of `env.step` calls that make up the interval.
+        communicated (boolean): `True` if a new input was transmitted at this decision.
+    """
+    def __init__(self, action, tau=None, nb_substeps=1, communicated=True):
+        self.action = action
+        self.tau = tau
+        self.nb_substeps = nb_substeps
+        self.dt = None if tau is None else tau / nb_substeps
+        self.communicated = communicated
+        self.filtered = False
+
+    @property
+    def timed(self):
+        return self.tau is not None
+
+
+class TriggerPolicy(object):
+    """Decides when the agent is queried and for how long its input is held.
+
+    To implement your own trigger policy, you have to implement `decide` and optionally
+    `reset_states`, `hold` and `commit`.
+    """
+    def reset_states(self):
+        """Resets internally kept states at the beginning of each episode."""
+        pass
+
+    def decide(self, agent, observation, episode_step):
+        """Computes the decision for the current observation.
+
+        # Arguments
+            agent (`Agent` instance): The agent whose `forward` is queried.
+            observation (object): The current observation from the environment.
+            episode_step (integer): Number of decisions already taken in this episode.
+
+        # Returns
+            A `Decision` instance.
+        """
+        raise NotImplementedError()
+
+    def hold(self, action):
+        """Wraps an externally chosen action (e.g. a random start step) into a `Decision`."""
+        return Decision(action)
+
+    def commit(self, agent, decision, episode_step):
+        """Called once the safety filter has produced the input that is actually applied."""
+        pass
+
+
+class SelfTrigger(TriggerPolicy):
+    """Self-triggered control: the agent outputs `(u, tau)` and the input is held for `tau`.
+
+    # Arguments
+        substeps_per_unit (integer): Number of integration sub-steps per unit of time, so that
+            `dt = tau / ceil(substeps_per_unit * tau)` never exceeds `1 / substeps_per_unit`.
+    """
+    def __init__(self, substeps_per_unit=20):
+        self.substeps_per_unit = substeps_per_unit
+
+    def _decision(self, action, tau, communicated=True):
+        nb_substeps = int(np.ceil(self.substeps_per_unit * tau))
+        return Decision(action, tau=tau, nb_substeps=nb_substeps, communicated=communicated)
+
+    def decide(self, agent, observation, episode_step):
+        action_tau = agent.forward(observation)
+        return self._decision(np.array([action_tau[0]]), action_tau[1])
+
+    def hold(self, action):
+        return self._decision(action, 1.)
+
+
+class PeriodicTrigger(TriggerPolicy):
+    """Time-triggered control: the agent is queried every `tau` (or every env step).
+
+    # Arguments
+        tau (float): Sampling period. If `None`, the environment is stepped with the action
+            only and integrates with its own time step.
+        substeps_per_unit (integer): See `SelfTrigger`. Only used if `tau` is set.
+        action_repetition (integer): Number of `env.step` calls per decision if `tau` is `None`.
+    """
+    def __init__(self, tau=None, substeps_per_unit=200, action_repetition=1):
+        self.tau = tau
+        self.substeps_per_unit = substeps_per_unit
+        self.action_repetition = action_repetition
+
+    def hold(self, action):
+        if self.tau is None:
+            return Decision(action, nb_substeps=self.action_repetition)
+        nb_substeps = int(np.ceil(self.substeps_per_unit * self.tau))
+        return Decision(action, tau=self.tau, nb_substeps=nb_substeps)
+
+    def decide(self, agent, observation, episode_step):
+        return self.hold(agent.forward(observation))
+
+
+def _with_heads(action, communicated):
+    # Copy of an event action `(u, c_1, c_0)` whose heads encode whether it was transmitted.
+    action = np.array(action, dtype=np.float64)
+    action[1:3] = (1., 0.) if communicated else (0., 1.)
+    return action
+
+
+class EventTrigger(TriggerPolicy):
+    """Event-triggered control: the agent outputs `(u, c_1, c_0)` on every step and a new input
+    is transmitted only if `c_1 > c_0`. Otherwise the previously transmitted input is held.
+
+    The first step of each episode always communicates.
+
+    With a `condition` (see `rl2.triggers`), the condition replaces the comparison of the
+    heads: the agent is only queried when it fires, and on the other steps the held action is
+    recorded as the agent's action for the observation. In both cases the recorded heads are
+    set to the condition's decision, `(c_1, c_0) = (1, 0)` if it fired and `(0, 1)` otherwise,
+    so the heads learn to imitate the condition.
+
+    The condition compares against the observation of the last transmission, including inputs
+    that the safety filter forced to be transmitted.
+
+    # Arguments
+        epsilon (float): Probability scale for random communication. Defaults to `agent.epsilon`.
+        time_mode (boolean): If `True`, communicate on every step.
+        action_repetition (integer): Number of `env.step` calls per decision.
+        condition (`TriggerCondition` instance): Optional cheap trigger condition.
+    """
+    def __init__(self, epsilon=None, time_mode=False, action_repetition=1, condition=None):
+        self.epsilon = epsilon
+        self.time_mode = time_mode
+        self.action_repetition = action_repetition
+        self.condition = condition
+        self.sent_observation = None
+
+    def reset_states(self):
+        self.sent_observation = None
+
+    def hold(self, action):
+        return Decision(action, nb_substeps=self.action_repetition)
+
+    def decide(self, agent, observation, episode_step):
+        if episode_step == 0:
+            action_candidate = agent.forward(observation)
+            decision = self.hold(np.array([action_candidate[0]]))
+            decision.held = None if self.condition is None else _with_heads(action_candidate, True)
+            decision.observation = observation
+            return decision
+
+        epsilon = agent.epsilon if self.epsilon is None else self.epsilon
+        explore = False
+        if np.random.rand() < epsilon:
+            if np.random.binomial(2, 0.5, 1)[0] == 1:
+                explore = True
+        # If communication is not needed, the previously transmitted input is held.
+        held = agent.recent_action
+        decision = self.hold(np.array([held[0]]))
+        decision.communicated = False
+        decision.observation = observation
+
+        if self.condition is not None:
+            fire = explore or self.time_mode or self.condition(
+                np.array(observation, dtype=np.float64)[None], self.sent_observation[None])[0]
+            if not fire:
+                # Skip the actor, the held action is what the agent applies here.
+                agent.recent_observation = observation
+                decision.held = _with_heads(held, False)
+                return decision
+
+        action_candidate = agent.forward(observation)
+        if self.condition is not None or action_candidate[1] > action_candidate[2] or explore or self.time_mode:
+            held = action_candidate if self.condition is None else _with_heads(action_candidate, True)
+            decision.action = np.array([action_candidate[0]])
+            decision.communicated = True
+        decision.held = held
+        return decision
+
+    def commit(self, agent, decision, episode_step):
+        if decision.communicated:
+            # Also after the safety filter forced a transmission.
+            self.sent_observation = np.array(decision.observation, dtype=np.float64)
+        if decision.held is None:
+            return
+        decision.held[0] = decision.action[0]
+        agent.recent_action = decision.held
+
+
+class RewardShaper(object):
+    """Turns the plant's running reward into the reward of one decision.
+
+    `shape_substep` is applied to every sub-step reward, `shape_interval` to the sum over the
+    interval (already multiplied by `dt` for timed decisions).
+    """
+    def shape_substep(self, reward, decision):
+        return reward
+
+    def shape_interval(self, reward, decision):
+        return reward
+
+
+class IntervalPenalty(RewardShaper):
+    """Subtracts a constant `l` per decision, i.e. `r = int(r dt) - l`."""
+    def __init__(self, l=1.):
+        self.l = l
+
+    def shape_interval(self, reward, decision):
+        return reward - self.l
+
+
+class TauReward(RewardShaper):
+    """Rewards long intervals, i.e. `r = int(r dt) + l * tau`."""
+    def __init__(self, l=1.):
+        self.l = l
+
+    def shape_interval(self, reward, decision):
+        return reward + self.l * decision.tau
+
+
+class InputEnergyPenalty(RewardShaper):
+    """Penalizes the input energy over the interval, i.e. `r = int(r dt) - coef * tau * u^2`."""
+    def __init__(self, coef=.01):
+        self.coef = coef
+
+    def shape_interval(self, reward, decision):
+        return reward - self.coef * decision.tau * decision.action[0]**2
+
+
+class CommunicationPenalty(RewardShaper):
+    """Subtracts `lam` on every sub-step of a decision that transmitted a new input."""
+    def __init__(self, lam=1.):
+        self.lam = lam
+
+    def shape_substep(self, reward, decision):
+        gama = 1 if decision.communicated else 0
+        return reward - self.lam * gama
+
+
+class BarrierPenalty(RewardShaper):
+    """Subtracts `coef` on every sub-step of a decision that was corrected by the safety filter."""
+    def __init__(self, coef=.1):
+        self.coef = coef
+
+    def shape_substep(self, reward, decision):
+        barrier = -1 if decision.filtered else 0
+        return reward + self.coef * barrier
+
+
+class CBFSafetyFilter(object):
+    """Projects the input onto the set allowed by the control barrier function in
+    `rl2.barrier_certificate`.
+
+    # Arguments
+        clipper (float): Input bound. Defaults to `env.action_space.high`.
+        pure (boolean): If `True`, use `u_cbf_pure`, which does not force the input near the
+            boundary of the safe set.
+        use_env_state (boolean): If `True`, evaluate the barrier at `env.state` instead of the
+            observation.
+        log (boolean): If `True`, record `(h(x), active)` for every decision in `self.history`.
+    """
+    def __init__(self, clipper=None, pure=False, use_env_state=False, log=False):
+        self.clipper = clipper
+        self.pure = pure
+        self.use_env_state = use_env_state
+        self.log = log
+        self.history = []
+
+    def apply(self, env, observation, action):
+        """Returns the filtered input and whether the filter changed it."""
+        clipper = env.action_space.high if self.clipper is None else self.clipper
+        x = env.state if self.use_env_state else observation
+        if self.pure:
+            filtered = bc.u_cbf_pure(x, action[0], clipper)
+        else:
+            filtered = bc.u_cbf(x, action[0], clipper)
+        # Like the original `safecore` loop: a candidate beyond the input bound counts as corrected.
+        active = bool(np.any(action != filtered))
+        if self.log:
+            self.history.append([bc.h(x), int(active)])
+        return filtered, active
+
+    def apply_batch(self, states, actions, clipper):
+        """Filters `(N,)` candidate inputs for `(N, 2)` states at once.
+
+        # Returns
+            Tuple `(filtered, active)` of arrays of shape `(N,)`.
+        """
+        clipper = clipper if self.clipper is None else self.clipper
+        filtered, active, hx = bc.u_cbf_batch(states, actions, clipper, pure=self.pure)
+        if self.log:
+            self.history.extend(np.stack([hx, active.astype(int)], axis=1).tolist())
+        return filtered, active
+
+
+class RolloutEngine(object):
+    """Training loop shared by all agents in `selfcore`, `eventcore` and `safecore`.
+
+    One decision is taken per step: the trigger policy queries the agent, the optional safety
+    filter corrects the input, the environment is integrated over the interval and the reward
+    shaper turns the running reward into the reward passed to `agent.backward`.
+
+    # Arguments
+        trigger (`TriggerPolicy` instance): Decides when and for how long inputs are applied.
+        shaper (`RewardShaper` instance): Reward of one decision. Defaults to the plain sum.
+        safety_filter (`CBFSafetyFilter` instance): Optional input correction.
+        exact_intervals (boolean): For timed decisions on envs with `step_interval` (e.g.
+            `LinearEnv`), integrate each interval in one call instead of `nb_substeps` steps.
+    """
+    def __init__(self, trigger, shaper=None, safety_filter=None, exact_intervals=False):
+        self.trigger = trigger
+        self.shaper = RewardShaper() if shaper is None else shaper
+        self.safety_filter = safety_filter
+        self.exact_intervals = exact_intervals
+
+    def _env_step(self, env, decision):
+        if decision.timed:
+            return env.step(decision.action, decision.dt, decision.tau)
+        return env.step(decision.action)
+
+    def _reset(self, agent, env, callbacks, copy_observation, nb_max_start_steps, start_step_policy):
+        observation = copy_observation(env.reset())
+        if agent.processor is not None:
+            observation = agent.processor.process_observation(observation)
+        assert observation is not None
+
+        # Perform random starts at beginning of episode and do not record them into the experience.
+        # This slightly changes the start position between games.
+        nb_random_start_steps = 0 if nb_max_start_steps == 0 else np.random.randint(nb_max_start_steps)
+        for _ in range(nb_random_start_steps):
+            if start_step_policy is None:
+                action = env.action_space.sample()
+            else:
+                action = start_step_policy(observation)
+            if agent.processor is not None:
+                action = agent.processor.process_action(action)
+            callbacks.on_action_begin(action)
+            observation, reward, done, info = self._env_step(env, self.trigger.hold(action))
+            observation = copy_observation(observation)
+            if agent.processor is not None:
+                observation, reward, done, info = agent.processor.process_step(observation, reward, done, info)
+            callbacks.on_action_end(action)
+            if done:
+                warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
+                observation = copy_observation(env.reset())
+                if agent.processor is not None:
+                    observation = agent.processor.process_observation(observation)
+                break
+        return observation
+
+    def fit(self, agent, env, nb_steps, callbacks=None, verbose=1, visualize=False,
+            nb_max_start_steps=0, start_step_policy=None, log_interval=10000,
+            nb_max_episode_steps=None, episode_time=None):
+        """Trains `agent` on the given environment.
+
+        See `self_Agent.fit` for the common arguments. In addition:
+
+        # Arguments
+            nb_max_episode_steps (integer): Number of decisions after which an episode is forced
+                to end. `None` for no limit.
+            episode_time (float): Accumulated interval length after which an episode is forced
+                to end. `None` for no limit.
+
+        # Returns
+            A `keras.callbacks.History` instance that recorded the entire training process.
+        """
+        if not agent.compiled:
+            raise RuntimeError('Your tried to fit your agent but it hasn\'t been compiled yet. Please call `compile()` before `fit()`.')
+
+        agent.training = True
+        copy_observation = ObservationCopier(env, check=getattr(agent, 'check_observations', False))
+
+        callbacks = [] if not callbacks else callbacks[:]
+
+        if verbose == 1:
+            callbacks += [TrainIntervalLogger(interval=log_interval)]
+        elif verbose > 1:
+            callbacks += [TrainEpisodeLogger()]
+        if visualize:
+            callbacks += [Visualizer()]
+        history = History()
+        callbacks += [history]
+        callbacks = CallbackList(callbacks)
+        if hasattr(callbacks, 'set_model'):
+            callbacks.set_model(agent)
+        else:
+            callbacks._set_model(agent)
+        callbacks._set_env(env)
+        params = {
+            'nb_steps': nb_steps,
+        }
+        if hasattr(callbacks, 'set_params'):
+            callbacks.set_params(params)
+        else:
+            callbacks._set_params(params)
+        agent._on_train_begin()
+        previous_timer = agent.__dict__.get('timer')
+        callbacks.on_train_begin()
+        timer = agent.timer
+
+        episode = 0
+        agent.step = 0
+        observation = None
+        episode_reward = None
+        episode_step = None
+        did_abort = False
+        try:
+            while agent.step < nb_steps:
+                if observation is None:  # start of a new episode
+                    callbacks.on_episode_begin(episode)
+                    episode_step = 0
+                    episode_reward = np.float32(0)
+                    episode_time_elapsed = 0.
+                    episode_barrier = 0
+
+                    # Obtain the initial observation by resetting the environment.
+                    agent.reset_states()
+                    self.trigger.reset_states()
+                    observation = self._reset(agent, env, callbacks, copy_observation, nb_max_start_steps, start_step_policy)
+
+                # At this point, we expect to be fully initialized.
+                assert episode_reward is not None
+                assert episode_step is not None
+                assert observation is not None
+
+                # Run a single step.
+                callbacks.on_step_begin(episode_step, {'observation': observation})
+                # This is were all of the work happens. We first perceive and compute the action
+                # (forward step) and then use the reward to improve (backward step).
+                start = timer.start()
+                decision = self.trigger.decide(agent, observation, episode_step)
+                timer.stop('forward', start)
+                if self.safety_filter is not None:
+                    decision.action, decision.filtered = self.safety_filter.apply(env, observation, decision.action)
+                    if decision.filtered:
+                        # A corrected input always has to be transmitted.
+                        decision.communicated = True
+                        episode_barrier += 1
+                self.trigger.commit(agent, decision, episode_step)
+
+                if agent.processor is not None:
+                    decision.action = agent.processor.process_action(decision.action)
+                action = decision.action
+                reward = np.float32(0)
+                accumulated_info = {}
+                done = False
+                exact = self.exact_intervals and decision.timed and hasattr(env, 'step_interval')
+                start = timer.start()
+                for _ in range(1 if exact else decision.nb_substeps):
+                    callbacks.on_action_begin(action)
+                    if exact:
+                        observation, r, done, info = env.step_interval(decision.action, decision.tau)
+                    else:
+                        observation, r, done, info = self._env_step(env, decision)
+                    observation = copy_observation(observation)
+                    if agent.processor is not None:
+                        observation, r, done, info = agent.processor.process_step(observation, r, done, info)
+                    for key, value in info.items():
+                        if not np.isreal(value):
+                            continue
+                        if key not in accumulated_info:
+                            accumulated_info[key] = np.zeros_like(value)
+                        accumulated_info[key] += value
+                    callbacks.on_action_end(action)
+                    if exact:
+                        # `r` already is the integral, substep shaping is constant over the interval.
+                        reward += r + self.shaper.shape_substep(0., decision) * decision.tau
+                    else:
+                        reward += self.shaper.shape_substep(r, decision)
+                    if done:
+                        break
+                timer.stop('env', start)
+                if decision.timed:
+                    if not exact:
+                        reward *= decision.dt  # make sum to integral
+                    episode_time_elapsed += decision.tau
+                reward = self.shaper.shape_interval(reward, decision)
+                if episode_time is not None and episode_time_elapsed > episode_time:
+                    # Force a terminal state.
+                    done = True
+                if nb_max_episode_steps and episode_step >= nb_max_episode_steps - 1:
+                    # Force a terminal state.
+                    done = True
+                start = timer.start()
+                metrics = agent.backward(reward, terminal=done)
+                timer.stop('backward', start)
+                episode_reward += reward
+
+                step_logs = {
+                    'action': action,
+                    'observation': observation,
+                    'reward': reward,
+                    'metrics': metrics,
+                    'episode': episode,
+                    'info': accumulated_info,
+                    'decision': decision,
+                }
+                callbacks.on_step_end(episode_step, step_logs)
+                episode_step += 1
+                agent.step += 1
+
+                if done:
+                    # We are in a terminal state but the agent hasn't yet seen it. We therefore
+                    # perform one more forward-backward call and simply ignore the action before
+                    # resetting the environment. We need to pass in `terminal=False` here since
+                    # the *next* state, that is the state of the newly reset environment, is
+                    # always non-terminal by convention.
+                    start = timer.start()
+                    agent.forward(observation)
+                    timer.stop('forward', start)
+                    start = timer.start()
+                    agent.backward(0., terminal=False)
+                    timer.stop('backward', start)
+
+                    # This episode is finished, report and reset.
+                    episode_logs = {
+                        'episode_reward': episode_reward,
+                        'nb_episode_steps': episode_step,
+                        'nb_steps': agent.step,
+                    }
+                    if decision.timed:
+                        episode_logs['episode_average_tau'] = episode_time_elapsed / episode_step
+                    if self.safety_filter is not None:
+                        episode_logs['episode_barrier'] = episode_barrier
+                    callbacks.on_episode_end(episode, episode_logs)
+
+                    episode += 1
+                    observation = None
+                    episode_step = None
+                    episode_reward = None
+        except KeyboardInterrupt:
+            # We catch keyboard interrupts here so that training can be be safely aborted.
+            # This is so common that we've built this right into this function, which ensures that
+            # the `on_train_end` method is properly called.
+            did_abort = True
+        finally:
+            # A timer enabled by a callback (e.g. `PhaseProfiler`) ends with the run, also if the
+            # loop raises and `on_train_end` is skipped.
+            reset_timer(agent, previous_timer)
+        callbacks.on_train_end(logs={'did_abort': did_abort})
+        agent._on_train_end()
+
+        return history
+
+
+class StateMemoryRecorder(Callback):
+    """Records `env.state` at every decision into `agent.state_memory`, one array per episode.
+
+    The unfinished episode is only kept if training was aborted.
+
+    # Arguments
+        before_step (boolean): If `True`, record the state before each decision, starting with
+            the initial state (as the event agents always did). Otherwise record it after each
+            decision (as the self-triggered agents did).
+    """
+    def __init__(self, before_step=False):
+        super(StateMemoryRecorder, self).__init__()
+        self.before_step = before_step
+
+    def on_train_begin(self, logs={}):
+        self.model.state_memory = []
+        self.episode_memory = []
+
+    def on_step_begin(self, step, logs={}):
+        if self.before_step:
+            self.episode_memory.append(np.array(self.env.state))
+
+    def on_step_end(self, step, logs={}):
+        if not self.before_step:
+            self.episode_memory.append(np.array(self.env.state))
+
+    def on_episode_end(self, episode, logs={}):
+        self.model.state_memory.append(np.array(self.episode_memory))
+        self.episode_memory = []
+
+    def on_train_end(self, logs={}):
+        if logs.get('did_abort'):
+            self.model.state_memory.append(np.array(self.episode_memory))
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import warnings
-from copy import deepcopy
 
 import numpy as np
 from keras2.callbacks import History
@@ -8,11 +7,18 @@ import rl2.barrier_certificate as bc
 
 from rl2.callbacks import (
     CallbackList,
+    PhaseTimer,
     TestLogger,
-    TrainEpisodeLogger,
-    TrainIntervalLogger,
     Visualizer
 )
+from rl2.core import ObservationCopier
+from rl2.prefetch import stop_prefetching
+from rl2.rollout import (
+    BarrierPenalty,
+    CBFSafetyFilter,
+    PeriodicTrigger,
+    RolloutEngine
+)
 
 
 class Agent(object):
@@ -37,9 +43,15 @@ class Agent(object):
 
     # Arguments
         processor (`Processor` instance): See [Processor](#processor) for details.
+        check_observations (boolean): If `True`, verify that environments declaring
+            `fresh_observations` never reuse their observation arrays. See `ObservationCopier`.
     """
-    def __init__(self, processor=None):
+    # Timer hooks of `fit` and `backward`, enabled by `rl2.callbacks.PhaseProfiler`.
+    timer = PhaseTimer()
+
+    def __init__(self, processor=None, check_observations=False):
         self.processor = processor
+        self.check_observations = check_observations
         self.training = False
         self.step = 0
 
@@ -87,165 +99,11 @@ class Agent(object):
         if action_repetition < 1:
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
-        self.training = True
-
-        callbacks = [] if not callbacks else callbacks[:]
-
-        if verbose == 1:
-            callbacks += [TrainIntervalLogger(interval=log_interval)]
-        elif verbose > 1:
-            callbacks += [TrainEpisodeLogger()]
-        if visualize:
-            callbacks += [Visualizer()]
-        history = History()
-        callbacks += [history]
-        callbacks = CallbackList(callbacks)
-        if hasattr(callbacks, 'set_model'):
-            callbacks.set_model(self)
-        else:
-            callbacks._set_model(self)
-        callbacks._set_env(env)
-        params = {
-            'nb_steps': nb_steps,
-        }
-        if hasattr(callbacks, 'set_params'):
-            callbacks.set_params(params)
-        else:
-            callbacks._set_params(params)
-        self._on_train_begin()
-        callbacks.on_train_begin()
-
-        episode = np.int16(0)
-        self.step = np.int16(0)
-        observation = None
-        episode_reward = None
-        episode_step = None
-        did_abort = False
-        try:
-            while self.step < nb_steps:
-                if observation is None:  # start of a new episode
-                    episode_barrier = 0
-                    callbacks.on_episode_begin(episode)
-                    episode_step = np.int16(0)
-                    episode_reward = np.float32(0)
-
-                    # Obtain the initial observation by resetting the environment.
-                    self.reset_states()
-                    observation = deepcopy(env.reset())
-                    if self.processor is not None:
-                        observation = self.processor.process_observation(observation)
-                    assert observation is not None
-
-                    # Perform random starts at beginning of episode and do not record them into the experience.
-                    # This slightly changes the start position between games.
-                    nb_random_start_steps = 0 if nb_max_start_steps == 0 else np.random.randint(nb_max_start_steps)
-                    for _ in range(nb_random_start_steps):
-                        if start_step_policy is None:
-                            action = env.action_space.sample()
-                        else:
-                            action = start_step_policy(observation)
-                        if self.processor is not None:
-                            action = self.processor.process_action(action)
-                        callbacks.on_action_begin(action)
-                        observation, reward, done, info = env.step(action)
-                        observation = deepcopy(observation)
-                        if self.processor is not None:
-                            observation, reward, done, info = self.processor.process_step(observation, reward, done, info)
-                        callbacks.on_action_end(action)
-                        if done:
-                            warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                            observation = deepcopy(env.reset())
-                            if self.processor is not None:
-                                observation = self.processor.process_observation(observation)
-                            break
-
-                # At this point, we expect to be fully initialized.
-                assert episode_reward is not None
-                assert episode_step is not None
-                assert observation is not None
-
-                # Run a single step.
-                callbacks.on_step_begin(episode_step)
-                # This is were all of the work happens. We first perceive and compute the action
-                # (forward step) and then use the reward to improve (backward step).
-                action_candidate = self.forward(observation)
-
-                action = bc.u_cbf(observation, action_candidate[0])
-                barrier = 0 if action == action_candidate else -1
-
-
-                if self.processor is not None:
-                    action = self.processor.process_action(action)
-                reward = np.float32(0)
-                accumulated_info = {}
-                done = False
-                for _ in range(action_repetition):
-                    callbacks.on_action_begin(action)
-                    observation, r, done, info = env.step(action)
-                    observation = deepcopy(observation)
-                    if self.processor is not None:
-                        observation, r, done, info = self.processor.process_step(observation, r, done, info)
-                    for key, value in info.items():
-                        if not np.isreal(value):
-                            continue
-                        if key not in accumulated_info:
-                            accumulated_info[key] = np.zeros_like(value)
-                        accumulated_info[key] += value
-                    callbacks.on_action_end(action)
-                    r += 0.1 * barrier
-                    reward += r
-                    if done:
-                        break
-                if nb_max_episode_steps and episode_step >= nb_max_episode_steps - 1:
-                    # Force a terminal state.
-                    done = True
-                metrics = self.backward(reward, terminal=done)
-                episode_reward += reward
-                episode_barrier += -barrier
-
-                step_logs = {
-                    'action': action,
-                    'observation': observation,
-                    'reward': reward,
-                    'metrics': metrics,
-                    'episode': episode,
-                    'info': accumulated_info,
-                }
-                callbacks.on_step_end(episode_step, step_logs)
-                episode_step += 1
-                self.step += 1
-
-                if done:
-                    # We are in a terminal state but the agent hasn't yet seen it. We therefore
-                    # perform one more forward-backward call and simply ignore the action before
-                    # resetting the environment. We need to pass in `terminal=False` here since
-                    # the *next* state, that is the state of the newly reset environment, is
-                    # always non-terminal by convention.
-                    self.forward(observation)
-                    self.backward(0., terminal=False)
-
-                    # This episode is finished, report and reset.
-                    episode_logs = {
-                        'episode_reward': episode_reward,
-                        'nb_episode_steps': episode_step,
-                        'nb_steps': self.step,
-                        'episode_barrier': episode_barrier,
-                    }
-                    callbacks.on_episode_end(episode, episode_logs)
-
-                    episode += 1
-                    observation = None
-                    episode_step = None
-                    episode_reward = None
-        except KeyboardInterrupt:
-            # We catch keyboard interrupts here so that training can be be safely aborted.
-            # This is so common that we've built this right into this function, which ensures that
-            # the `on_train_end` method is properly called.
-            did_abort = True
-        callbacks.on_train_end(logs={'did_abort': did_abort})
-        self._on_train_end()
-
-        return history
+        engine = RolloutEngine(PeriodicTrigger(action_repetition=action_repetition), shaper=BarrierPenalty(.1),
+                               safety_filter=CBFSafetyFilter(clipper=10.))
+        return engine.fit(self, env, nb_steps, callbacks=callbacks, verbose=verbose, visualize=visualize,
+                          nb_max_start_steps=nb_max_start_steps, start_step_policy=start_step_policy,
+                          log_interval=log_interval, nb_max_episode_steps=nb_max_episode_steps)
 
     def test(self, env, nb_episodes=1, action_repetition=1, callbacks=None, visualize=True,
              nb_max_episode_steps=None, nb_max_start_steps=0, start_step_policy=None, verbose=1):
@@ -283,6 +141,7 @@ class Agent(object):
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
         self.training = False
+        copy_observation = ObservationCopier(env, check=self.check_observations)
         self.step = 0
         self.data_log = np.zeros((nb_episodes, action_repetition * nb_max_episode_steps, 4))
         his = []
@@ -318,7 +177,7 @@ class Agent(object):
 
             # Obtain the initial observation by resetting the environment.
             self.reset_states()
-            observation = deepcopy(env.reset())
+            observation = copy_observation(env.reset())
             if self.processor is not None:
                 observation = self.processor.process_observation(observation)
             assert observation is not None
@@ -335,13 +194,13 @@ class Agent(object):
                     action = self.processor.process_action(action)
                 callbacks.on_action_begin(action)
                 observation, r, done, info = env.step(action)
-                observation = deepcopy(observation)
+                observation = copy_observation(observation)
                 if self.processor is not None:
                     observation, r, done, info = self.processor.process_step(observation, r, done, info)
                 callbacks.on_action_end(action)
                 if done:
                     warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                    observation = deepcopy(env.reset())
+                    observation = copy_observation(env.reset())
                     if self.processor is not None:
                         observation = self.processor.process_observation(observation)
                     break
@@ -363,7 +222,7 @@ class Agent(object):
                 for _ in range(action_repetition):
                     callbacks.on_action_begin(action)
                     observation, r, d, info = env.step(action)
-                    observation = deepcopy(observation)
+                    observation = copy_observation(observation)
                     if self.processor is not None:
                         observation, r, d, info = self.processor.process_step(observation, r, d, info)
                     callbacks.on_action_end(action)
@@ -504,7 +363,7 @@ class Agent(object):
     def _on_train_end(self):
         """Callback that is called after training ends."
         """
-        pass
+        stop_prefetching(self)
 
     def _on_test_begin(self):
         """Callback that is called before testing begins."
@@ -644,6 +503,8 @@ class Env(object):
     reward_range = (-np.inf, np.inf)
     action_space = None
     observation_space = None
+    # Set to `True` if `step` and `reset` always return a newly allocated observation.
+    fresh_observations = False
 
     def step(self, action):
         """Run one timestep of the environment's dynamics.
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import warnings
-from copy import deepcopy
 
 import numpy as np
 from keras2.callbacks import History
@@ -8,12 +7,45 @@ from keras2.callbacks import History
 import rl2.barrier_certificate as bc
 
 from rl2.callbacks import (
+    Callback,
     CallbackList,
+    PhaseTimer,
     TestLogger,
-    TrainEpisodeLogger,
-    TrainIntervalLogger,
     Visualizer
 )
+from rl2.core import ObservationCopier
+from rl2.prefetch import stop_prefetching
+from rl2.rollout import (
+    CBFSafetyFilter,
+    InputEnergyPenalty,
+    IntervalPenalty,
+    PeriodicTrigger,
+    RolloutEngine,
+    SelfTrigger,
+    StateMemoryRecorder,
+    TauReward
+)
+
+
+class _SelfTriggerLogger(Callback):
+    """Keeps `critic_loss_log` of `self_Agent` and prints its optional step and episode logs."""
+    def __init__(self, step_log=False, original_log=False):
+        self.step_log = step_log
+        self.original_log = original_log
+
+    def on_step_end(self, step, logs={}):
+        self.model.critic_loss_log.append(logs['metrics'][0])
+        self.tau = logs['decision'].tau
+        if self.step_log:
+            print('\r' + f'{self.model.step}: tau = {logs["decision"].tau}, state = {self.env.state}', end='')
+
+    def on_episode_end(self, episode, logs={}):
+        if self.original_log:
+            print()
+            # As before the shared rollout loop: the printed `average_tau` is the last `tau`.
+            print(f'episode_end, average_tau = {self.tau}, explosion = False')
+            print()
+
 
 class self_Agent(object):
     """Abstract base class for all implemented agents.
@@ -37,9 +69,15 @@ class self_Agent(object):
 
     # Arguments
         processor (`Processor` instance): See [Processor](#processor) for details.
+        check_observations (boolean): If `True`, verify that environments declaring
+            `fresh_observations` never reuse their observation arrays. See `ObservationCopier`.
     """
-    def __init__(self, processor=None):
+    # Timer hooks of `fit` and `backward`, enabled by `rl2.callbacks.PhaseProfiler`.
+    timer = PhaseTimer()
+
+    def __init__(self, processor=None, check_observations=False):
         self.processor = processor
+        self.check_observations = check_observations
         self.training = False
         self.step = 0
 
@@ -53,7 +91,7 @@ class self_Agent(object):
 
     def fit(self, env, nb_steps, action_repetition=1, callbacks=None, verbose=1,
             visualize=False, step_log=False, original_log=False, nb_max_start_steps=0, start_step_policy=None, log_interval=10000,
-            nb_max_episode_steps=None, l=1, episode_time=20.):
+            nb_max_episode_steps=None, l=1, episode_time=20., exact_intervals=False):
         """Trains the agent on the given environment.
 
         # Arguments
@@ -78,6 +116,8 @@ class self_Agent(object):
             nb_max_episode_steps (integer): Number of steps per episode that the agent performs before
                 automatically resetting the environment. Set to `None` if each episode should run
                 (potentially indefinitely) until the environment signals a terminal state.
+            exact_intervals (boolean): If `True` and `env` has `step_interval` (e.g. `LinearEnv`),
+                every interval is integrated in one call instead of in fixed Euler substeps.
 
         # Returns
             A `keras.callbacks.History` instance that recorded the entire training process.
@@ -87,193 +127,15 @@ class self_Agent(object):
         if action_repetition < 1:
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
-        self.training = True
-
-        self.state_memory = []
-        episode_memory = []
-        self.params_log = []
-
-        self.critic_loss_log = []
-        
-        # original parameters
-        accumulated_time = 0
-
-        callbacks = [] if not callbacks else callbacks[:]
-
-        if verbose == 1:
-            callbacks += [TrainIntervalLogger(interval=log_interval)]
-        elif verbose > 1:
-            callbacks += [TrainEpisodeLogger()]
-        if visualize:
-            callbacks += [Visualizer()]
-        history = History()
-        callbacks += [history]
-        callbacks = CallbackList(callbacks)
-        if hasattr(callbacks, 'set_model'):
-            callbacks.set_model(self)
-        else:
-            callbacks._set_model(self)
-        callbacks._set_env(env)
-        params = {
-            'nb_steps': nb_steps,
-        }
-        if hasattr(callbacks, 'set_params'):
-            callbacks.set_params(params)
-        else:
-            callbacks._set_params(params)
-        self._on_train_begin()
-        callbacks.on_train_begin()
-
-        episode = np.int16(0)
-        self.step = np.int16(0)
-        observation = None
-        episode_reward = None
-        episode_step = None
-        did_abort = False
-        try:
-            while self.step < nb_steps:
-                if observation is None:  # start of a new episode
-                    explosion = False
-                    callbacks.on_episode_begin(episode)
-                    episode_step = np.int16(0)
-                    episode_reward = np.float32(0)
-
-                    # Obtain the initial observation by resetting the environment.
-                    self.reset_states()
-                    observation = deepcopy(env.reset())
-                    if self.processor is not None:
-                        observation = self.processor.process_observation(observation)
-                    assert observation is not None
-
-                    # Perform random starts at beginning of episode and do not record them into the experience.
-                    # This slightly changes the start position between games.
-                    nb_random_start_steps = 0 if nb_max_start_steps == 0 else np.random.randint(nb_max_start_steps)
-                    for _ in range(nb_random_start_steps):
-                        if start_step_policy is None:
-                            action = env.action_space.sample()
-                        else:
-                            action = start_step_policy(observation)
-                        if self.processor is not None:
-                            action = self.processor.process_action(action)
-                        callbacks.on_action_begin(action)
-                        observation, reward, done, info = env.step(action, 1)  # dont care dt
-                        observation = deepcopy(observation)
-                        if self.processor is not None:
-                            observation, reward, done, info = self.processor.process_step(observation, reward, done, info)
-                        callbacks.on_action_end(action)
-                        if done:
-                            warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                            observation = deepcopy(env.reset())
-                            if self.processor is not None:
-                                observation = self.processor.process_observation(observation)
-                            break
-
-                # At this point, we expect to be fully initialized.
-                assert episode_reward is not None
-                assert episode_step is not None
-                assert observation is not None
-
-                # Run a single step.
-                callbacks.on_step_begin(episode_step)
-                # This is were all of the work happens. We first perceive and compute the action
-                # (forward step) and then use the reward to improve (backward step).
-                action_tau = self.forward(observation)
-                action = action_tau if action_tau.shape[0] == 1 else np.array([action_tau[0]])
-
-                tau = action_tau[1]
-                action_repetition = int(np.ceil(20 * tau))  # minimum natural number which makes `dt` smaller than 0.05
-                dt = tau / action_repetition
-
-                if self.processor is not None:
-                    action = self.processor.process_action(action)
-                reward = np.float32(0)
-                accumulated_info = {}
-                done = False
-                for _ in range(action_repetition):
-                    callbacks.on_action_begin(action)
-                    observation, r, done, info = env.step(action, dt, tau)
-                    observation = deepcopy(observation)
-                    if self.processor is not None:
-                        observation, r, done, info = self.processor.process_step(observation, r, done, info)
-                    for key, value in info.items():
-                        if not np.isreal(value):
-                            continue
-                        if key not in accumulated_info:
-                            accumulated_info[key] = np.zeros_like(value)
-                        accumulated_info[key] += value
-                    callbacks.on_action_end(action)
-                    reward += r
-                    if done:
-                        break
-                reward *= dt  # make sum to integral
-                reward -= l # add tau reward
-                accumulated_time += tau
-                if step_log:
-                    print('\r' + f'{self.step}: tau = {tau}, state = {env.state}', end='')
-                if accumulated_time > episode_time:
-                    # Force a terminal state.
-                    done = True
-                metrics = self.backward(reward, terminal=done)
-                self.critic_loss_log.append(metrics[0])
-                episode_reward += reward
-
-                step_logs = {
-                    'action': action,
-                    'observation': observation,
-                    'reward': reward,
-                    'metrics': metrics,
-                    'episode': episode,
-                    'info': accumulated_info,
-                }
-                callbacks.on_step_end(episode_step, step_logs)
-                episode_memory.append(env.state)
-                episode_step += 1
-                self.step += 1
-
-                if done:
-                    # We are in a terminal state but the agent hasn't yet seen it. We therefore
-                    # perform one more forward-backward call and simply ignore the action before
-                    # resetting the environment. We need to pass in `terminal=False` here since
-                    # the *next* state, that is the state of the newly reset environment, is
-                    # always non-terminal by convention.
-                    self.forward(observation)
-                    self.backward(0., terminal=False)
-                    if original_log:
-                        print()
-                        print(f'episode_end, average_tau = {tau}, explosion = {explosion}')
-                        print()
-
-                    # This episode is finished, report and reset.
-                    episode_logs = {
-                        'episode_average_tau': accumulated_time/episode_step,
-                        'episode_reward': episode_reward,
-                        'nb_episode_steps': episode_step,
-                        'nb_steps': self.step,
-                    }
-                    callbacks.on_episode_end(episode, episode_logs)
-
-                    episode += 1
-                    self.state_memory.append(np.array(episode_memory))
-                    episode_memory = []
-                    observation = None
-                    episode_step = None
-                    episode_reward = None
-                    accumulated_time = 0
-        except KeyboardInterrupt:
-            # We catch keyboard interrupts here so that training can be be safely aborted.
-            # This is so common that we've built this right into this function, which ensures that
-            # the `on_train_end` method is properly called.
-            did_abort = True
-            self.state_memory.append(np.array(episode_memory))
-        callbacks.on_train_end(logs={'did_abort': did_abort})
-        self.params_log = np.array(self.params_log)
-        self._on_train_end()
-
-        return history
+        return self._fit(env, nb_steps, IntervalPenalty(l), callbacks=callbacks, verbose=verbose,
+                         visualize=visualize, step_log=step_log, original_log=original_log,
+                         nb_max_start_steps=nb_max_start_steps, start_step_policy=start_step_policy,
+                         log_interval=log_interval, episode_time=episode_time,
+                         exact_intervals=exact_intervals)
     
     def fit2(self, env, nb_steps, action_repetition=1, callbacks=None, verbose=1,
             visualize=False, step_log=False, original_log=False, nb_max_start_steps=0, start_step_policy=None, log_interval=10000,
-            nb_max_episode_steps=None, l=1, episode_time=20.):
+            nb_max_episode_steps=None, l=1, episode_time=20., exact_intervals=False):
         """Trains the agent on the given environment.
 
         # Arguments
@@ -298,6 +160,8 @@ class self_Agent(object):
             nb_max_episode_steps (integer): Number of steps per episode that the agent performs before
                 automatically resetting the environment. Set to `None` if each episode should run
                 (potentially indefinitely) until the environment signals a terminal state.
+            exact_intervals (boolean): If `True` and `env` has `step_interval` (e.g. `LinearEnv`),
+                every interval is integrated in one call instead of in fixed Euler substeps.
 
         # Returns
             A `keras.callbacks.History` instance that recorded the entire training process.
@@ -307,187 +171,27 @@ class self_Agent(object):
         if action_repetition < 1:
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
-        self.training = True
+        return self._fit(env, nb_steps, TauReward(l), callbacks=callbacks, verbose=verbose,
+                         visualize=visualize, step_log=step_log, original_log=original_log,
+                         nb_max_start_steps=nb_max_start_steps, start_step_policy=start_step_policy,
+                         log_interval=log_interval, episode_time=episode_time,
+                         exact_intervals=exact_intervals)
 
-        self.state_memory = []
-        episode_memory = []
+    def _fit(self, env, nb_steps, shaper, callbacks=None, verbose=1, visualize=False, step_log=False,
+             original_log=False, nb_max_start_steps=0, start_step_policy=None, log_interval=10000,
+             episode_time=20., exact_intervals=False):
+        """Self-triggered training loop shared by `fit` and `fit2`, which only differ in `shaper`.
+        """
         self.params_log = []
-
         self.critic_loss_log = []
-        
-        # original parameters
-        accumulated_time = 0
 
         callbacks = [] if not callbacks else callbacks[:]
-
-        if verbose == 1:
-            callbacks += [TrainIntervalLogger(interval=log_interval)]
-        elif verbose > 1:
-            callbacks += [TrainEpisodeLogger()]
-        if visualize:
-            callbacks += [Visualizer()]
-        history = History()
-        callbacks += [history]
-        callbacks = CallbackList(callbacks)
-        if hasattr(callbacks, 'set_model'):
-            callbacks.set_model(self)
-        else:
-            callbacks._set_model(self)
-        callbacks._set_env(env)
-        params = {
-            'nb_steps': nb_steps,
-        }
-        if hasattr(callbacks, 'set_params'):
-            callbacks.set_params(params)
-        else:
-            callbacks._set_params(params)
-        self._on_train_begin()
-        callbacks.on_train_begin()
-
-        episode = np.int16(0)
-        self.step = np.int16(0)
-        observation = None
-        episode_reward = None
-        episode_step = None
-        did_abort = False
-        try:
-            while self.step < nb_steps:
-                if observation is None:  # start of a new episode
-                    explosion = False
-                    callbacks.on_episode_begin(episode)
-                    episode_step = np.int16(0)
-                    episode_reward = np.float32(0)
-
-                    # Obtain the initial observation by resetting the environment.
-                    self.reset_states()
-                    observation = deepcopy(env.reset())
-                    if self.processor is not None:
-                        observation = self.processor.process_observation(observation)
-                    assert observation is not None
-
-                    # Perform random starts at beginning of episode and do not record them into the experience.
-                    # This slightly changes the start position between games.
-                    nb_random_start_steps = 0 if nb_max_start_steps == 0 else np.random.randint(nb_max_start_steps)
-                    for _ in range(nb_random_start_steps):
-                        if start_step_policy is None:
-                            action = env.action_space.sample()
-                        else:
-                            action = start_step_policy(observation)
-                        if self.processor is not None:
-                            action = self.processor.process_action(action)
-                        callbacks.on_action_begin(action)
-                        observation, reward, done, info = env.step(action, 1)  # dont care dt
-                        observation = deepcopy(observation)
-                        if self.processor is not None:
-                            observation, reward, done, info = self.processor.process_step(observation, reward, done, info)
-                        callbacks.on_action_end(action)
-                        if done:
-                            warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                            observation = deepcopy(env.reset())
-                            if self.processor is not None:
-                                observation = self.processor.process_observation(observation)
-                            break
-
-                # At this point, we expect to be fully initialized.
-                assert episode_reward is not None
-                assert episode_step is not None
-                assert observation is not None
-
-                # Run a single step.
-                callbacks.on_step_begin(episode_step)
-                # This is were all of the work happens. We first perceive and compute the action
-                # (forward step) and then use the reward to improve (backward step).
-                action_tau = self.forward(observation)
-                action = action_tau if action_tau.shape[0] == 1 else np.array([action_tau[0]])
-
-                tau = action_tau[1]
-                action_repetition = int(np.ceil(20 * tau))  # minimum natural number which makes `dt` smaller than 0.05
-                dt = tau / action_repetition
-
-                if self.processor is not None:
-                    action = self.processor.process_action(action)
-                reward = np.float32(0)
-                accumulated_info = {}
-                done = False
-                for _ in range(action_repetition):
-                    callbacks.on_action_begin(action)
-                    observation, r, done, info = env.step(action, dt, tau)
-                    observation = deepcopy(observation)
-                    if self.processor is not None:
-                        observation, r, done, info = self.processor.process_step(observation, r, done, info)
-                    for key, value in info.items():
-                        if not np.isreal(value):
-                            continue
-                        if key not in accumulated_info:
-                            accumulated_info[key] = np.zeros_like(value)
-                        accumulated_info[key] += value
-                    callbacks.on_action_end(action)
-                    reward += r
-                    if done:
-                        break
-                reward *= dt  # make sum to integral
-                reward += l * tau # add tau reward
-                accumulated_time += tau
-                if step_log:
-                    print('\r' + f'{self.step}: tau = {tau}, state = {env.state}', end='')
-                if accumulated_time > episode_time:
-                    # Force a terminal state.
-                    done = True
-                metrics = self.backward(reward, terminal=done)
-                self.critic_loss_log.append(metrics[0])
-                episode_reward += reward
-
-                step_logs = {
-                    'action': action,
-                    'observation': observation,
-                    'reward': reward,
-                    'metrics': metrics,
-                    'episode': episode,
-                    'info': accumulated_info,
-                }
-                callbacks.on_step_end(episode_step, step_logs)
-                episode_memory.append(env.state)
-                episode_step += 1
-                self.step += 1
-
-                if done:
-                    # We are in a terminal state but the agent hasn't yet seen it. We therefore
-                    # perform one more forward-backward call and simply ignore the action before
-                    # resetting the environment. We need to pass in `terminal=False` here since
-                    # the *next* state, that is the state of the newly reset environment, is
-                    # always non-terminal by convention.
-                    self.forward(observation)
-                    self.backward(0., terminal=False)
-                    if original_log:
-                        print()
-                        print(f'episode_end, average_tau = {tau}, explosion = {explosion}')
-                        print()
-
-                    # This episode is finished, report and reset.
-                    episode_logs = {
-                        'episode_average_tau': accumulated_time/episode_step,
-                        'episode_reward': episode_reward,
-                        'nb_episode_steps': episode_step,
-                        'nb_steps': self.step,
-                    }
-                    callbacks.on_episode_end(episode, episode_logs)
-
-                    episode += 1
-                    self.state_memory.append(np.array(episode_memory))
-                    episode_memory = []
-                    observation = None
-                    episode_step = None
-                    episode_reward = None
-                    accumulated_time = 0
-        except KeyboardInterrupt:
-            # We catch keyboard interrupts here so that training can be be safely aborted.
-            # This is so common that we've built this right into this function, which ensures that
-            # the `on_train_end` method is properly called.
-            did_abort = True
-            self.state_memory.append(np.array(episode_memory))
-        callbacks.on_train_end(logs={'did_abort': did_abort})
+        callbacks += [StateMemoryRecorder(), _SelfTriggerLogger(step_log=step_log, original_log=original_log)]
+        engine = RolloutEngine(SelfTrigger(), shaper=shaper, exact_intervals=exact_intervals)
+        history = engine.fit(self, env, nb_steps, callbacks=callbacks, verbose=verbose, visualize=visualize,
+                             nb_max_start_steps=nb_max_start_steps, start_step_policy=start_step_policy,
+                             log_interval=log_interval, episode_time=episode_time)
         self.params_log = np.array(self.params_log)
-        self._on_train_end()
 
         return history
 
@@ -527,6 +231,7 @@ class self_Agent(object):
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
         self.training = False
+        copy_observation = ObservationCopier(env, check=self.check_observations)
         self.step = 0
         self.data_log = np.zeros((nb_episodes, nb_max_episode_steps, 5))
         his = []
@@ -562,7 +267,7 @@ class self_Agent(object):
 
             # Obtain the initial observation by resetting the environment.
             self.reset_states()
-            observation = deepcopy(env.reset())
+            observation = copy_observation(env.reset())
             if self.processor is not None:
                 observation = self.processor.process_observation(observation)
             assert observation is not None
@@ -579,13 +284,13 @@ class self_Agent(object):
                     action = self.processor.process_action(action)
                 callbacks.on_action_begin(action)
                 observation, r, done, info = env.step(action, 1)
-                observation = deepcopy(observation)
+                observation = copy_observation(observation)
                 if self.processor is not None:
                     observation, r, done, info = self.processor.process_step(observation, r, done, info)
                 callbacks.on_action_end(action)
                 if done:
                     warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                    observation = deepcopy(env.reset())
+                    observation = copy_observation(env.reset())
                     if self.processor is not None:
                         observation = self.processor.process_observation(observation)
                     break
@@ -630,7 +335,7 @@ class self_Agent(object):
                     com = 0
                     callbacks.on_action_begin(action)
                     observation, r, d, info = env.step(action, dt, tau)
-                    observation = deepcopy(observation)
+                    observation = copy_observation(observation)
                     if self.processor is not None:
                         observation, r, d, info = self.processor.process_step(observation, r, d, info)
                     callbacks.on_action_end(action)
@@ -776,7 +481,7 @@ class self_Agent(object):
     def _on_train_end(self):
         """Callback that is called after training ends."
         """
-        pass
+        stop_prefetching(self)
 
     def _on_test_begin(self):
         """Callback that is called before testing begins."
@@ -815,9 +520,15 @@ class sample_Agent(object):
 
     # Arguments
         processor (`Processor` instance): See [Processor](#processor) for details.
+        check_observations (boolean): If `True`, verify that environments declaring
+            `fresh_observations` never reuse their observation arrays. See `ObservationCopier`.
     """
-    def __init__(self, processor=None):
+    # Timer hooks of `fit` and `backward`, enabled by `rl2.callbacks.PhaseProfiler`.
+    timer = PhaseTimer()
+
+    def __init__(self, processor=None, check_observations=False):
         self.processor = processor
+        self.check_observations = check_observations
         self.training = False
         self.step = 0
 
@@ -831,7 +542,7 @@ class sample_Agent(object):
 
     def fit(self, env, nb_steps, action_repetition=1, callbacks=None, verbose=1,
             visualize=False, nb_max_start_steps=0, start_step_policy=None, log_interval=10000,
-            nb_max_episode_steps=None, tau=0.002):
+            nb_max_episode_steps=None, tau=0.002, exact_intervals=False):
         """Trains the agent on the given environment.
 
         # Arguments
@@ -856,6 +567,8 @@ class sample_Agent(object):
             nb_max_episode_steps (integer): Number of steps per episode that the agent performs before
                 automatically resetting the environment. Set to `None` if each episode should run
                 (potentially indefinitely) until the environment signals a terminal state.
+            exact_intervals (boolean): If `True` and `env` has `step_interval` (e.g. `LinearEnv`),
+                every interval is integrated in one call instead of in fixed Euler substeps.
 
         # Returns
             A `keras.callbacks.History` instance that recorded the entire training process.
@@ -865,171 +578,12 @@ class sample_Agent(object):
         if action_repetition < 1:
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
-        self.training = True
-        action_repetition = int(np.ceil(200 * tau))  # minimum natural number which makes `dt` smaller than 0.005
-        dt = tau / action_repetition
-
-        callbacks = [] if not callbacks else callbacks[:]
-
-        if verbose == 1:
-            callbacks += [TrainIntervalLogger(interval=log_interval)]
-        elif verbose > 1:
-            callbacks += [TrainEpisodeLogger()]
-        if visualize:
-            callbacks += [Visualizer()]
-        history = History()
-        callbacks += [history]
-        callbacks = CallbackList(callbacks)
-        if hasattr(callbacks, 'set_model'):
-            callbacks.set_model(self)
-        else:
-            callbacks._set_model(self)
-        callbacks._set_env(env)
-        params = {
-            'nb_steps': nb_steps,
-        }
-        if hasattr(callbacks, 'set_params'):
-            callbacks.set_params(params)
-        else:
-            callbacks._set_params(params)
-        self._on_train_begin()
-        callbacks.on_train_begin()
-
-        episode = np.int16(0)
-        self.step = np.int16(0)
-        observation = None
-        episode_reward = None
-        episode_step = None
-        did_abort = False
-        try:
-            while self.step < nb_steps:
-                if observation is None:  # start of a new episode
-                    callbacks.on_episode_begin(episode)
-                    episode_step = np.int16(0)
-                    episode_reward = np.float32(0)
-
-                    # Obtain the initial observation by resetting the environment.
-                    self.reset_states()
-                    observation = deepcopy(env.reset())
-                    if self.processor is not None:
-                        observation = self.processor.process_observation(observation)
-                    assert observation is not None
-
-                    # Perform random starts at beginning of episode and do not record them into the experience.
-                    # This slightly changes the start position between games.
-                    nb_random_start_steps = 0 if nb_max_start_steps == 0 else np.random.randint(nb_max_start_steps)
-                    for _ in range(nb_random_start_steps):
-                        if start_step_policy is None:
-                            action = env.action_space.sample()
-                        else:
-                            action = start_step_policy(observation)
-                        if self.processor is not None:
-                            action = self.processor.process_action(action)
-                        callbacks.on_action_begin(action)
-                        observation, reward, done, info = env.step(action)
-                        observation = deepcopy(observation)
-                        if self.processor is not None:
-                            observation, reward, done, info = self.processor.process_step(observation, reward, done, info)
-                        callbacks.on_action_end(action)
-                        if done:
-                            warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                            observation = deepcopy(env.reset())
-                            if self.processor is not None:
-                                observation = self.processor.process_observation(observation)
-                            break
-
-                # At this point, we expect to be fully initialized.
-                assert episode_reward is not None
-                assert episode_step is not None
-                assert observation is not None
-
-                # Run a single step.
-                callbacks.on_step_begin(episode_step)
-                # This is were all of the work happens. We first perceive and compute the action
-                # (forward step) and then use the reward to improve (backward step).
-                action = self.forward(observation)
-
-                # cbf certification for input
-                cbf_nessessity = True
-                if cbf_nessessity:
-                    x = env.state
-                    cbf = False
-                    tmp = bc.u_cbf(x, action)
-                    if action != tmp:
-                        cbf = True
-                        action = tmp
-
-                if self.processor is not None:
-                    action = self.processor.process_action(action)
-                reward = np.float32(0)
-                accumulated_info = {}
-                done = False
-                for _ in range(action_repetition):
-                    callbacks.on_action_begin(action)
-                    observation, r, done, info = env.step(action, tau, dt)
-                    observation = deepcopy(observation)
-                    if self.processor is not None:
-                        observation, r, done, info = self.processor.process_step(observation, r, done, info)
-                    for key, value in info.items():
-                        if not np.isreal(value):
-                            continue
-                        if key not in accumulated_info:
-                            accumulated_info[key] = np.zeros_like(value)
-                        accumulated_info[key] += value
-                    callbacks.on_action_end(action)
-                    reward += r
-                    if done:
-                        break
-                reward *= dt
-                reward -= 0.01 * tau * action[0]**2
-                if nb_max_episode_steps and episode_step >= nb_max_episode_steps - 1:
-                    # Force a terminal state.
-                    done = True
-                metrics = self.backward(reward, terminal=done)
-                episode_reward += reward
-
-                step_logs = {
-                    'action': action,
-                    'observation': observation,
-                    'reward': reward,
-                    'metrics': metrics,
-                    'episode': episode,
-                    'info': accumulated_info,
-                }
-                callbacks.on_step_end(episode_step, step_logs)
-                episode_step += 1
-                self.step += 1
-
-                if done:
-                    # We are in a terminal state but the agent hasn't yet seen it. We therefore
-                    # perform one more forward-backward call and simply ignore the action before
-                    # resetting the environment. We need to pass in `terminal=False` here since
-                    # the *next* state, that is the state of the newly reset environment, is
-                    # always non-terminal by convention.
-                    self.forward(observation)
-                    self.backward(0., terminal=False)
-
-                    # This episode is finished, report and reset.
-                    episode_logs = {
-                        'episode_reward': episode_reward,
-                        'nb_episode_steps': episode_step,
-                        'nb_steps': self.step,
-                    }
-                    callbacks.on_episode_end(episode, episode_logs)
-
-                    episode += 1
-                    observation = None
-                    episode_step = None
-                    episode_reward = None
-        except KeyboardInterrupt:
-            # We catch keyboard interrupts here so that training can be be safely aborted.
-            # This is so common that we've built this right into this function, which ensures that
-            # the `on_train_end` method is properly called.
-            did_abort = True
-        callbacks.on_train_end(logs={'did_abort': did_abort})
-        self._on_train_end()
-
-        return history
+        engine = RolloutEngine(PeriodicTrigger(tau=tau), shaper=InputEnergyPenalty(.01),
+                               safety_filter=CBFSafetyFilter(clipper=10., use_env_state=True),
+                               exact_intervals=exact_intervals)
+        return engine.fit(self, env, nb_steps, callbacks=callbacks, verbose=verbose, visualize=visualize,
+                          nb_max_start_steps=nb_max_start_steps, start_step_policy=start_step_policy,
+                          log_interval=log_interval, nb_max_episode_steps=nb_max_episode_steps)
 
     def test(self, env, nb_episodes=1, action_repetition=1, callbacks=None, visualize=True,
              nb_max_episode_steps=None, nb_max_start_steps=0, start_step_policy=None, verbose=1, tau=0.002):
@@ -1067,6 +621,7 @@ class sample_Agent(object):
             raise ValueError('action_repetition must be >= 1, is {}'.format(action_repetition))
 
         self.training = False
+        copy_observation = ObservationCopier(env, check=self.check_observations)
         self.step = 0
         self.data_log = np.zeros((nb_episodes, nb_max_episode_steps, 5))
         his = []
@@ -1104,7 +659,7 @@ class sample_Agent(object):
 
             # Obtain the initial observation by resetting the environment.
             self.reset_states()
-            observation = deepcopy(env.reset())
+            observation = copy_observation(env.reset())
             if self.processor is not None:
                 observation = self.processor.process_observation(observation)
             assert observation is not None
@@ -1121,13 +676,13 @@ class sample_Agent(object):
                     action = self.processor.process_action(action)
                 callbacks.on_action_begin(action)
                 observation, r, done, info = env.step(action)
-                observation = deepcopy(observation)
+                observation = copy_observation(observation)
                 if self.processor is not None:
                     observation, r, done, info = self.processor.process_step(observation, r, done, info)
                 callbacks.on_action_end(action)
                 if done:
                     warnings.warn('Env ended before {} random steps could be performed at the start. You should probably lower the `nb_max_start_steps` parameter.'.format(nb_random_start_steps))
-                    observation = deepcopy(env.reset())
+                    observation = copy_observation(env.reset())
                     if self.processor is not None:
                         observation = self.processor.process_observation(observation)
                     break
@@ -1157,7 +712,7 @@ class sample_Agent(object):
                     com = 0
                     callbacks.on_action_begin(action)
                     observation, r, d, info = env.step(action, tau, dt)
-                    observation = deepcopy(observation)
+                    observation = copy_observation(observation)
                     if self.processor is not None:
                         observation, r, d, info = self.processor.process_step(observation, r, d, info)
                     callbacks.on_action_end(action)
@@ -1302,7 +857,7 @@ class sample_Agent(object):
     def _on_train_end(self):
         """Callback that is called after training ends."
         """
-        pass
+        stop_prefetching(self)
 
     def _on_test_begin(self):
         """Callback that is called before testing begins."
@@ -1441,6 +996,8 @@ class Env(object):
     reward_range = (-np.inf, np.inf)
     action_space = None
     observation_space = None
+    # Set to `True` if `step` and `reset` always return a newly allocated observation.
+    fresh_observations = False
 
     def step(self, action):
         """Run one timestep of the environment's dynamics.
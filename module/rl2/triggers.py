@@ -0,0 +1,167 @@
+"""Cheap event-trigger conditions and a batched event-triggered execution loop.
+
+An event-triggered controller only needs its actor when a new input is transmitted. The
+conditions here decide that from the current states and the states at the last transmission,
+either with classical thresholds on `|x - x_k|` (a few NumPy operations) or with a separate,
+small trigger model, so that steps that hold the input never call the actor.
+"""
+from __future__ import division
+
+import numpy as np
+
+
+class TriggerCondition(object):
+    """Decides for a batch of plants whether an event fires.
+
+    To implement your own condition, you have to implement `__call__`.
+    """
+    def __call__(self, states, sent_states):
+        """Evaluates the condition
+
+        # Arguments
+            states (np.ndarray): `(N, d)` current states.
+            sent_states (np.ndarray): `(N, d)` states at the last transmission `x_k`.
+
+        # Returns
+            `(N,)` boolean array, `True` where a new input has to be transmitted.
+        """
+        raise NotImplementedError()
+
+
+class AbsoluteThreshold(TriggerCondition):
+    """Fires when `|x - x_k| > delta`."""
+    def __init__(self, delta, ord=2):
+        self.delta = delta
+        self.ord = ord
+
+    def __call__(self, states, sent_states):
+        return np.linalg.norm(states - sent_states, ord=self.ord, axis=1) > self.delta
+
+
+class RelativeThreshold(TriggerCondition):
+    """Fires when `|x - x_k| > sigma |x| + eps`, the classical condition for ISS plants."""
+    def __init__(self, sigma, eps=0., ord=2):
+        self.sigma = sigma
+        self.eps = eps
+        self.ord = ord
+
+    def __call__(self, states, sent_states):
+        error = np.linalg.norm(states - sent_states, ord=self.ord, axis=1)
+        return error > self.sigma * np.linalg.norm(states, ord=self.ord, axis=1) + self.eps
+
+
+class ModelCondition(TriggerCondition):
+    """Fires when a trigger model outputs `c_1 > c_0`, like the actor heads of `eventDDPGAgent`
+
+    # Arguments
+        model (`keras.models.Model` instance): Maps `(N, 1, d)` states to `(N, 2)` rows
+            `(c_1, c_0)`, see `trigger_model_from_actor`.
+    """
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, states, sent_states):
+        c = self.model.predict_on_batch(states[:, None])
+        return c[:, 0] > c[:, 1]
+
+
+def trigger_model_from_actor(actor):
+    """Builds the model of the communication heads `(c_1, c_0)` of an event actor
+
+    The actor has to end with a concatenation of `[u, c_1, c_0]` branches. The returned model
+    shares their weights and only computes the trigger branches.
+    """
+    from keras2.layers import concatenate
+    from keras2.models import Model
+
+    node = actor.layers[-1]._inbound_nodes[0]
+    heads = node.input_tensors[1:]
+    if len(heads) != 2:
+        raise ValueError('Expected the actor to end with a concatenation of [u, c_1, c_0] branches.')
+    return Model(inputs=actor.inputs, outputs=concatenate(heads))
+
+
+def _policy_output(actor, states):
+    if hasattr(actor, 'predict_on_batch'):
+        return actor.predict_on_batch(states[:, None])
+    return np.asarray(actor(states))
+
+
+class EventTriggeredRuntime(object):
+    """Runs an event-triggered controller on a batch of environments
+
+    On every step the trigger condition is evaluated for all environments at once. The actor
+    is called once per step for the environments whose event fired (and on the first step),
+    all others keep their held input. The env rewards are summed as returned and, like
+    `CommunicationPenalty`, `lam` is subtracted for every transmission.
+
+    # Arguments
+        actor (`keras.models.Model` instance or function): Maps `(N, 1, d)` states (a function
+            gets `(N, d)`) to actions whose first entry is the input.
+        condition (`TriggerCondition` instance): Decides when to transmit.
+        lam (float): Cost of one transmission.
+    """
+    def __init__(self, actor, condition, lam=1.):
+        self.actor = actor
+        self.condition = condition
+        self.lam = lam
+
+    def run(self, envs, nb_steps, dt=None, reset=True, record=False):
+        """Runs `nb_steps` steps in every environment
+
+        # Arguments
+            envs (list): Environments, stepped with `env.step(u)`, or `env.step(u, dt, dt)` if
+                `dt` is given (e.g. `PendulumEnv2`, `LinearEnv`).
+            nb_steps (integer): Number of steps per environment.
+            dt (float): Time step of timed environments.
+            reset (boolean): Reset the environments first, otherwise continue from their state.
+            record (boolean): Also return the states and events of every step.
+
+        # Returns
+            Dict with the summed rewards `rewards` and the numbers of transmissions `nb_events`
+            per environment, the number of actor calls `nb_actor_calls` and, with `record`,
+            `(nb_steps, N, d)` `states` and `(nb_steps, N)` `events`.
+        """
+        if reset:
+            states = np.array([env.reset() for env in envs], dtype=np.float64)
+        else:
+            states = np.array([env._get_obs() for env in envs], dtype=np.float64)
+        nb_envs = len(envs)
+        sent_states = states.copy()
+        inputs = np.zeros(nb_envs)
+        rewards = np.zeros(nb_envs)
+        nb_events = np.zeros(nb_envs, dtype=np.int64)
+        active = np.ones(nb_envs, dtype=bool)
+        nb_actor_calls = 0
+        state_log, event_log = [], []
+
+        for step in range(nb_steps):
+            if step == 0:
+                events = active.copy()
+            else:
+                events = active & self.condition(states, sent_states)
+            if np.any(events):
+                inputs[events] = _policy_output(self.actor, states[events])[:, 0]
+                sent_states[events] = states[events]
+                nb_events += events
+                rewards -= self.lam * events
+                nb_actor_calls += 1
+            if record:
+                state_log.append(states.copy())
+                event_log.append(events)
+
+            for i in np.nonzero(active)[0]:
+                u = inputs[i:i + 1]
+                observation, r, done, _ = envs[i].step(u) if dt is None else envs[i].step(u, dt, dt)
+                states[i] = observation
+                rewards[i] += r
+                if done:
+                    active[i] = False
+            if not np.any(active):
+                break
+
+        result = {'rewards': rewards, 'nb_events': nb_events, 'nb_actor_calls': nb_actor_calls}
+        if record:
+            result['states'] = np.array(state_log)
+            result['events'] = np.array(event_log)
+        return result
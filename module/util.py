@@ -1,5 +1,9 @@
+import hashlib
+import json
+import os
+
 import numpy as np
-import scipy
+import scipy.linalg
 
 def moving_average(data, l=30):
     out = []
@@ -12,12 +16,30 @@ def moving_average(data, l=30):
     return out
 
 
+def _memoize_arrays(f):
+    """Caches `f(*arrays)` by the shapes, dtypes and contents of the array arguments."""
+    cache = {}
+
+    def wrapper(*arrays):
+        arrays = [np.asarray(a) for a in arrays]
+        key = tuple((a.shape, a.dtype.str, a.tobytes()) for a in arrays)
+        if key not in cache:
+            cache[key] = f(*arrays)
+        return cache[key].copy()
+    wrapper.cache = cache
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    return wrapper
+
+
+@_memoize_arrays
 def lqr(A, B, Q, R):
     P = scipy.linalg.solve_continuous_are(A, B, Q, R)
     K = np.linalg.inv(R).dot(B.T).dot(P)
     return -K
 
 
+@_memoize_arrays
 def dlqr(A, B, Q, R):
     P = scipy.linalg.solve_discrete_are(A, B, Q, R)
     K = np.linalg.inv(np.dot(B.T, P).dot(B) + R).dot(B.T).dot(P).dot(A)
@@ -46,25 +68,55 @@ def _gain(env, dt=None):
     return K
 
 
-def make_standup_agent(actor_net, tau, env, epochs=100, verbose=False):
+def _standup_cache_key(actor_net, tau, env, epochs, nb_samples):
+    # Layer names are left out, they depend on how many models were built before.
+    architecture = []
+    for layer in actor_net.layers:
+        config = {k: v for k, v in layer.get_config().items() if k != 'name'}
+        shapes = [list(w.shape) for w in layer.get_weights()]
+        architecture.append([layer.__class__.__name__, config, shapes])
+    content = {
+        'architecture': architecture,
+        'tau': float(tau),
+        'env': [float(env.m), float(env.l), float(env.g)],
+        'epochs': epochs,
+        'nb_samples': nb_samples,
+    }
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def make_standup_agent(actor_net, tau, env, epochs=100, verbose=False, nb_samples=30000, cache_dir=None):
+    """Pretrains `actor_net` to imitate the LQR controller of `env` with the constant interval `tau`.
+
+    With `cache_dir`, the pretrained weights are stored under a hash of the actor architecture,
+    `tau`, the pendulum parameters and the training setup, and loaded instead of retraining when
+    the same configuration is requested again.
+    """
+    # Compiled on both paths, so a cache hit returns the same object as a fresh training run.
+    actor_net.compile(loss='mean_squared_error',optimizer='adam')
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, 'standup_{}.h5'.format(
+            _standup_cache_key(actor_net, tau, env, epochs, nb_samples)))
+        if os.path.exists(path):
+            actor_net.load_weights(path)
+            return actor_net
+
     # 学習データの用意
     action_repetition = int(np.ceil(20 * tau))  # minimum natural number which makes `dt` smaller than 0.005
     dt = tau / action_repetition
     K = _gain(env, dt)
-    x_train = []
-    y_train = []
     high = np.array([np.pi, np.pi])
-    for i in range(30000):
-        x_train.append([np.random.uniform(low=-high, high=high)])
-        y_train.append([np.dot(K, x_train[-1][0]), tau])
-
-    x_train = np.array(x_train)
-    y_train = np.array(y_train)
+    states = np.random.uniform(low=-high, high=high, size=(nb_samples, 2))
+    x_train = states[:, np.newaxis, :]
+    y_train = np.column_stack([states.dot(K), np.full(nb_samples, tau)])
 
     # 学習
-    actor_net.compile(loss='mean_squared_error',optimizer='adam')
     actor_net.fit(x_train, y_train, batch_size=128, epochs=epochs, verbose=verbose)
 
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        actor_net.save_weights(path)
     return actor_net
 
 def get_NN_params(actor):
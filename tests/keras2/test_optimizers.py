@@ -0,0 +1,67 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+pytest.importorskip('tensorflow')
+
+from keras2 import backend as K  # noqa: E402
+from keras2 import optimizers  # noqa: E402
+
+
+def _problem(seed=0):
+    """Two groups of variables coupled by one loss."""
+    rng = np.random.RandomState(seed)
+    values = [rng.randn(3, 2), rng.randn(2), rng.randn(2, 4)]
+    params = [K.variable(value) for value in values]
+    x = K.constant(rng.randn(5, 3))
+    y = K.constant(rng.randn(5, 4))
+    hidden = K.tanh(K.dot(x, params[0]) + params[1])
+    loss = K.mean(K.square(K.dot(hidden, params[2]) - y)) + 10. * K.sum(K.square(params[1]))
+    return params, loss
+
+
+@pytest.mark.parametrize('amsgrad', [False, True])
+def test_grouped_adam_matches_one_adam_per_group(amsgrad):
+    params, loss = _problem()
+    reference_params, reference_loss = _problem()
+
+    # The groups are interleaved in `params`.
+    grouped = optimizers.GroupedAdam([
+        {'name': 'a', 'params': [params[0], params[2]], 'lr': .01, 'clipnorm': .5},
+        {'name': 'b', 'params': [params[1]], 'lr': .003, 'decay': .01},
+    ], amsgrad=amsgrad)
+    adam_a = optimizers.Adam(lr=.01, clipnorm=.5, amsgrad=amsgrad)
+    adam_b = optimizers.Adam(lr=.003, decay=.01, amsgrad=amsgrad)
+
+    train = K.function([], [loss], updates=grouped.get_updates(loss, params))
+    reference_train = K.function([], [reference_loss], updates=(
+        adam_a.get_updates(reference_loss, [reference_params[0], reference_params[2]]) +
+        adam_b.get_updates(reference_loss, [reference_params[1]])))
+
+    for _ in range(25):
+        train([])
+        reference_train([])
+    for p, reference_p in zip(params, reference_params):
+        assert_allclose(K.get_value(p), K.get_value(reference_p), rtol=1e-5, atol=1e-6)
+
+
+def test_grouped_adam_gradients_follow_params_order():
+    params, loss = _problem()
+    grouped = optimizers.GroupedAdam([
+        {'name': 'a', 'params': [params[2]]},
+        {'name': 'rest'},
+    ])
+    grouped.get_updates(loss, params)
+    expected = K.gradients(loss, params)
+
+    assert len(grouped.gradients) == len(params)
+    values = K.function([], grouped.gradients + expected)([])
+    for grad, expected_grad in zip(values[:len(params)], values[len(params):]):
+        assert_allclose(grad, expected_grad, rtol=1e-6)
+
+
+def test_grouped_adam_needs_unique_group_names():
+    with pytest.raises(ValueError):
+        optimizers.GroupedAdam([{'name': 'a'}, {'name': 'a'}])
@@ -0,0 +1,72 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+pytest.importorskip('rl')
+
+from keras.models import Sequential  # noqa: E402
+from keras.layers import Activation, Dense, Flatten  # noqa: E402
+
+from rl2.agents.cem import CEMAgent, _numpy_forward, _numpy_spec  # noqa: E402
+from rl2.memory import EpisodeParameterMemory  # noqa: E402
+
+
+class _CountingEnv(object):
+    # Never done on its own, so every episode lasts `nb_max_episode_steps`.
+    def reset(self):
+        self.x = np.zeros(3)
+        return self.x
+
+    def step(self, action):
+        self.x = self.x + (1. if action == 1 else -1.) * .1
+        return self.x, float(action), False, {}
+
+
+def _make_env():
+    return _CountingEnv()
+
+
+def _agent(batch_size=8):
+    model = Sequential()
+    model.add(Flatten(input_shape=(1, 3)))
+    model.add(Dense(4, activation='relu'))
+    model.add(Dense(2))
+    model.add(Activation('softmax'))
+    memory = EpisodeParameterMemory(limit=1000, window_length=1)
+    agent = CEMAgent(model, nb_actions=2, memory=memory, batch_size=batch_size, elite_frac=.25)
+    agent.compile()
+    return agent
+
+
+def test_numpy_forward_matches_model():
+    agent = _agent()
+    batch = np.random.RandomState(0).randn(5, 1, 3)
+    expected = agent.model.predict_on_batch(batch)
+    actual = _numpy_forward(_numpy_spec(agent.model), agent.model.get_weights(), batch)
+    assert_allclose(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_fit_parallel_counts_env_steps():
+    agent = _agent()
+    history = agent.fit_parallel(_make_env, nb_generations=3, population_size=8, nb_workers=1,
+                                 nb_max_episode_steps=5, verbose=0)
+    assert agent.step == 3 * 8 * 5
+    assert agent.episode == 3 * 8
+    assert agent.memory.nb_entries == 3 * 8
+    assert len(history['mean_reward']) == 3
+    assert not agent.training
+
+
+def test_fit_parallel_pool_matches_in_process():
+    histories = []
+    for nb_workers in [1, 2]:
+        np.random.seed(1)
+        agent = _agent()
+        histories.append(agent.fit_parallel(_make_env, nb_generations=2, population_size=8,
+                                            nb_workers=nb_workers, nb_max_episode_steps=5, verbose=0))
+    assert_allclose(histories[1]['mean_reward'], histories[0]['mean_reward'])
+    assert_allclose(histories[1]['mean_best_reward'], histories[0]['mean_best_reward'])
@@ -0,0 +1,45 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+pytest.importorskip('tensorflow')
+
+import keras2.backend as K  # noqa: E402
+from keras2.layers import Input  # noqa: E402
+
+from rl2.agents.dqn import NAFLayer  # noqa: E402
+
+
+def _advantage(L_flat, mu, a, mode):
+    # One sample at a time, like the original per-sample scan.
+    nb_actions = mu.shape[1]
+    A = []
+    for l_flat, m, u in zip(L_flat, mu, a):
+        if mode == 'full':
+            L = np.zeros((nb_actions, nb_actions))
+            L[np.tril_indices(nb_actions)] = l_flat
+            L[np.diag_indices(nb_actions)] = np.exp(np.diag(L)) + K.epsilon()
+            P = np.dot(L, L.T)
+        else:
+            P = np.diag(l_flat)
+        A.append(-.5 * np.dot(u - m, np.dot(P, u - m)))
+    return np.array(A)[:, None]
+
+
+@pytest.mark.parametrize('mode', ['full', 'diag'])
+@pytest.mark.parametrize('nb_actions', [1, 3])
+def test_naf_layer_matches_per_sample_computation(mode, nb_actions):
+    nb_elems = (nb_actions * nb_actions + nb_actions) // 2 if mode == 'full' else nb_actions
+    rng = np.random.RandomState(0)
+    L_flat = rng.uniform(-1., 1., size=(32, nb_elems)).astype(np.float32)
+    mu = rng.randn(32, nb_actions).astype(np.float32)
+    a = rng.randn(32, nb_actions).astype(np.float32)
+
+    inputs = [Input(shape=(nb_elems,)), Input(shape=(nb_actions,)), Input(shape=(nb_actions,))]
+    output = NAFLayer(nb_actions, mode=mode)(inputs)
+    result = K.function(inputs, [output])([L_flat, mu, a])[0]
+
+    assert result.shape == (32, 1)
+    assert_allclose(result, _advantage(L_flat.astype(np.float64), mu, a, mode), rtol=1e-4, atol=1e-5)
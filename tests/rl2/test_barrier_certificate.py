@@ -0,0 +1,38 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+import rl2.barrier_certificate as bc
+
+
+def _inputs(nb_samples=5000, seed=0):
+    rng = np.random.RandomState(seed)
+    x = rng.uniform(-1.2, 1.2, size=(nb_samples, 2))
+    x[::25, 1] = 0.  # the still branch of `_u_of_x`
+    u = rng.uniform(-20., 20., size=nb_samples)  # also beyond the input bound
+    return x, u
+
+
+@pytest.mark.parametrize('pure', [False, True])
+@pytest.mark.parametrize('clipper', [10., 4.])
+def test_u_cbf_batch_matches_u_cbf(pure, clipper):
+    x, u = _inputs()
+    single = bc.u_cbf_pure if pure else bc.u_cbf
+    expected = np.array([single(xi, ui, clipper)[0] for xi, ui in zip(x, u)])
+    filtered, active, hx = bc.u_cbf_batch(x, u, clipper, pure=pure)
+    assert_allclose(filtered, expected, atol=1e-10)
+    assert_allclose(hx, [bc.h(xi) for xi in x])
+
+    # Same rule as `CBFSafetyFilter.apply`.
+    expected_active = np.array([bool(np.any(ui != single(xi, ui, clipper))) for xi, ui in zip(x, u)])
+    assert_array_equal(active, expected_active)
+
+
+def test_u_of_x_batch_matches_u_of_x():
+    x, _ = _inputs(1000, seed=1)
+    rmin, rmax = bc._u_of_x_batch(x, 10.)
+    expected = np.array([bc._u_of_x(xi, 10.) for xi in x])
+    assert_allclose(rmin, expected[:, 0], atol=1e-10)
+    assert_allclose(rmax, expected[:, 1], atol=1e-10)
@@ -0,0 +1,174 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+
+from rl2.callbacks import PhaseTimer  # noqa: E402
+from rl2.dataset import (  # noqa: E402
+    DatasetRecorder,
+    TransitionDataset,
+    TransitionWriter,
+    _npy_header,
+    write_memory,
+)
+from rl2.memory import TIME_COLUMNS, CompactSequentialMemory  # noqa: E402
+from rl2.rollout import IntervalPenalty, RolloutEngine, SelfTrigger  # noqa: E402
+
+
+def _rows(nb_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    return {'s': rng.randn(nb_rows, 2), 'u': rng.randn(nb_rows, 1), 'tau': rng.uniform(.01, 1., nb_rows),
+            'r': rng.randn(nb_rows), 's1': rng.randn(nb_rows, 2), 'done': rng.rand(nb_rows) < .1,
+            't': rng.uniform(0., 10., nb_rows)}
+
+
+def _concat(*rows):
+    return {name: np.concatenate([r[name] for r in rows]) for name in rows[0]}
+
+
+def test_writer_round_trip_and_reopen(tmp_path):
+    path = str(tmp_path / 'data')
+    first, second, third = _rows(7, 0), _rows(50, 1), _rows(3, 2)
+    with TransitionWriter(path, metadata={'env': 'LinearEnv'}, buffer_size=4) as writer:
+        for i in range(len(first['r'])):
+            writer.append(**{name: column[i] for name, column in first.items()})
+        # The rows of the last partial buffer become readable on `flush`.
+        writer.extend(**second)
+        assert len(writer) == 57
+    assert len(TransitionDataset(path)) == 57
+
+    with TransitionWriter(path, metadata={'lam': .1}) as writer:
+        writer.extend(**third)
+
+    dataset = TransitionDataset(path)
+    expected = _concat(first, second, third)
+    assert len(dataset) == 60
+    assert dataset.metadata == {'env': 'LinearEnv', 'lam': .1}
+    for name, column in expected.items():
+        dtype = np.uint8 if name == 'done' else np.float32
+        assert dataset[name].dtype == dtype
+        assert_array_equal(dataset[name], np.asarray(column, dtype=dtype))
+
+    idxs = np.array([59, 3, 3, 20, 0])
+    s, u, tau, r, s1, done, t = dataset.get(idxs)
+    assert_array_equal(s, expected['s'][idxs].astype(np.float32))
+    assert_array_equal(done, expected['done'][idxs])
+
+    state0, action, reward, state1, terminal1 = dataset.arrays(tau_index=1)
+    assert_allclose(action[:, 0], expected['u'][:, 0], rtol=1e-6)
+    assert_allclose(action[:, 1], expected['tau'], rtol=1e-6)
+    assert_array_equal(terminal1, 1. - expected['done'])
+
+
+def test_writer_rejects_mismatched_shapes(tmp_path):
+    with TransitionWriter(str(tmp_path / 'data')) as writer:
+        writer.extend(**_rows(4))
+        rows = _rows(4)
+        rows['s'] = rows['s'][:, :1]
+        with pytest.raises(ValueError):
+            writer.extend(**rows)
+
+
+def test_npy_header_rejects_shapes_that_do_not_fit():
+    assert len(_npy_header('float32', [10 ** 9, 3])) == 128
+    with pytest.raises(ValueError):
+        _npy_header('float32', [10 ** 9] + [1000] * 20)
+
+
+def test_write_memory_matches_sample_arrays(tmp_path):
+    rng = np.random.RandomState(0)
+    memory = CompactSequentialMemory(limit=100, window_length=1, columns=TIME_COLUMNS)
+    time = 0.
+    for step in range(60):
+        terminal = step % 17 == 16
+        tau = rng.uniform(.01, 1.)
+        memory.append(rng.randn(2), np.array([rng.randn(), tau]), rng.randn(), terminal,
+                      tau=tau, episode_time=time, discount=1.)
+        time = 0. if terminal else time + tau
+
+    path = str(tmp_path / 'data')
+    with TransitionWriter(path) as writer:
+        write_memory(writer, memory)
+    dataset = TransitionDataset(path)
+
+    idxs = np.arange(memory.window_length, memory.nb_entries - 1)
+    idxs = idxs[~memory._terminal(idxs - 1)]
+    state0, action, reward, state1, terminal1, columns = memory.sample_arrays(len(idxs), idxs, columns=True)
+    assert len(dataset) == len(idxs)
+    assert_allclose(dataset['s'], state0[:, 0], rtol=1e-6)
+    assert_allclose(dataset['u'][:, 0], action[:, 0], rtol=1e-6)
+    assert_allclose(dataset['tau'], columns['tau'], rtol=1e-6)
+    assert_allclose(dataset['t'], columns['episode_time'], rtol=1e-6)
+    assert_allclose(dataset['r'], reward, rtol=1e-6)
+    assert_allclose(dataset['s1'], state1[:, 0], rtol=1e-6)
+    assert_array_equal(dataset['done'], 1 - terminal1)
+
+
+class _NoisyPlant(object):
+    """Linear plant whose observations are noisy measurements of `state`."""
+    A = np.array([[-1., 4.], [2., -3.]])
+    B = np.array([2., 4.])
+
+    def __init__(self):
+        self.state = None
+        self.resets = []
+
+    def _observe(self):
+        return self.state + np.random.uniform(-.1, .1, size=2)
+
+    def reset(self):
+        self.state = np.random.uniform(-1., 1., size=2)
+        self.resets.append(self._observe())
+        return self.resets[-1].copy()
+
+    def step(self, u, dt=.05, tau=None):
+        x = self.state
+        self.state = x + dt * (np.dot(self.A, x) + self.B * u[0])
+        done = bool(np.max(np.abs(self.state)) > 3.)
+        return self._observe(), -np.dot(x, x), done, {}
+
+
+class _LinearAgent(object):
+    timer = PhaseTimer()
+    compiled = True
+    processor = None
+
+    def reset_states(self):
+        pass
+
+    def _on_train_begin(self):
+        pass
+
+    def _on_train_end(self):
+        pass
+
+    def forward(self, observation):
+        return np.array([-np.dot([.5, .4], observation), .1 + .1 * np.abs(observation[0])])
+
+    def backward(self, reward, terminal=False):
+        return []
+
+
+def test_dataset_recorder_stores_observations(tmp_path):
+    env = _NoisyPlant()
+    path = str(tmp_path / 'data')
+    writer = TransitionWriter(path)
+    np.random.seed(0)
+    RolloutEngine(SelfTrigger(), IntervalPenalty(.5)).fit(
+        _LinearAgent(), env, 60, callbacks=[DatasetRecorder(writer)], verbose=0, episode_time=1.)
+    writer.close()
+
+    dataset = TransitionDataset(path)
+    s, s1, done = np.asarray(dataset['s']), np.asarray(dataset['s1']), np.asarray(dataset['done'])
+    assert len(dataset) == 60
+    starts = np.concatenate([[0], np.nonzero(done[:-1])[0] + 1])
+    assert len(starts) == len(env.resets) > 1
+    # Every episode starts from the reset observation, then continues from the last `s1`.
+    assert_allclose(s[starts], np.array(env.resets), rtol=1e-6)
+    following = np.setdiff1d(np.arange(len(dataset)), starts)
+    assert_array_equal(s[following], s1[following - 1])
+    assert_allclose(dataset['t'][starts], 0.)
@@ -0,0 +1,91 @@
+from __future__ import division
+
+from collections import namedtuple
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from rl2.dp import QTable, StateGrid, linear_dp, linear_interval
+from rl2.evaluation import LinearPolicyEvaluator
+
+Plant = namedtuple('Plant', ['A', 'B', 'D'])
+PLANT = Plant(A=np.array([[-1., 4.], [2., -3.]]), B=np.array([2., 4.]), D=np.array([.6, .3]))
+
+
+def _small_dp():
+    return linear_dp(num=(9, 9), us=np.linspace(-4., 4., 5), taus=np.array([.05, .2, .5]))
+
+
+def test_interpolation_is_exact_on_points_and_linear_functions():
+    grid = StateGrid([-1., -2.], [1., 2.], (5, 7))
+    points = grid.points()
+    idxs, weights = grid.interpolation(points)
+    assert_allclose(np.sum(weights * (idxs == np.arange(grid.size)[:, None]), axis=1), 1.)
+
+    rng = np.random.RandomState(0)
+    states = rng.uniform([-1., -2.], [1., 2.], size=(100, 2))
+    f = np.dot(points, [3., -.5]) + 1.
+    idxs, weights = grid.interpolation(states)
+    assert_allclose(np.sum(weights * f[idxs], axis=1), np.dot(states, [3., -.5]) + 1.)
+
+
+def test_periodic_interpolation_wraps_around():
+    grid = StateGrid([-np.pi, -1.], [np.pi, 1.], (8, 3), periodic=(True, False))
+    states = np.array([[.3, .2], [-.7, -.4]])
+    shifted = states + [[2 * np.pi, 0.], [-2 * np.pi, 0.]]
+    f = np.random.RandomState(0).randn(grid.size)
+    idxs, weights = grid.interpolation(states)
+    shifted_idxs, shifted_weights = grid.interpolation(shifted)
+    assert_allclose(np.sum(weights * f[idxs], axis=1), np.sum(shifted_weights * f[shifted_idxs], axis=1))
+
+
+def test_linear_interval_matches_evaluator_moments():
+    rng = np.random.RandomState(0)
+    states = rng.uniform(-1., 1., size=(20, 2))
+    u = rng.uniform(-2., 2., size=20)
+    tau = rng.choice([.05, .2, .37], size=20)
+    next_states, reward = linear_interval(states, u, tau, clip=np.inf)
+
+    evaluator = LinearPolicyEvaluator(PLANT, np.zeros(2), .2, ln=0., nb_decisions=1)
+    for i in range(len(states)):
+        M, c, Phi, _ = evaluator.interval(tau[i])
+        z = np.append(states[i], u[i])
+        assert_allclose(next_states[i], np.dot(Phi, z), rtol=1e-10, atol=1e-12)
+        assert_allclose(reward[i], -np.dot(z, np.dot(M, z)) - c, rtol=1e-10)
+
+
+def test_evaluate_is_a_fixed_point_of_the_backup():
+    dp = _small_dp()
+    rng = np.random.RandomState(0)
+    policy = np.stack([rng.randint(len(dp.us), size=dp.grid.size),
+                       rng.randint(len(dp.taus), size=dp.grid.size)], axis=1)
+    V = dp.evaluate(policy)
+    s = np.arange(dp.grid.size)
+    assert_allclose(dp.backup(V)[s, policy[:, 0], policy[:, 1]], V, rtol=1e-5)
+
+
+def test_policy_iteration_matches_value_iteration():
+    dp = _small_dp()
+    pi = dp.policy_iteration()
+    vi = dp.value_iteration(tol=1e-10)
+    assert_allclose(pi.V, vi.V, rtol=1e-5, atol=1e-5)
+    assert_allclose(dp.backup(pi.V).reshape(dp.grid.size, -1).max(axis=1), pi.V, rtol=1e-5, atol=1e-5)
+
+
+def test_qtable_save_load_round_trip(tmp_path):
+    table = _small_dp().policy_iteration()
+    filepath = str(tmp_path / 'q.npz')
+    table.save(filepath)
+    loaded = QTable.load(filepath)
+
+    assert loaded.Q.dtype == np.float32
+    assert_allclose(loaded.Q, table.Q, rtol=1e-6)
+    assert_array_equal(loaded.us, table.us)
+    assert_array_equal(loaded.taus, table.taus)
+    assert loaded.alpha == table.alpha and loaded.beta == table.beta
+    assert loaded.grid.num == table.grid.num and loaded.grid.periodic == table.grid.periodic
+    assert_allclose(loaded.grid.points(), table.grid.points())
+
+    states = np.random.RandomState(0).uniform(-7., 7., size=(50, 2))
+    assert_allclose(loaded.value(states), table.value(states), rtol=1e-6)
+    assert_allclose(loaded.q_value(states, 1.3, .3), table.q_value(states, 1.3, .3), rtol=1e-6)
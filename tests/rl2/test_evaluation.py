@@ -0,0 +1,69 @@
+from __future__ import division
+
+from collections import namedtuple
+
+import numpy as np
+import scipy.linalg
+from numpy.testing import assert_allclose
+
+from rl2.evaluation import INPUT_COST, STATE_COST, LinearPolicyEvaluator, monte_carlo_value, state_grid
+from rl2.montecarlo import LinearPolicy
+
+# The matrices of `gym2.envs.classic_control.LinearEnv`.
+Plant = namedtuple('Plant', ['A', 'B', 'D'])
+PLANT = Plant(A=np.array([[-1., 4.], [2., -3.]]), B=np.array([2., 4.]), D=np.array([.6, .3]))
+TAU = .2
+
+
+def _lqr_gain():
+    # A larger input weight than the env's keeps the gain stable when held for `TAU`.
+    B = PLANT.B[:, None]
+    R = np.array([[10. * INPUT_COST]])
+    P = scipy.linalg.solve_continuous_are(PLANT.A, B, STATE_COST * np.eye(2), R)
+    return -np.linalg.solve(R, np.dot(B.T, P)).reshape(-1)
+
+
+def test_value_matches_monte_carlo_without_noise():
+    K = _lqr_gain()
+    states = state_grid(-2., 2., 5)
+    evaluator = LinearPolicyEvaluator(PLANT, K, TAU, ln=0., nb_decisions=30)
+    expected = monte_carlo_value(states, LinearPolicy(K, TAU), PLANT, nb_decisions=30, ln=0., clip=None)
+    assert_allclose(evaluator.value(states), expected, rtol=1e-8, atol=1e-8)
+
+
+def test_infinite_horizon_is_the_limit():
+    K = _lqr_gain()
+    states = state_grid(-2., 2., 5)
+    finite = LinearPolicyEvaluator(PLANT, K, TAU, nb_decisions=400)
+    infinite = LinearPolicyEvaluator(PLANT, K, TAU)
+    assert_allclose(infinite.value(states), finite.value(states), rtol=1e-6)
+
+
+def test_q_value_matches_monte_carlo_without_noise():
+    K = _lqr_gain()
+    rng = np.random.RandomState(0)
+    states = rng.uniform(-2., 2., size=(8, 2))
+    first_actions = np.stack([rng.uniform(-3., 3., size=8), rng.choice([.05, .2, .37], size=8)], axis=1)
+    evaluator = LinearPolicyEvaluator(PLANT, K, TAU, ln=0., nb_decisions=20)
+
+    policy = LinearPolicy(K, TAU)
+    calls = []
+
+    def first_then_policy(x):
+        calls.append(None)
+        return first_actions if len(calls) == 1 else policy(x)
+
+    # The policy's horizon plus the decision given to `q_value`.
+    expected = monte_carlo_value(states, first_then_policy, PLANT, nb_decisions=21, ln=0., clip=None)
+    assert_allclose(evaluator.q_value(states, first_actions), expected, rtol=1e-8, atol=1e-8)
+
+
+def test_value_matches_monte_carlo_with_noise():
+    K = _lqr_gain()
+    state = np.array([[1., -.5]])
+    nb_episodes = 2000
+    evaluator = LinearPolicyEvaluator(PLANT, K, TAU, ln=1., nb_decisions=20)
+    returns = monte_carlo_value(np.repeat(state, nb_episodes, axis=0), LinearPolicy(K, TAU), PLANT,
+                                nb_decisions=20, ln=1., clip=None, random_state=np.random.RandomState(1))
+    stderr = returns.std() / np.sqrt(nb_episodes)
+    assert abs(returns.mean() - evaluator.value(state)[0]) < 4. * stderr
@@ -0,0 +1,105 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+import scipy.integrate
+import scipy.linalg
+from numpy.testing import assert_allclose
+
+from rl2.integration import QuadraticIntervalCost
+
+# The matrices of `gym2.envs.classic_control.LinearEnv`.
+A = np.array([[-1., 4.], [2., -3.]])
+B = np.array([2., 4.])
+G = np.array([.6, .3])
+
+
+def _trajectory(x, u, ts):
+    # Exact zero-order hold solution on the grid `ts`.
+    Az = np.zeros((3, 3))
+    Az[:2, :2] = A
+    Az[:2, 2] = B
+    z = np.append(x, u)
+    return np.array([np.dot(scipy.linalg.expm(Az * t), z)[:2] for t in ts])
+
+
+def _quadrature(values, ts):
+    return scipy.integrate.simpson(values, x=ts, axis=0)
+
+
+@pytest.mark.parametrize('alpha', [0., .7])
+@pytest.mark.parametrize('tau', [.01, .3, 1.5])
+def test_cost_matches_quadrature(alpha, tau):
+    interval_cost = QuadraticIntervalCost(A, B, .1, .01, alpha=alpha)
+    rng = np.random.RandomState(0)
+    states = rng.uniform(-3., 3., size=(4, 2))
+    actions = rng.uniform(-5., 5., size=4)
+    ts = np.linspace(0., tau, 2001)
+    expected = []
+    for x, u in zip(states, actions):
+        xs = _trajectory(x, u, ts)
+        running = .1 * np.sum(xs ** 2, axis=1) + .01 * u ** 2
+        expected.append(_quadrature(np.exp(-alpha * ts) * running, ts))
+    assert_allclose(interval_cost.cost(states, actions, tau), expected, rtol=1e-8)
+    assert_allclose(interval_cost.transition(states, actions, tau),
+                    [_trajectory(x, u, [tau])[0] for x, u in zip(states, actions)], rtol=1e-10)
+
+
+@pytest.mark.parametrize('alpha', [0., .7])
+def test_noise_terms_match_quadrature(alpha):
+    tau = .4
+    interval_cost = QuadraticIntervalCost(A, B, .1, .01, alpha=alpha, G=G)
+    _, c, _, Sigma = interval_cost.interval(tau)
+
+    # Sigma(t) = int_0^t exp(A s) G G^T exp(A^T s) ds
+    ss = np.linspace(0., tau, 2001)
+    integrand = np.array([np.dot(np.dot(scipy.linalg.expm(A * s), np.outer(G, G)), scipy.linalg.expm(A * s).T)
+                          for s in ss])
+    sigmas = scipy.integrate.cumulative_trapezoid(integrand, x=ss, axis=0, initial=0.)
+    assert_allclose(Sigma, sigmas[-1], rtol=1e-5)
+    traces = .1 * np.trace(sigmas, axis1=1, axis2=2)
+    assert_allclose(c, _quadrature(np.exp(-alpha * ss) * traces, ss), rtol=1e-4)
+
+
+def test_noisy_transition_has_the_interval_moments():
+    interval_cost = QuadraticIntervalCost(A, B, G=G)
+    _, _, _, Sigma = interval_cost.interval(.5)
+    x, u = np.array([1., -2.]), 3.
+    mean = interval_cost.transition(x, [u], .5)[0]
+    samples = interval_cost.transition(np.tile(x, (40000, 1)), np.full(40000, u), .5,
+                                       random_state=np.random.RandomState(0))
+    assert_allclose(samples.mean(axis=0), mean, atol=3e-2)
+    assert_allclose(np.cov(samples.T), Sigma, atol=3e-2)
+
+
+def test_intervals_are_cached_per_quantized_tau():
+    interval_cost = QuadraticIntervalCost(A, B, resolution=1e-3, max_cache_size=3)
+    assert interval_cost.interval(.2) is interval_cost.interval(.2002)
+    assert interval_cost.interval(.2) is not interval_cost.interval(.201)
+    interval_cost.interval(.3)
+    assert len(interval_cost._cache) == 3
+    interval_cost.interval(.4)
+    assert len(interval_cost._cache) == 1
+
+    # A batch with mixed lengths matches one call per interval.
+    states = np.random.RandomState(1).randn(6, 2)
+    actions = np.arange(6.)
+    taus = np.array([.1, .2, .1, .3, .2, .1])
+    expected = [interval_cost.cost(x[None], [u], tau)[0] for x, u, tau in zip(states, actions, taus)]
+    assert_allclose(interval_cost.cost(states, actions, taus), expected)
+
+
+def test_linear_env_step_interval_matches_fine_substeps():
+    from gym2.envs.classic_control.linear_system import LinearEnv
+
+    env = LinearEnv()
+    x0 = np.array([1.5, -2.])
+    u, tau, dt = np.array([2.]), .3, 1e-4
+    env.set_state(x0.copy())
+    observation, reward, done, _ = env.step_interval(u, tau, ln=0)
+
+    env.set_state(x0.copy())
+    rewards = [env.step(u, dt, tau, ln=0)[1] for _ in range(int(round(tau / dt)))]
+    assert_allclose(observation, env.state, rtol=1e-3)
+    assert_allclose(reward, np.sum(rewards) * dt, rtol=1e-3)
+    assert not done
@@ -0,0 +1,60 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+pytest.importorskip('tensorflow')
+
+import keras2.backend as K  # noqa: E402
+from keras2.layers import Dense, Flatten, Input  # noqa: E402
+from keras2.models import Model  # noqa: E402
+
+import rl2.barrier_certificate as bc  # noqa: E402
+from rl2.layers import CBFProjection, append_cbf_projection  # noqa: E402
+
+
+def _away_from_switches(x, u, clipper, pure):
+    """Rows whose result does not flip between float32 and float64 evaluation."""
+    rmin, rmax = bc._u_of_x_batch(x, clipper)
+    hx = bc.h(x.T)
+    keep = (np.abs(u - rmin) > 1e-3) & (np.abs(u - rmax) > 1e-3) & (np.abs(x[:, 1]) > 1e-3)
+    if not pure:
+        keep &= np.abs(hx - 1e-1) > 1e-3
+    return keep
+
+
+@pytest.mark.parametrize('pure', [False, True])
+def test_cbf_projection_matches_u_cbf_batch(pure):
+    rng = np.random.RandomState(0)
+    x = rng.uniform(-1.2, 1.2, size=(2000, 2)).astype(np.float32).astype(np.float64)
+    tau = rng.uniform(.01, 1., size=2000)
+    u = rng.uniform(-20., 20., size=2000).astype(np.float32).astype(np.float64)
+    keep = _away_from_switches(x, u, 10., pure)
+    x, u, tau = x[keep], u[keep], tau[keep]
+
+    observation = Input(shape=(1, 2))
+    action = Input(shape=(2,))
+    projected = CBFProjection(clipper=10., pure=pure)([observation, action])
+    project = K.function([observation, action], [projected])
+    result = project([x[:, None], np.stack([u, tau], axis=1)])[0]
+
+    expected, _, _ = bc.u_cbf_batch(x, u, 10., pure=pure)
+    assert_allclose(result[:, 0], expected, rtol=1e-4, atol=1e-4)
+    # `tau` passes through.
+    assert_allclose(result[:, 1], tau, rtol=1e-6)
+
+
+def test_append_cbf_projection_shares_the_actor_weights():
+    observation = Input(shape=(1, 2))
+    actor = Model(inputs=observation, outputs=Dense(2)(Flatten()(observation)))
+    safe_actor = append_cbf_projection(actor, clipper=4.)
+    assert safe_actor.trainable_weights == actor.trainable_weights
+
+    states = np.random.RandomState(0).uniform(-1., 1., size=(64, 1, 2))
+    actions = actor.predict_on_batch(states)
+    safe_actions = safe_actor.predict_on_batch(states)
+    keep = _away_from_switches(states[:, 0], actions[:, 0].astype(np.float64), 4., False)
+    expected, _, _ = bc.u_cbf_batch(states[keep, 0], actions[keep, 0], 4.)
+    assert_allclose(safe_actions[keep, 0], expected, rtol=1e-4, atol=1e-4)
+    assert_allclose(safe_actions[:, 1], actions[:, 1])
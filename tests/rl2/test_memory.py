@@ -0,0 +1,161 @@
+from __future__ import division
+import multiprocessing as mp
+import random
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+from rl2.memory import (
+    CompactSequentialMemory,
+    SequentialMemory,
+    SharedSequentialMemory,
+    TIME_COLUMNS,
+)
+
+
+def _transitions(nb_steps, seed=0):
+    # Values that are exact in float32, episodes of varying length.
+    rng = np.random.RandomState(seed)
+    observations = rng.randint(-50, 50, size=(nb_steps, 2)).astype('float64')
+    actions = rng.randint(-20, 20, size=(nb_steps, 2)).astype('float64') / 4.
+    rewards = rng.randint(-100, 0, size=nb_steps).astype('float64') / 8.
+    terminals = rng.rand(nb_steps) < .15
+    taus = rng.randint(1, 40, size=nb_steps).astype('float64') / 32.
+    return observations, actions, rewards, terminals, taus
+
+
+def _fill(memory, nb_steps, seed=0):
+    for observation, action, reward, terminal, tau in zip(*_transitions(nb_steps, seed)):
+        columns = {'tau': tau, 'episode_time': 2 * tau, 'discount': tau / 2} if memory.columns else {}
+        memory.append(observation, action, reward, terminal, **columns)
+
+
+def _stack(experiences):
+    return (np.array([e.state0 for e in experiences]), np.array([e.action for e in experiences]),
+            np.array([e.reward for e in experiences]), np.array([e.state1 for e in experiences]),
+            np.array([0. if e.terminal1 else 1. for e in experiences]))
+
+
+def _valid_idxs(memory):
+    # Indexes whose transition does not start right after a reset, i.e. that are not resampled.
+    idxs = np.arange(memory.window_length, memory.nb_entries - 1)
+    if hasattr(memory, '_terminal'):
+        return idxs[~memory._terminal(idxs - 1)]
+    return np.array([idx for idx in idxs if not memory.terminals[idx - 1]])
+
+
+@pytest.mark.parametrize('window_length', [1, 3])
+@pytest.mark.parametrize('ignore_episode_boundaries', [False, True])
+@pytest.mark.parametrize('limit', [1000, 150])
+def test_compact_memory_matches_sequential(window_length, ignore_episode_boundaries, limit):
+    kwargs = {'window_length': window_length, 'ignore_episode_boundaries': ignore_episode_boundaries,
+              'columns': TIME_COLUMNS}
+    memory = SequentialMemory(limit, **kwargs)
+    compact = CompactSequentialMemory(limit, **kwargs)
+    _fill(memory, 400)
+    _fill(compact, 400)
+    assert compact.nb_entries == memory.nb_entries
+
+    idxs = _valid_idxs(memory)
+    experiences, columns = memory.sample_columns(len(idxs), idxs)
+    expected = _stack(experiences)
+    arrays = compact.sample_arrays(len(idxs), idxs, columns=True)
+    for actual, desired in zip(arrays[:5], expected):
+        assert_allclose(actual, desired)
+    for name in TIME_COLUMNS:
+        assert_allclose(arrays[5][name], columns[name])
+
+    # The list interface of the compact memory returns the same experiences.
+    for actual, desired in zip(_stack(compact.sample(len(idxs), idxs)), expected):
+        assert_allclose(actual, desired)
+
+
+def test_compact_memory_fixed_point_storage():
+    memory = SequentialMemory(500, window_length=2)
+    compact = CompactSequentialMemory(500, window_length=2, observation_dtype='int16', observation_scale=.25,
+                                      action_dtype='float16')
+    _fill(memory, 300)
+    _fill(compact, 300)
+    idxs = _valid_idxs(memory)
+    for actual, desired in zip(compact.sample_arrays(len(idxs), idxs), _stack(memory.sample(len(idxs), idxs))):
+        assert_allclose(actual, desired)
+
+
+def test_compact_memory_never_samples_restarts():
+    compact = CompactSequentialMemory(1000, window_length=2)
+    _fill(compact, 300)
+    for _ in range(20):
+        idxs = compact._sample_idxs(64, None)
+        assert np.all(idxs >= compact.window_length + 1)
+        assert np.all(idxs < compact.nb_entries)
+        assert not np.any(compact._terminal(idxs - 2))
+
+
+def test_shared_memory_matches_compact():
+    kwargs = {'window_length': 2, 'columns': TIME_COLUMNS}
+    compact = CompactSequentialMemory(1000, **kwargs)
+    shared = SharedSequentialMemory(1000, observation_shape=(2,), action_shape=(2,), **kwargs)
+    _fill(compact, 400)
+    _fill(shared, 400)
+    assert shared.nb_entries == compact.nb_entries
+    for seed in range(5):
+        random.seed(seed)
+        np.random.seed(seed)
+        expected = compact.sample_arrays(32, columns=True)
+        random.seed(seed)
+        np.random.seed(seed)
+        actual = shared.sample_arrays(32, columns=True)
+        for a, e in zip(actual[:5], expected[:5]):
+            assert_allclose(a, e)
+        for name in TIME_COLUMNS:
+            assert_allclose(actual[5][name], expected[5][name])
+
+
+def _write_segment(memory, i, seed):
+    _fill(memory.writer(i), 200, seed)
+
+
+def test_shared_memory_sees_other_processes():
+    shared = SharedSequentialMemory(1000, observation_shape=(2,), action_shape=(2,), nb_writers=2,
+                                    window_length=1)
+    process = mp.get_context('fork').Process(target=_write_segment, args=(shared, 1, 1))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    _fill(shared, 200, 0)
+    assert shared.nb_entries == 400
+
+    # Segment 1 holds exactly what a compact memory holds after the same appends.
+    compact = CompactSequentialMemory(500, window_length=1)
+    _fill(compact, 200, 1)
+    shared._snapshot()
+    reader = shared.readers[1]
+    idxs = _valid_idxs(compact)
+    for actual, desired in zip(reader.sample_arrays(len(idxs), idxs), compact.sample_arrays(len(idxs), idxs)):
+        assert_allclose(actual, desired)
+    state0, action, reward, state1, terminal1 = shared.sample_arrays(64)
+    assert state0.shape == (64, 1, 2)
+    assert action.shape == (64, 2)
+
+
+@pytest.mark.parametrize('memory_class', [SequentialMemory, CompactSequentialMemory])
+@pytest.mark.parametrize('window_length', [1, 2, 4])
+@pytest.mark.parametrize('ignore_episode_boundaries', [False, True])
+def test_get_recent_state_batch_matches_get_recent_state(memory_class, window_length, ignore_episode_boundaries):
+    memory = memory_class(100, window_length=window_length, ignore_episode_boundaries=ignore_episode_boundaries)
+    observations, actions, rewards, terminals, _ = _transitions(120)
+    observation = observations[0]
+    for i in range(1, len(observations)):
+        batch = memory.get_recent_state_batch(observation)
+        assert batch.shape == (1, window_length, 2)
+        assert_array_equal(batch[0], np.array(memory.get_recent_state(observation)))
+        memory.append(observation, actions[i], rewards[i], terminals[i], training=i % 7 != 0)
+        observation = observations[i]
+
+
+def test_get_recent_state_batch_falls_back_for_other_observations():
+    memory = SequentialMemory(100, window_length=3)
+    for i in range(5):
+        memory.append([float(i), float(-i)], 0., 0., False)
+    assert_array_equal(memory.get_recent_state_batch([9., 9.])[0], np.array(memory.get_recent_state([9., 9.])))
@@ -0,0 +1,103 @@
+from __future__ import division
+
+from collections import namedtuple
+import os
+
+import numpy as np
+import scipy.linalg
+from numpy.testing import assert_allclose, assert_array_equal
+
+from rl2.evaluation import INPUT_COST, STATE_COST, LinearPolicyEvaluator, state_grid
+from rl2.montecarlo import LinearPolicy, MonteCarloEstimator, policy_fingerprint
+
+# The matrices of `gym2.envs.classic_control.LinearEnv`.
+Plant = namedtuple('Plant', ['A', 'B', 'D'])
+PLANT = Plant(A=np.array([[-1., 4.], [2., -3.]]), B=np.array([2., 4.]), D=np.array([.6, .3]))
+TAU = .2
+
+
+def _lqr_gain():
+    # A larger input weight than the env's keeps the gain stable when held for `TAU`.
+    B = PLANT.B[:, None]
+    R = np.array([[10. * INPUT_COST]])
+    P = scipy.linalg.solve_continuous_are(PLANT.A, B, STATE_COST * np.eye(2), R)
+    return -np.linalg.solve(R, np.dot(B.T, P)).reshape(-1)
+
+
+class _CountingPolicy(LinearPolicy):
+    def __init__(self, K, tau):
+        super(_CountingPolicy, self).__init__(K, tau)
+        self.nb_calls = 0
+
+    def __call__(self, states):
+        self.nb_calls += 1
+        return super(_CountingPolicy, self).__call__(states)
+
+    def fingerprint(self):
+        return policy_fingerprint(LinearPolicy(self.K, self.tau))
+
+
+def test_value_matches_evaluator_without_noise():
+    K = _lqr_gain()
+    states = state_grid(-2., 2., 5)
+    estimator = MonteCarloEstimator(PLANT, ln=0., nb_decisions=30, max_episodes=2, batch_episodes=2)
+    mean, stderr, nb_episodes = estimator.value(LinearPolicy(K, TAU), states)
+    expected = LinearPolicyEvaluator(PLANT, K, TAU, ln=0., nb_decisions=30).value(states)
+    assert_allclose(mean, expected, rtol=1e-8, atol=1e-8)
+    assert_allclose(stderr, 0., atol=1e-8)
+    assert_array_equal(nb_episodes, 2)
+
+
+def test_q_value_matches_evaluator_without_noise():
+    K = _lqr_gain()
+    rng = np.random.RandomState(0)
+    states = rng.uniform(-2., 2., size=(8, 2))
+    first_actions = np.stack([rng.uniform(-3., 3., size=8), rng.choice([.05, .2, .37], size=8)], axis=1)
+    # The evaluator's horizon does not count the decision given to `q_value`.
+    estimator = MonteCarloEstimator(PLANT, ln=0., nb_decisions=21, max_episodes=1)
+    mean, _, _ = estimator.q_value(LinearPolicy(K, TAU), states, first_actions)
+    expected = LinearPolicyEvaluator(PLANT, K, TAU, ln=0., nb_decisions=20).q_value(states, first_actions)
+    assert_allclose(mean, expected, rtol=1e-8, atol=1e-8)
+
+
+def test_value_with_noise_stops_at_tol():
+    K = _lqr_gain()
+    states = np.array([[1., -.5], [-1.5, .5]])
+    estimator = MonteCarloEstimator(PLANT, ln=1., nb_decisions=20, max_episodes=4000, batch_episodes=100,
+                                    tol=.02)
+    mean, stderr, nb_episodes = estimator.value(LinearPolicy(K, TAU), states)
+    assert np.all(stderr < .02)
+    assert np.all(nb_episodes < 4000)
+    expected = LinearPolicyEvaluator(PLANT, K, TAU, ln=1., nb_decisions=20).value(states)
+    assert np.all(np.abs(mean - expected) < 4. * stderr)
+
+
+def test_results_do_not_depend_on_workers():
+    K = _lqr_gain()
+    states = state_grid(-2., 2., 3)
+    kwargs = {'ln': 1., 'nb_decisions': 10, 'max_episodes': 16, 'chunk_size': 4}
+    serial = MonteCarloEstimator(PLANT, nb_workers=0, **kwargs).value(LinearPolicy(K, TAU), states)
+    parallel = MonteCarloEstimator(PLANT, nb_workers=2, **kwargs).value(LinearPolicy(K, TAU), states)
+    for a, b in zip(parallel, serial):
+        assert_allclose(a, b)
+
+
+def test_results_are_cached(tmpdir):
+    K = _lqr_gain()
+    states = state_grid(-2., 2., 3)
+    estimator = MonteCarloEstimator(PLANT, ln=1., nb_decisions=10, max_episodes=8, cache_dir=str(tmpdir))
+    policy = _CountingPolicy(K, TAU)
+    first = estimator.value(policy, states)
+    nb_calls = policy.nb_calls
+    assert nb_calls > 0
+    second = estimator.value(policy, states)
+    assert policy.nb_calls == nb_calls
+    for a, b in zip(second, first):
+        assert_array_equal(a, b)
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    # Other rows, Q instead of V or another gain are new entries.
+    estimator.value(policy, states[:4])
+    estimator.q_value(policy, states, policy(states))
+    estimator.value(_CountingPolicy(.5 * K, TAU), states)
+    assert len(os.listdir(str(tmpdir))) == 4
@@ -0,0 +1,118 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+pytest.importorskip('tensorflow')
+
+from rl2.offline import OfflineCriticTrainer  # noqa: E402
+
+
+class _RecordingCritic(object):
+    """Critic whose value is a fixed function of its inputs; `fit` only records the call."""
+    input = ['first_input', 'second_input']
+
+    def __init__(self, action_idx=0):
+        self.action_idx = action_idx
+        self.fits = []
+
+    def _split(self, inputs):
+        if isinstance(inputs, list):
+            return inputs[1 - self.action_idx], inputs[self.action_idx]
+        return inputs, None
+
+    def value(self, state, action=None):
+        v = np.sum(state.reshape(len(state), -1), axis=1)
+        if action is not None:
+            v = v + 2. * action[:, 0]
+        return v
+
+    def predict(self, inputs, batch_size=32):
+        state, action = self._split(inputs)
+        return self.value(state, action)[:, None]
+
+    def fit(self, inputs, targets, batch_size=32, epochs=1, shuffle=True, verbose=0, callbacks=None):
+        self.fits.append((inputs, targets))
+        for i in range(0, len(targets), batch_size):
+            for callback in callbacks:
+                callback.on_batch_end(i // batch_size, {'loss': float(i)})
+
+
+def _dataset(nb_transitions=40, seed=0):
+    rng = np.random.RandomState(seed)
+    state0 = rng.randn(nb_transitions, 2)
+    action = np.stack([rng.randn(nb_transitions), rng.uniform(.05, .5, nb_transitions)], axis=1)
+    reward = rng.randn(nb_transitions)
+    state1 = rng.randn(nb_transitions, 2)
+    terminal1 = (rng.rand(nb_transitions) > .2).astype('float64')
+    return state0, action, reward, state1, terminal1
+
+
+def test_state_value_targets_and_rounds():
+    state0, action, reward, state1, terminal1 = _dataset()
+    critic = _RecordingCritic()
+    trainer = OfflineCriticTrainer(critic, alpha=.4, batch_size=8, target_model_update=5)
+    history = trainer.fit(state0, action, reward, state1, terminal1, nb_steps=12)
+
+    # Rounds of 5, 5 and 2 minibatches.
+    assert [len(targets) for _, targets in critic.fits] == [40, 40, 16]
+    assert len(history['loss']) == 12
+    assert len(history['td_loss']) == 3
+
+    expected = reward + terminal1 * np.exp(-.4 * action[:, 1]) * critic.value(state1[:, None])
+    rows = []
+    for inputs, targets in critic.fits:
+        assert inputs.shape[1:] == (1, 2)
+        # Each input is a row of `state0`, paired with the target of that row.
+        idxs = [int(np.nonzero(np.all(state0 == x[0], axis=1))[0][0]) for x in inputs]
+        assert_allclose(targets[:, 0], expected[idxs])
+        rows.extend(idxs)
+    # The first 40 rows are one permutation of the dataset.
+    assert sorted(rows[:40]) == list(range(40))
+    td = np.mean((expected - critic.value(state0[:, None])) ** 2)
+    assert_allclose(history['td_loss'], td)
+
+
+@pytest.mark.parametrize('action_idx', [0, 1])
+def test_q_value_targets_use_the_actor(action_idx):
+    state0, action, reward, state1, terminal1 = _dataset()
+    critic = _RecordingCritic(action_idx)
+
+    def actor(states):
+        return np.stack([-states[:, 0, 0], np.full(len(states), .2)], axis=1)
+
+    trainer = OfflineCriticTrainer(critic, actor=actor, critic_action_input=critic.input[action_idx],
+                                   batch_size=40, target_model_update=1)
+    trainer.fit(state0, action, reward, state1, nb_steps=1)
+
+    inputs, targets = critic.fits[0]
+    state, taken = critic._split(inputs)
+    order = [int(np.nonzero(np.all(state0 == x[0], axis=1))[0][0]) for x in state]
+    assert_array_equal(taken, action[order])
+    next_value = critic.value(state1[:, None], actor(state1[:, None]))
+    expected = reward + np.exp(-.4 * action[:, 1]) * next_value
+    assert_allclose(targets[:, 0], expected[order])
+
+
+def test_keras_critic_converges_to_constant_value():
+    from keras2.layers import Dense, Flatten
+    from keras2.models import Sequential
+    from keras2.optimizers import Adam
+
+    critic = Sequential()
+    critic.add(Flatten(input_shape=(1, 2)))
+    critic.add(Dense(1))
+    critic.compile(optimizer=Adam(lr=.05), loss='mse')
+
+    # Every transition earns 1 and is discounted by exp(-.4 * .5), whatever the state.
+    rng = np.random.RandomState(0)
+    state0 = rng.uniform(-1., 1., size=(256, 2))
+    action = np.stack([np.zeros(256), np.full(256, .5)], axis=1)
+    np.random.seed(0)
+    trainer = OfflineCriticTrainer(critic, alpha=.4, batch_size=32, target_model_update=100)
+    history = trainer.fit(state0, action, np.ones(256), rng.uniform(-1., 1., size=(256, 2)), nb_steps=4000)
+
+    expected = 1. / (1. - np.exp(-.4 * .5))
+    assert_allclose(critic.predict(state0[:, None]).reshape(-1), expected, rtol=.05)
+    assert history['td_loss'][-1] < history['td_loss'][0]
@@ -0,0 +1,110 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+pytest.importorskip('tensorflow')
+
+from rl2.memory import CompactSequentialMemory, SequentialMemory, TIME_COLUMNS  # noqa: E402
+from rl2.prefetch import PrefetchingMemory, sample_batch, stop_prefetching  # noqa: E402
+
+
+class _RecordingTimer(object):
+    def __init__(self):
+        self.phases = []
+
+    def start(self):
+        return 0.
+
+    def stop(self, phase, start):
+        self.phases.append(phase)
+
+
+class _Agent(object):
+    def __init__(self, memory, batch_size=16):
+        self.memory = memory
+        self.batch_size = batch_size
+        self.timer = _RecordingTimer()
+
+    def process_state_batch(self, batch):
+        return np.array(batch)
+
+
+def _fill(memory, nb_steps=200):
+    # The action and reward of step `i` are derived from its observation, no terminals.
+    for i in range(nb_steps):
+        columns = {'tau': i / 8., 'episode_time': i / 4., 'discount': i / 16.} if memory.columns else {}
+        memory.append(np.array([i, -i], dtype='float64'), np.array([i / 2.]), i / 4., False, **columns)
+
+
+def _check_batch(batch, batch_size, window_length):
+    state0, action, reward, state1, terminal1 = batch[:5]
+    assert state0.shape == (batch_size, window_length, 2)
+    assert state1.shape == (batch_size, window_length, 2)
+    last = state0[:, -1, 0]
+    assert_allclose(action[:, 0], last / 2.)
+    assert_allclose(reward, last / 4.)
+    assert_allclose(state1[:, -1, 0], last + 1.)
+    assert_allclose(terminal1, 1.)
+    return last
+
+
+@pytest.mark.parametrize('memory_class', [SequentialMemory, CompactSequentialMemory])
+@pytest.mark.parametrize('window_length', [1, 2])
+def test_prefetched_batches_are_consistent(memory_class, window_length):
+    memory = PrefetchingMemory(memory_class(limit=1000, window_length=window_length))
+    _fill(memory)
+    agent = _Agent(memory)
+    try:
+        for _ in range(5):
+            _check_batch(sample_batch(agent), agent.batch_size, window_length)
+        assert memory.enqueuer is not None
+    finally:
+        stop_prefetching(agent)
+    assert memory.enqueuer is None
+    assert agent.timer.phases == ['memory.sample'] * 5
+
+
+@pytest.mark.parametrize('memory_class', [SequentialMemory, CompactSequentialMemory])
+def test_prefetched_columns_match_transitions(memory_class):
+    memory = PrefetchingMemory(memory_class(limit=1000, window_length=1, columns=TIME_COLUMNS))
+    _fill(memory)
+    agent = _Agent(memory)
+    try:
+        batch = sample_batch(agent, columns=True)
+    finally:
+        stop_prefetching(agent)
+    last = _check_batch(batch, agent.batch_size, 1)
+    assert_allclose(batch[5]['tau'], last / 8.)
+    assert_allclose(batch[5]['discount'], last / 16.)
+
+
+def test_get_batch_restarts_for_another_batch_size():
+    memory = PrefetchingMemory(SequentialMemory(limit=1000, window_length=1))
+    _fill(memory)
+    agent = _Agent(memory)
+    try:
+        assert sample_batch(agent)[0].shape[0] == 16
+        agent.batch_size = 4
+        assert sample_batch(agent)[0].shape[0] == 4
+    finally:
+        memory.stop()
+
+
+def test_wrapper_delegates_to_memory():
+    inner = SequentialMemory(limit=1000, window_length=3)
+    memory = PrefetchingMemory(inner, max_queue_size=5)
+    _fill(memory, nb_steps=10)
+    assert memory.nb_entries == inner.nb_entries == 10
+    assert memory.window_length == 3
+    assert memory.get_config()['max_queue_size'] == 5
+    assert len(memory.get_recent_state(np.zeros(2))) == 3
+
+
+def test_sample_batch_without_prefetching_reports_to_timer():
+    memory = SequentialMemory(limit=1000, window_length=1)
+    _fill(memory)
+    agent = _Agent(memory)
+    _check_batch(sample_batch(agent), agent.batch_size, 1)
+    assert agent.timer.phases == ['memory.sample']
@@ -0,0 +1,57 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+from rl2.random import NoiseBank, OrnsteinUhlenbeckProcess
+
+
+@pytest.mark.parametrize('block_size', [1, 3, 1024])
+def test_noise_bank_white_noise_uses_blocks_of_draws(block_size):
+    bank = NoiseBank(4, 2, mu=[0., 1.], sigma=[.5, 2.], block_size=block_size, seed=0)
+    rng = np.random.RandomState(0)
+    rng.standard_normal((4, 2))  # initial `reset_states`
+    z = []
+    while len(z) < 7:
+        z.extend(rng.standard_normal((block_size, 4, 2)))
+    for i in range(7):
+        x = bank.sample()
+        assert x.shape == (4, 2)
+        assert_allclose(x, np.array([0., 1.]) + np.array([.5, 2.]) * z[i])
+
+
+@pytest.mark.parametrize('sigma_min', [None, .1])
+def test_noise_bank_matches_ornstein_uhlenbeck_process(sigma_min):
+    # One process drawing one step at a time consumes the global generator like the original.
+    kwargs = {'theta': .15, 'mu': .3, 'sigma': .8, 'sigma_min': sigma_min, 'n_steps_annealing': 50, 'dt': .05}
+    np.random.seed(3)
+    process = OrnsteinUhlenbeckProcess(size=2, **kwargs)
+    expected = [process.sample() for _ in range(100)]
+    np.random.seed(3)
+    bank = NoiseBank(1, 2, block_size=1, **kwargs)
+    actual = [bank.sample()[0] for _ in range(100)]
+    assert_allclose(actual, expected)
+
+
+def test_noise_bank_anneals_sigma():
+    bank = NoiseBank(1, 2, sigma=[1., 2.], sigma_min=[.5, .5], n_steps_annealing=10, seed=0)
+    assert_allclose(bank.current_sigma, [1., 2.])
+    for _ in range(5):
+        bank.sample()
+    assert_allclose(bank.current_sigma, [.75, 1.25])
+    for _ in range(10):
+        bank.sample()
+    assert_allclose(bank.current_sigma, [.5, .5])
+
+
+def test_noise_bank_resets_only_given_processes():
+    bank = NoiseBank(3, 2, theta=.5, seed=0)
+    for _ in range(5):
+        bank.sample()
+    before = bank.x_prev.copy()
+    bank.reset_states([1])
+    assert_array_equal(bank.x_prev[[0, 2]], before[[0, 2]])
+    assert not np.any(bank.x_prev[1] == before[1])
+    bank.reset_states()
+    assert not np.any(bank.x_prev == before)
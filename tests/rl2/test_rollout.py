@@ -0,0 +1,343 @@
+from __future__ import division
+
+from copy import deepcopy
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+
+import rl2.barrier_certificate as bc  # noqa: E402
+from rl2.callbacks import Callback, PhaseProfiler, PhaseTimer  # noqa: E402
+from rl2.rollout import (  # noqa: E402
+    CBFSafetyFilter,
+    CommunicationPenalty,
+    EventTrigger,
+    IntervalPenalty,
+    RolloutEngine,
+    SelfTrigger,
+    TauReward,
+)
+from rl2.triggers import AbsoluteThreshold  # noqa: E402
+
+
+class _LinearPlant(object):
+    """Deterministic linear plant, stepped with `step(u)` or `step(u, dt, tau)`."""
+    A = np.array([[-1., 4.], [2., -3.]])
+    B = np.array([2., 4.])
+
+    def __init__(self):
+        self.state = None
+
+    def reset(self):
+        self.state = np.random.uniform(-1., 1., size=2)
+        return self.state.copy()
+
+    def step(self, u, dt=.05, tau=None):
+        x = self.state
+        reward = -(.1 * np.dot(x, x) + .01 * u[0]**2)
+        self.state = x + dt * (np.dot(self.A, x) + self.B * u[0])
+        done = bool(np.max(np.abs(self.state)) > 3.)
+        return self.state.copy(), reward, done, {}
+
+
+class _ScriptedAgent(object):
+    """Deterministic agent that logs every `forward` and `backward` call."""
+    timer = PhaseTimer()
+
+    def __init__(self, event=False, epsilon=.3):
+        self.event = event
+        self.epsilon = epsilon
+        self.compiled = True
+        self.training = False
+        self.processor = None
+        self.step = 0
+        self.recent_action = None
+        self.recent_observation = None
+        self.calls = []
+
+    def reset_states(self):
+        self.recent_action = None
+        self.recent_observation = None
+        self.calls.append(('reset',))
+
+    def _on_train_begin(self):
+        pass
+
+    def _on_train_end(self):
+        pass
+
+    def forward(self, observation):
+        observation = np.asarray(observation)
+        u = -np.dot([.5, .4], observation)
+        if self.event:
+            action = np.array([u, np.sin(7. * observation[0]), np.cos(5. * observation[1])])
+        else:
+            action = np.array([u, .05 + .4 * np.abs(np.tanh(observation[0] * observation[1]))])
+        self.recent_observation = observation
+        self.recent_action = action
+        self.calls.append(('forward', observation.copy()))
+        return action
+
+    def backward(self, reward, terminal=False):
+        start = self.timer.start()
+        self.calls.append(('backward', float(reward), bool(terminal)))
+        self.timer.stop('memory.append', start)
+        return []
+
+
+def _self_fit(agent, env, nb_steps, shape, episode_time):
+    # The loop of `self_Agent.fit` before it moved to `RolloutEngine`.
+    agent.step = 0
+    observation = None
+    while agent.step < nb_steps:
+        if observation is None:
+            agent.reset_states()
+            observation = deepcopy(env.reset())
+            accumulated_time = 0.
+        action_tau = agent.forward(observation)
+        action = np.array([action_tau[0]])
+        tau = action_tau[1]
+        action_repetition = int(np.ceil(20 * tau))
+        dt = tau / action_repetition
+        reward = np.float32(0)
+        done = False
+        for _ in range(action_repetition):
+            observation, r, done, info = env.step(action, dt, tau)
+            observation = deepcopy(observation)
+            reward += r
+            if done:
+                break
+        reward *= dt
+        reward = shape(reward, tau)
+        accumulated_time += tau
+        if accumulated_time > episode_time:
+            done = True
+        agent.backward(reward, terminal=done)
+        agent.step += 1
+        if done:
+            agent.forward(observation)
+            agent.backward(0., terminal=False)
+            observation = None
+
+
+def _event_fit(agent, env, nb_steps, lam, nb_max_episode_steps):
+    # The loop of `event_Agent.fit` before it moved to `RolloutEngine`.
+    agent.step = 0
+    observation = None
+    while agent.step < nb_steps:
+        if observation is None:
+            episode_step = 0
+            agent.reset_states()
+            observation = deepcopy(env.reset())
+        if episode_step == 0:
+            gama = 1
+            action = np.array([agent.forward(observation)[0]])
+        else:
+            explore = False
+            if np.random.rand() < agent.epsilon:
+                if np.random.binomial(2, 0.5, 1)[0] == 1:
+                    explore = True
+            gama = 0
+            action_with_decision = agent.recent_action
+            action = np.array([action_with_decision[0]])
+            action_candidate = agent.forward(observation)
+            if action_candidate[1] > action_candidate[2] or explore:
+                gama = 1
+                action_with_decision = action_candidate
+                action = np.array([action_candidate[0]])
+            agent.recent_action = action_with_decision
+        observation, r, done, info = env.step(action)
+        observation = deepcopy(observation)
+        reward = np.float32(0)
+        reward += r - lam * gama
+        if episode_step >= nb_max_episode_steps - 1:
+            done = True
+        agent.backward(reward, terminal=done)
+        episode_step += 1
+        agent.step += 1
+        if done:
+            agent.forward(observation)
+            agent.backward(0., terminal=False)
+            observation = None
+
+
+class _DecisionLog(Callback):
+    def __init__(self):
+        super(_DecisionLog, self).__init__()
+        self.communicated = []
+        self.actions = []
+
+    def on_step_end(self, step, logs={}):
+        self.communicated.append(logs['decision'].communicated)
+        self.actions.append(logs['decision'].action[0])
+
+
+def _assert_same_calls(calls, expected):
+    assert len(calls) == len(expected)
+    assert sum(call[0] == 'reset' for call in calls) > 2
+    for call, expected_call in zip(calls, expected):
+        assert call[0] == expected_call[0]
+        if call[0] == 'forward':
+            assert_array_equal(call[1], expected_call[1])
+        else:
+            assert call[1:] == expected_call[1:]
+
+
+@pytest.mark.parametrize('shaper, shape', [
+    (IntervalPenalty(.5), lambda reward, tau: reward - .5),
+    (TauReward(.5), lambda reward, tau: reward + .5 * tau),
+])
+def test_self_trigger_matches_self_agent_loop(shaper, shape):
+    expected = _ScriptedAgent()
+    np.random.seed(0)
+    _self_fit(expected, _LinearPlant(), 300, shape, episode_time=3.)
+
+    agent = _ScriptedAgent()
+    np.random.seed(0)
+    RolloutEngine(SelfTrigger(), shaper).fit(agent, _LinearPlant(), 300, verbose=0, episode_time=3.)
+
+    assert agent.step == expected.step
+    _assert_same_calls(agent.calls, expected.calls)
+
+
+def test_event_trigger_matches_event_agent_loop():
+    expected = _ScriptedAgent(event=True)
+    np.random.seed(0)
+    _event_fit(expected, _LinearPlant(), 300, lam=.1, nb_max_episode_steps=40)
+
+    agent = _ScriptedAgent(event=True)
+    log = _DecisionLog()
+    np.random.seed(0)
+    RolloutEngine(EventTrigger(), CommunicationPenalty(.1)).fit(
+        agent, _LinearPlant(), 300, callbacks=[log], verbose=0, nb_max_episode_steps=40)
+
+    assert agent.step == expected.step
+    _assert_same_calls(agent.calls, expected.calls)
+    # Both transmitting and holding steps were taken.
+    assert any(log.communicated) and not all(log.communicated)
+
+
+def test_event_trigger_condition_sets_heads_to_its_decision():
+    class _RecordingAgent(_ScriptedAgent):
+        # Records the action `backward` would store in the memory.
+        def backward(self, reward, terminal=False):
+            self.recorded.append(np.array(self.recent_action))
+            return super(_RecordingAgent, self).backward(reward, terminal)
+
+    agent = _RecordingAgent(event=True, epsilon=0.)
+    agent.recorded = []
+    log = _DecisionLog()
+    np.random.seed(0)
+    RolloutEngine(EventTrigger(condition=AbsoluteThreshold(.2)), CommunicationPenalty(.1)).fit(
+        agent, _LinearPlant(), 200, callbacks=[log], verbose=0, nb_max_episode_steps=40)
+
+    # Leave out the extra `backward` after every terminal step.
+    backwards = [call for call in agent.calls if call[0] == 'backward']
+    recorded = [action for i, action in enumerate(agent.recorded) if i == 0 or not backwards[i - 1][2]]
+    assert len(recorded) == len(log.communicated) == 200
+    assert any(log.communicated) and not all(log.communicated)
+    for action, communicated, u in zip(recorded, log.communicated, log.actions):
+        assert_array_equal(action, [u, 1., 0.] if communicated else [u, 0., 1.])
+    # The agent is only queried when the condition fires, and once more after terminal steps.
+    nb_done = sum(call[2] for call in backwards)
+    assert sum(call[0] == 'forward' for call in agent.calls) == sum(log.communicated) + nb_done
+
+
+def test_safety_filter_counts_corrections_like_safe_agent_loop():
+    filter_ = CBFSafetyFilter(clipper=10.)
+    rng = np.random.RandomState(0)
+    for _ in range(500):
+        x = rng.uniform(-1.2, 1.2, size=2)
+        candidate = np.array([rng.uniform(-20., 20.)])
+        filtered, active = filter_.apply(None, x, candidate)
+        expected = bc.u_cbf(x, candidate[0], 10.)
+        assert_array_equal(filtered, expected)
+        # `barrier = 0 if action == action_candidate else -1` in the original `safecore` loop,
+        # so candidates beyond the input bound count as corrected.
+        assert active == bool(np.any(expected != candidate))
+
+
+def test_step_counter_passes_int16_range():
+    agent = _ScriptedAgent()
+    np.random.seed(0)
+    RolloutEngine(SelfTrigger(substeps_per_unit=1), IntervalPenalty(.5)).fit(
+        agent, _LinearPlant(), 33000, verbose=0, episode_time=3.)
+    assert type(agent.step) is int
+    assert agent.step == 33000
+    assert sum(call[0] == 'backward' and call[2] for call in agent.calls) > 0
+
+
+@pytest.mark.parametrize('pure', [False, True])
+def test_safety_filter_batch_matches_apply(pure):
+    rng = np.random.RandomState(1)
+    states = rng.uniform(-1.2, 1.2, size=(300, 2))
+    candidates = rng.uniform(-20., 20., size=300)
+    filtered, active = CBFSafetyFilter(pure=pure, log=True).apply_batch(states, candidates, 10.)
+    single = CBFSafetyFilter(clipper=10., pure=pure, log=True)
+    for x, candidate, u, a in zip(states, candidates, filtered, active):
+        expected, expected_active = single.apply(None, x, np.array([candidate]))
+        assert_array_equal(u, expected[0])
+        assert a == expected_active
+
+
+def test_phase_profiler_collects_the_timer_hooks():
+    agent = _ScriptedAgent()
+    profiler = PhaseProfiler(trace_window=(0, 4), verbose=0)
+    np.random.seed(0)
+    RolloutEngine(SelfTrigger(), IntervalPenalty(.5)).fit(
+        agent, _LinearPlant(), 50, callbacks=[profiler], verbose=0, episode_time=1.)
+
+    summary = profiler.summary()
+    nb_done = sum(call[0] == 'backward' and call[2] for call in agent.calls)
+    assert nb_done > 0
+    assert summary['phases']['step']['count'] == 50
+    assert summary['phases']['env']['count'] == 50
+    # The extra forward/backward pair at the end of every episode is timed too.
+    assert summary['phases']['forward']['count'] == 50 + nb_done
+    assert summary['phases']['backward']['count'] == 50 + nb_done
+    # Hooks inside `backward` report to the same timer.
+    assert summary['phases']['memory.append']['count'] == 50 + nb_done
+    assert summary['substeps_per_decision'] >= 1.
+    assert {event['name'] for event in profiler.trace_events} >= {'step', 'forward', 'env', 'backward'}
+    # The agent is back to the no-op timer.
+    assert 'timer' not in agent.__dict__
+
+
+def test_phase_profiler_times_exact_intervals_as_env():
+    class _IntervalPlant(_LinearPlant):
+        taus = []
+
+        def step(self, u, dt=.05, tau=None):
+            raise AssertionError('exact intervals must not be substepped')
+
+        def step_interval(self, u, tau, ln=1, alpha=0.):
+            self.taus.append(tau)
+            return _LinearPlant.step(self, u, dt=tau)
+
+    agent = _ScriptedAgent()
+    env = _IntervalPlant()
+    profiler = PhaseProfiler(verbose=0)
+    np.random.seed(0)
+    RolloutEngine(SelfTrigger(), IntervalPenalty(.5), exact_intervals=True).fit(
+        agent, env, 50, callbacks=[profiler], verbose=0, episode_time=1.)
+
+    summary = profiler.summary()
+    assert len(env.taus) == 50
+    assert summary['phases']['env']['count'] == 50
+    assert summary['substeps_per_decision'] == 1.
+
+
+def test_phase_profiler_is_detached_when_the_loop_raises():
+    class _FailingPlant(_LinearPlant):
+        def step(self, u, dt=.05, tau=None):
+            raise RuntimeError('plant failure')
+
+    agent = _ScriptedAgent()
+    profiler = PhaseProfiler(verbose=0)
+    with pytest.raises(RuntimeError):
+        RolloutEngine(SelfTrigger()).fit(agent, _FailingPlant(), 10, callbacks=[profiler], verbose=0)
+    assert 'timer' not in agent.__dict__
+    assert type(agent.timer) is PhaseTimer
@@ -0,0 +1,117 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+from rl2.triggers import AbsoluteThreshold, EventTriggeredRuntime, ModelCondition, RelativeThreshold
+
+K = np.array([-.5, -.4])
+
+
+class _Plant(object):
+    """Deterministic linear plant, stepped with `step(u)` or `step(u, dt, tau)`."""
+    A = np.array([[-1., 4.], [2., -3.]])
+    B = np.array([2., 4.])
+
+    def __init__(self, x0, bound=3.):
+        self.x0 = np.asarray(x0, dtype=np.float64)
+        self.bound = bound
+        self.state = None
+
+    def reset(self):
+        self.state = self.x0.copy()
+        return self.state.copy()
+
+    def _get_obs(self):
+        return self.state.copy()
+
+    def step(self, u, dt=.05, tau=None):
+        x = self.state
+        reward = -(.1 * np.dot(x, x) + .01 * u[0] ** 2)
+        self.state = x + dt * (np.dot(self.A, x) + self.B * u[0])
+        return self.state.copy(), reward, bool(np.max(np.abs(self.state)) > self.bound), {}
+
+
+def _actor(states):
+    return np.stack([np.dot(states, K), np.zeros(len(states))], axis=1)
+
+
+def _reference_run(env, condition, nb_steps, lam, dt=None):
+    # One environment at a time, querying the actor on every event.
+    x = env.reset()
+    sent = x.copy()
+    u = None
+    reward, nb_events = 0., 0
+    for step in range(nb_steps):
+        if step == 0 or condition(x[None], sent[None])[0]:
+            u = np.dot(x, K)
+            sent = x.copy()
+            nb_events += 1
+            reward -= lam
+        x, r, done, _ = env.step(np.array([u])) if dt is None else env.step(np.array([u]), dt, dt)
+        reward += r
+        if done:
+            break
+    return reward, nb_events
+
+
+def test_absolute_threshold():
+    condition = AbsoluteThreshold(.5)
+    states = np.array([[0., 0.], [.3, .4], [.3, .41], [1., 0.]])
+    assert_array_equal(condition(states, np.zeros((4, 2))), [False, False, True, True])
+    assert_array_equal(AbsoluteThreshold(.5, ord=np.inf)(states, np.zeros((4, 2))), [False, False, False, True])
+
+
+def test_relative_threshold():
+    condition = RelativeThreshold(.1, eps=.01)
+    states = np.array([[1., 0.], [1., 0.], [10., 0.], [10., 0.]])
+    sent = np.array([[1.1, 0.], [1.12, 0.], [10.9, 0.], [11.2, 0.]])
+    assert_array_equal(condition(states, sent), [False, True, False, True])
+
+
+def test_model_condition_compares_heads():
+    class _Model(object):
+        def predict_on_batch(self, batch):
+            assert batch.shape == (3, 1, 2)
+            return np.stack([batch[:, 0, 0], batch[:, 0, 1]], axis=1)
+
+    states = np.array([[1., 0.], [0., 1.], [.5, .5]])
+    assert_array_equal(ModelCondition(_Model())(states, states), [True, False, False])
+
+
+@pytest.mark.parametrize('dt', [None, .02])
+def test_runtime_matches_per_env_loop(dt):
+    starts = [[1., -.5], [-2., 1.], [.2, .1], [2.5, 2.5]]
+    condition = RelativeThreshold(.2, eps=.05)
+    result = EventTriggeredRuntime(_actor, condition, lam=.1).run([_Plant(x0) for x0 in starts], 150, dt=dt)
+    for i, x0 in enumerate(starts):
+        reward, nb_events = _reference_run(_Plant(x0), condition, 150, .1, dt=dt)
+        assert_allclose(result['rewards'][i], reward)
+        assert result['nb_events'][i] == nb_events
+    assert 1 < np.max(result['nb_events']) < 150
+    # One batched actor call per step with at least one event.
+    assert result['nb_actor_calls'] <= 150
+
+
+def test_runtime_records_events_and_stops_finished_envs():
+    envs = [_Plant([1., -.5]), _Plant([2.9, 2.9], bound=3.)]
+    result = EventTriggeredRuntime(_actor, AbsoluteThreshold(.1), lam=0.).run(envs, 50, record=True)
+    states, events = result['states'], result['events']
+    assert states.shape[1:] == (2, 2) and events.shape[1:] == (2,)
+    assert_array_equal(events[0], [True, True])
+    assert_allclose(states[0], [[1., -.5], [2.9, 2.9]])
+    assert_array_equal(result['nb_events'], events.sum(axis=0))
+    # The second plant leaves the bound at once and is not stepped or triggered again.
+    assert not np.any(events[1:, 1])
+    assert_allclose(envs[1].state, states[1, 1])
+    assert result['nb_actor_calls'] == np.sum(np.any(events, axis=1))
+
+
+def test_runtime_continues_without_reset():
+    env = _Plant([1., -.5])
+    env.reset()
+    env.step(np.array([0.]))
+    state = env.state.copy()
+    result = EventTriggeredRuntime(_actor, AbsoluteThreshold(.1)).run([env], 1, reset=False, record=True)
+    assert_allclose(result['states'][0, 0], state)
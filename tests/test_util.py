@@ -0,0 +1,112 @@
+from __future__ import division
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from util import _gain, lqr, make_standup_agent
+
+
+class _Pendulum(object):
+    m, l, g = 1., 1., 10.
+
+
+class _Layer(object):
+    def __init__(self, name, units):
+        self.name = name
+        self.units = units
+
+    def get_config(self):
+        return {'name': self.name, 'units': self.units}
+
+    def get_weights(self):
+        return [np.zeros((2, self.units))]
+
+
+class _RecordingActor(object):
+    # Records the training calls; the weights are a single array saved with `np.save`.
+    def __init__(self, units=16, prefix='dense'):
+        self.layers = [_Layer(prefix + '_1', units), _Layer(prefix + '_2', 2)]
+        self.weights = np.random.randn(3)
+        self.calls = []
+
+    def compile(self, **kwargs):
+        self.calls.append('compile')
+
+    def fit(self, x, y, **kwargs):
+        self.calls.append('fit')
+        self.weights = self.weights + 1.
+
+    def save_weights(self, path):
+        with open(path, 'wb') as f:
+            np.save(f, self.weights)
+
+    def load_weights(self, path):
+        self.calls.append('load')
+        with open(path, 'rb') as f:
+            self.weights = np.load(f)
+
+
+def test_lqr_is_cached_by_value():
+    A = np.array([[0., 1.], [15., 0.]])
+    B = np.array([[0.], [3.]])
+    Q = np.diag([1., .1])
+    R = np.array([[.001]])
+    K = lqr(A, B, Q, R)
+    nb_cached = len(lqr.cache)
+    K[0, 0] = 0.
+    assert_allclose(lqr(A.copy(), B, Q, R), lqr(A, B, Q, R))
+    assert lqr(A, B, Q, R)[0, 0] != 0.
+    assert len(lqr.cache) == nb_cached
+    lqr(A, B, Q, 2 * R)
+    assert len(lqr.cache) == nb_cached + 1
+
+
+def test_gain_stabilizes_discretized_pendulum():
+    env = _Pendulum()
+    K = _gain(env, dt=.01)
+    A = np.array([[0, 1], [(3 * env.g) / (2 * env.l), 0]])
+    B = np.array([[0], [3 / (env.m * env.l ** 2)]])
+    Ad = np.eye(2) + .01 * (A + np.dot(B, K[None]))
+    assert np.max(np.abs(np.linalg.eigvals(Ad))) < 1.
+
+
+def test_standup_weights_are_cached(tmpdir):
+    cache_dir = str(tmpdir.join('standup'))
+    actor = _RecordingActor()
+    make_standup_agent(actor, .1, _Pendulum(), epochs=1, nb_samples=64, cache_dir=cache_dir)
+    assert actor.calls == ['compile', 'fit']
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Same architecture under other layer names: loaded, not retrained.
+    other = _RecordingActor(prefix='dense_7')
+    make_standup_agent(other, .1, _Pendulum(), epochs=1, nb_samples=64, cache_dir=cache_dir)
+    assert other.calls == ['compile', 'load']
+    assert_allclose(other.weights, actor.weights)
+
+    # Another interval or architecture is trained again.
+    make_standup_agent(_RecordingActor(), .2, _Pendulum(), epochs=1, nb_samples=64, cache_dir=cache_dir)
+    make_standup_agent(_RecordingActor(units=8), .1, _Pendulum(), epochs=1, nb_samples=64, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 3
+
+
+def test_standup_cache_round_trip_with_keras(tmpdir):
+    pytest.importorskip('tensorflow')
+    pytest.importorskip('h5py')
+    from keras2.layers import Dense, Flatten
+    from keras2.models import Sequential
+
+    def actor():
+        model = Sequential()
+        model.add(Flatten(input_shape=(1, 2)))
+        model.add(Dense(8, activation='relu'))
+        model.add(Dense(2))
+        return model
+
+    trained = make_standup_agent(actor(), .1, _Pendulum(), epochs=1, nb_samples=256, cache_dir=str(tmpdir))
+    loaded = make_standup_agent(actor(), .1, _Pendulum(), epochs=1, nb_samples=256, cache_dir=str(tmpdir))
+    for a, b in zip(loaded.get_weights(), trained.get_weights()):
+        assert_allclose(a, b)
+    x = np.random.randn(4, 1, 2)
+    assert_allclose(loaded.predict(x), trained.predict(x), rtol=1e-5)